@@ -7,6 +7,32 @@ import requests
 import yaml
 from livefs_edit import __main__  # noqa: F401
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from utils.build_cache import (
+    build_key,
+    file_digest,
+    prepare_output,
+    restore_artifact,
+    store_artifact,
+    tree_digest,
+    write_checksum,
+)
+from utils.build_pipeline import (
+    CONFIGS_PATH,
+    master_iso,
+    render_configs,
+    render_grub,
+    render_host_configs,
+    render_seed_configs,
+    render_seeds,
+    run_step,
+    stage_iso,
+)
+from utils.package_cache import (
+    PACKAGE_CACHE,
+    PACKAGE_LOCK_PATH,
+    resolve_packages,
+    write_package_lock,
+)
 from utils.utils_iso_automator import (
     ansible_playbook,
     process_server,
@@ -22,7 +48,17 @@ ISO_MODIFIED_PATH = f"{ISO_AUTOMATOR_PATH}/modified_image"
 ISO_IMAGE_NAME = ""
 KERNEL_FOLDER_NAME = ""
 ISO_BASE_PATH = f"{ISO_AUTOMATOR_PATH}/base_image"
+ISO_OUTPUT_PATH = f"{ISO_AUTOMATOR_PATH}/nginx/autoinstall.iso"
 ISO_IMAGE_VERSION = os.getenv("ISO_IMAGE_VERSION")
+# overlay: only the added files are written, on top of the mounted ISO. copy: copies the whole ISO content
+ISO_STAGING_MODE = os.getenv("ISO_STAGING_MODE", "copy")
+# replay: replaces the added files in the ISO with the packages. mkisofs: masters a new ISO from the staged content
+ISO_MASTERING_MODE = os.getenv("ISO_MASTERING_MODE", "mkisofs")
+# The per-host configs are served as NoCloud seeds by nginx instead of being part of the ISO
+ISO_SEED_MODE = os.getenv("ISO_SEED_MODE", "").lower() in ["true", "1", "yes"]
+ISO_SEEDS_PATH = f"{ISO_AUTOMATOR_PATH}/nginx/seeds"
+# ansible: runs the playbooks of /root/ansible. python: renders the configs and builds the ISO in process
+ISO_BUILD_ENGINE = os.getenv("ISO_BUILD_ENGINE", "ansible")
 # Default package and repository configurations
 DEFAULT_PACKAGES = {
     "apt": [
@@ -44,39 +80,74 @@ DEFAULT_PACKAGES = {
 }
 
 
-def add_configuration(content_servers):
-    consolidated_info = []
-    # Consolidate all the information
-    servers = os.environ.get("SERVERS", "")
-    if servers:
-        servers = servers.split(",")
-    for role in content_servers["servers"]:
-        for server in content_servers["servers"][role]:
-            if servers and (server not in servers):
-                continue
-            process_server(server, role, content_servers, consolidated_info)
+def _config_key(apt_key, consolidated_dic):
+    """
+    Returns the cache key of the final ISO: the ISO with the packages, the kernel and extra files, the data of the
+    per-host configs and the playbooks and templates that render them. In seed mode, the hosts are not part of the
+    ISO.
+    """
+    if consolidated_dic["seed_mode"]:
+        consolidated_dic = dict(consolidated_dic, host_list=[])
+    debs = sorted(
+        {
+            deb
+            for host in consolidated_dic["host_list"]
+            for deb in host.get("packages", {}).get("deb", [])
+        }
+    )
+    return build_key(
+        apt_key,
+        ISO_IMAGE_VERSION,
+        tree_digest(f"{ISO_AUTOMATOR_PATH}/{KERNEL_FOLDER_NAME}"),
+        tree_digest(f"{ISO_AUTOMATOR_PATH}/extra_files"),
+        tree_digest("/root/ansible"),
+        consolidated_dic,
+        {deb: tree_digest(deb) for deb in debs},
+    )
 
-    if not consolidated_info:
-        logging.error("There is no content in consolidated_info.")
-        exit(1)
 
-    # find a better way of passing non-server configuration to playbooks
-    dry_run_env = os.environ.get("DRY_RUN", "")
-    dry_run = dry_run_env.lower() in ["true", "1", "yes"]
-    consolidated_dic = {
-        "host_list": consolidated_info,
-        "manual_installation": (
-            True if "manual_installation" in content_servers else False
-        ),
-        "dry_run": dry_run,
-    }
+def _generate_seeds(consolidated_dic):
+    logging.info(f"Generates the NoCloud seed of every host in {ISO_SEEDS_PATH}")
+    if ISO_BUILD_ENGINE == "python":
+        error = run_step(
+            "Generates the NoCloud seeds",
+            render_seeds,
+            consolidated_dic,
+            ISO_IMAGE_VERSION,
+        )
+    else:
+        # The configs of the hosts are rendered in parallel, the playbook creates the rest of the seeds
+        error = run_step(
+            "Renders the configs of every seed",
+            render_seed_configs,
+            consolidated_dic,
+            ISO_IMAGE_VERSION,
+        )
+        if error == 0:
+            write_dict_to_ansible_vars("./ansible/seed/vars/vars.yml", consolidated_dic)
+            extra_args = f"iso_version={ISO_IMAGE_VERSION} image={ISO_IMAGE_NAME}"
+            error = ansible_playbook("./ansible/seed/seeds-playbook.yaml", extra_args)
+    if error != 0:
+        logging.error("Generates the NoCloud seeds failed.")
+        exit(error)
+
+
+def _build_with_ansible(consolidated_dic):
+    """
+    Builds the final ISO with the playbooks of /root/ansible.
+
+    Returns:
+        int: 0 if the ISO was built, the exit code of the failed playbook otherwise.
+    """
     logging.warning("Starting ansible playbook !")
-    logging.info("Mounts ubuntu .iso in /mnt and copies to /mnt/modified_content")
-    extra_args = f"image={ISO_IMAGE_NAME} kernel={KERNEL_FOLDER_NAME}"
+    logging.info(
+        f"Mounts ubuntu .iso in /mnt and stages it in /mnt/modified_content ({ISO_STAGING_MODE})"
+    )
+    extra_args = f"image={ISO_IMAGE_NAME} kernel={KERNEL_FOLDER_NAME} staging_mode={ISO_STAGING_MODE}"
     ansible_error = ansible_playbook("./ansible/iso/iso-playbook.yaml", extra_args)
     if ansible_error != 0:
         logging.error("Mounts failed.")
-        exit(ansible_error)
+        return ansible_error
 
     logging.info("Modifies grub.cfg to allow automatic installation")
     write_dict_to_ansible_vars("./ansible/grub/vars/vars.yml", consolidated_dic)
@@ -84,32 +155,163 @@ def add_configuration(content_servers):
     ansible_error = ansible_playbook("./ansible/grub/grub-playbook.yaml", extra_args)
     if ansible_error != 0:
         logging.error("Modifies grub.cfg failed.")
-        exit(ansible_error)
+        return ansible_error
 
     logging.info("Generates autoinstall.yml per host")
+    # The configs of the hosts are rendered in parallel, the playbook creates the rest of the configs of the ISO
+    if not consolidated_dic["seed_mode"]:
+        ansible_error = run_step(
+            "Renders the configs of every host",
+            render_host_configs,
+            consolidated_dic,
+            ISO_IMAGE_VERSION,
+            CONFIGS_PATH,
+        )
+        if ansible_error != 0:
+            logging.error("Generates autoinstall.yml failed.")
+            return ansible_error
     write_dict_to_ansible_vars("./ansible/seed/vars/vars.yml", consolidated_dic)
     ansible_error = ansible_playbook("./ansible/seed/preseed-playbook.yaml", extra_args)
     if ansible_error != 0:
         logging.error("Generates autoinstall.yml failed.")
-        exit(ansible_error)
+        return ansible_error
 
-    logging.info("Creates the autoinstall.iso in /etc/iso-automator/nginx")
+    logging.info(
+        f"Creates the autoinstall.iso in /etc/iso-automator/nginx ({ISO_MASTERING_MODE})"
+    )
     ansible_error = ansible_playbook(
-        "/root/ansible/mounting/mounting-playbook.yaml", extra_args
+        "/root/ansible/mounting/mounting-playbook.yaml",
+        f"{extra_args} mastering_mode={ISO_MASTERING_MODE}",
     )
     if ansible_error != 0:
         logging.error("Creates the autoinstall.iso failed.")
-        exit(ansible_error)
+    return ansible_error
+
+
+def _build_with_python(consolidated_dic):
+    """
+    Builds the final ISO in process: the templates are rendered from the host list in memory, with one Jinja
+    environment for all of them, instead of running a playbook for every step.
+
+    Returns:
+        int: 0 if the ISO was built, 1 otherwise.
+    """
+    steps = [
+        (
+            f"Mounts ubuntu .iso in /mnt and stages it in /mnt/modified_content ({ISO_STAGING_MODE})",
+            stage_iso,
+            ISO_IMAGE_NAME,
+            KERNEL_FOLDER_NAME,
+            ISO_STAGING_MODE,
+        ),
+        (
+            "Modifies grub.cfg to allow automatic installation",
+            render_grub,
+            consolidated_dic,
+            ISO_IMAGE_VERSION,
+        ),
+        (
+            "Generates autoinstall.yml per host",
+            render_configs,
+            consolidated_dic,
+            ISO_IMAGE_VERSION,
+        ),
+        (
+            f"Creates the autoinstall.iso in /etc/iso-automator/nginx ({ISO_MASTERING_MODE})",
+            master_iso,
+            ISO_IMAGE_NAME,
+            ISO_IMAGE_VERSION,
+            ISO_MASTERING_MODE,
+            ISO_OUTPUT_PATH,
+        ),
+    ]
+    for description, step, *args in steps:
+        logging.info(description)
+        error = run_step(description, step, *args)
+        if error != 0:
+            return error
+    return 0
+
+
+def add_configuration(content_servers, apt_key):
+    consolidated_info = []
+    # Consolidate all the information
+    servers = os.environ.get("SERVERS", "")
+    if servers:
+        servers = servers.split(",")
+    for role in content_servers["servers"]:
+        for server in content_servers["servers"][role]:
+            if servers and (server not in servers):
+                continue
+            process_server(server, role, content_servers, consolidated_info)
+
+    if not consolidated_info:
+        logging.error("There is no content in consolidated_info.")
+        exit(1)
+
+    # find a better way of passing non-server configuration to playbooks
+    dry_run_env = os.environ.get("DRY_RUN", "")
+    dry_run = dry_run_env.lower() in ["true", "1", "yes"]
+    manual_installation = "manual_installation" in content_servers
+    seed_mode = ISO_SEED_MODE
+    if seed_mode and manual_installation:
+        logging.warning(
+            "The seed mode is not supported with manual_installation, the configs are part of the ISO."
+        )
+        seed_mode = False
+    if seed_mode:
+        for host in consolidated_info:
+            if "serial" not in (host.get("management") or {}):
+                logging.warning(
+                    f"Host {host['hostname']} has no management.serial, its seed is named after its hostname and the "
+                    "installer, which downloads it by serial number, won't find it."
+                )
+    consolidated_dic = {
+        "host_list": consolidated_info,
+        "manual_installation": manual_installation,
+        "dry_run": dry_run,
+        "seed_mode": seed_mode,
+        "configs_path": "/run/ws-auto/configs"
+        if seed_mode
+        else "/cdrom/ws-auto/configs",
+        "seeds_path": ISO_SEEDS_PATH,
+        "seeds_url": f"{os.environ.get('SERVER_URL')}/seeds",
+    }
+    config_key = _config_key(apt_key, consolidated_dic)
+    if restore_artifact("config", config_key, ISO_OUTPUT_PATH):
+        write_checksum(ISO_OUTPUT_PATH)
+        if seed_mode:
+            _generate_seeds(consolidated_dic)
+        return consolidated_info
+    prepare_output(ISO_OUTPUT_PATH)
+    prepare_output(f"{ISO_OUTPUT_PATH}.sha256")
+
+    if ISO_BUILD_ENGINE == "python":
+        error = _build_with_python(consolidated_dic)
+    else:
+        error = _build_with_ansible(consolidated_dic)
+    if error != 0:
+        exit(error)
+    store_artifact("config", config_key, ISO_OUTPUT_PATH)
+    write_checksum(ISO_OUTPUT_PATH)
+    if seed_mode:
+        _generate_seeds(consolidated_dic)
     return consolidated_info
 
 
 def generate_iso_with_config(content_servers):
-    generate_iso_with_apt(content_servers)
-    consolidated_info = add_configuration(content_servers)
+    apt_key = generate_iso_with_apt(content_servers)
+    consolidated_info = add_configuration(content_servers, apt_key)
     return consolidated_info
 
 
 def generate_iso_with_apt(content_servers):
+    """
+    Adds the packages to the base ISO with livefs_edit, unless the ISO of a previous build has the same inputs.
+
+    Returns:
+        str: The cache key of the ISO with the packages.
+    """
     iso_livefs_input = f"{ISO_BASE_PATH}/{ISO_IMAGE_NAME}"
     iso_livefs_output = f"{ISO_MODIFIED_PATH}/{ISO_IMAGE_NAME}"
 
@@ -119,16 +321,25 @@ def generate_iso_with_apt(content_servers):
     # User configuration from servers.yml
     user_packages = content_servers["configuration"]["default"]["packages"]
     # Prepare data for the template
-    data = dict()
-    for key, value in DEFAULT_PACKAGES.items():
-        packages = []
-        if user_packages.get("use_default_packages", True):
-            packages = value
-        data[key + "_list"] = list(set(packages + user_packages.get(key, [])))
+    data = resolve_packages(DEFAULT_PACKAGES, user_packages)
 
+    # The package cache is made of livefs_edit actions, registered by utils.package_cache
+    data["package_cache"] = PACKAGE_CACHE
     logging.info("Generating config.j2 for livefs_editor")
     render_jinja_template("/root/templates/config.j2", "/root/config.yaml", data)
 
+    apt_key = build_key(
+        file_digest(iso_livefs_input),
+        file_digest("/root/config.yaml"),
+        tree_digest("/root/config-files"),
+    )
+    if restore_artifact("apt", apt_key, iso_livefs_output):
+        if not restore_artifact("lock", apt_key, PACKAGE_LOCK_PATH):
+            write_package_lock(data)
+        return apt_key
+    prepare_output(iso_livefs_output)
+    write_package_lock(data)
+
     try:
         livefs_edit.__main__.main(
             [iso_livefs_input, iso_livefs_output, "--action-yaml", "config.yaml"]
@@ -136,6 +347,9 @@ def generate_iso_with_apt(content_servers):
     except Exception as error:
         logging.error(f"Error executing livefs-edit: {error}")
         exit(1)
+    store_artifact("apt", apt_key, iso_livefs_output)
+    store_artifact("lock", apt_key, PACKAGE_LOCK_PATH)
+    return apt_key
 
 
 def main():
@@ -19,6 +19,9 @@ iso_ip=$(echo $SERVER_URL | cut -d '"' -f 2 | cut -d '/' -f 3 | cut -d ':' -f 1)
 #reemplazar por la ip del servidor
 sed -i "s/ISO_IP/$iso_ip/g" /root/nginx-cert/nginx.conf
 
+#limite de bytes por segundo de cada descarga del iso, 0 sin limite
+sed -i "s/ISO_RATE_LIMIT/${ISO_RATE_LIMIT:-0}/g" /root/nginx-cert/nginx.conf
+
 cat /root/nginx-cert/nginx.conf
 
 cp /root/nginx-cert/nginx.conf "${CERT_DIR}/nginx.conf"
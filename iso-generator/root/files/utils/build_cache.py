@@ -0,0 +1,153 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+# Directory where the artifacts of the previous builds are kept, in the same filesystem as the outputs
+BUILD_CACHE_PATH = os.getenv("BUILD_CACHE_PATH", "/etc/iso-automator/cache")
+# Reuses the artifacts of the previous builds whose inputs are unchanged
+BUILD_CACHE = os.getenv("BUILD_CACHE", "true").lower() in ["true", "1", "yes"]
+# Artifacts kept per stage, the least recently used ones are removed
+BUILD_CACHE_ENTRIES = int(os.getenv("BUILD_CACHE_ENTRIES", "2"))
+
+FINGERPRINTS_FILE = "fingerprints.json"
+CHUNK_SIZE = 1024 * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def _load_fingerprints():
+    try:
+        with open(os.path.join(BUILD_CACHE_PATH, FINGERPRINTS_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_fingerprints():
+    os.makedirs(BUILD_CACHE_PATH, exist_ok=True)
+    with open(os.path.join(BUILD_CACHE_PATH, FINGERPRINTS_FILE), "w") as file:
+        json.dump(_load_fingerprints(), file)
+
+
+def _file_digest(path):
+    fingerprints = _load_fingerprints()
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    fingerprint = fingerprints.get(path)
+    if fingerprint and fingerprint[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return fingerprint[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    fingerprints[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """
+    Returns the SHA-256 of a file. The digest is remembered with the size and modification time of the file, so big
+    files like the base ISO are only read again when they change.
+    """
+    digest = _file_digest(path)
+    if BUILD_CACHE:
+        _save_fingerprints()
+    return digest
+
+
+def tree_digest(path):
+    """
+    Returns a digest of the names and contents of all the files under a directory, or of a single file. A missing
+    path has a digest too, so that creating it changes the digest.
+    """
+    if os.path.isfile(path):
+        return file_digest(path)
+    digest = hashlib.sha256()
+    for root, directories, files in os.walk(path):
+        directories.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            digest.update(_file_digest(file_path).encode())
+    if BUILD_CACHE:
+        _save_fingerprints()
+    return digest.hexdigest()
+
+
+def build_key(*inputs):
+    """
+    Returns the cache key of a stage from its inputs (digests, settings, the data of the templates...).
+    """
+    data = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _artifact_path(stage, key):
+    return os.path.join(BUILD_CACHE_PATH, stage, key)
+
+
+def _link(source, destination):
+    prepare_output(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def prepare_output(path):
+    """
+    Removes the previous output of a stage before it is built again. The output can be a hard link to a cached
+    artifact, which must not be overwritten in place.
+    """
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def restore_artifact(stage, key, destination):
+    """
+    Puts the cached artifact of a stage in its destination, if there is one for the key.
+
+    Returns:
+        bool: True if the artifact was restored and the stage can be skipped.
+    """
+    artifact = _artifact_path(stage, key)
+    if not BUILD_CACHE or not os.path.isfile(artifact):
+        return False
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    _link(artifact, destination)
+    # The modification time orders the artifacts by last use
+    os.utime(artifact)
+    logging.info(f"Inputs of the {stage} stage unchanged, reusing {artifact}")
+    return True
+
+
+def store_artifact(stage, key, source):
+    """
+    Keeps the output of a stage in the cache, and removes the least recently used artifacts of the stage.
+    """
+    if not BUILD_CACHE:
+        return
+    stage_path = os.path.join(BUILD_CACHE_PATH, stage)
+    os.makedirs(stage_path, exist_ok=True)
+    _link(source, _artifact_path(stage, key))
+    artifacts = sorted(
+        (os.path.join(stage_path, name) for name in os.listdir(stage_path)),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for artifact in artifacts[BUILD_CACHE_ENTRIES:]:
+        logging.info(f"Removing the cached artifact {artifact}")
+        os.remove(artifact)
+
+
+def write_checksum(path):
+    """
+    Writes the SHA-256 of a file next to it, in path.sha256 (sha256sum format), so its downloads can be verified.
+    The sidecar is replaced at once, it is never read half written.
+    """
+    with open(f"{path}.sha256.tmp", "w") as file:
+        file.write(f"{file_digest(path)}  {os.path.basename(path)}\n")
+    os.replace(f"{path}.sha256.tmp", f"{path}.sha256")
@@ -0,0 +1,504 @@
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from subprocess import DEVNULL, run
+from utils.utils_iso_automator import jinja_environment
+
+ANSIBLE_PATH = "/root/ansible"
+ISO_AUTOMATOR_PATH = "/etc/iso-automator"
+BASE_CONTENT_PATH = "/mnt/base_content"
+MODIFIED_CONTENT_PATH = "/mnt/modified_content"
+CONFIGS_PATH = f"{MODIFIED_CONTENT_PATH}/ws-auto/configs"
+OVERLAY_PATH = "/overlay"
+SUPPORTED_VERSIONS = ("ubuntu-20", "ubuntu-22")
+# Processes rendering the configs of the hosts
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+# Data of the templates, set once in every rendering process
+_render_data = {}
+
+
+def _get_template(template):
+    # Renders like the template module of ansible
+    return jinja_environment(ANSIBLE_PATH, trim_blocks=True).get_template(template)
+
+
+def render(template, destination, context, mode=None):
+    """
+    Renders a template of the ansible folder (e.g. seed/template/deploy.sh.j2) in the destination file.
+    """
+    content = _get_template(template).render(context)
+    with open(destination, "w") as file:
+        file.write(content)
+    if mode is not None:
+        os.chmod(destination, mode)
+
+
+def _run(cmd, **kwargs):
+    logging.debug(f"Running {' '.join(cmd)}")
+    return run(cmd, check=True, **kwargs)
+
+
+def _umount(path):
+    # Fails if the path is not mounted
+    run(["umount", path], stdout=DEVNULL, stderr=DEVNULL)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def host_dir(host):
+    """
+    Returns the name of the config directory of a host: its serial number, or its hostname if it has no serial.
+    """
+    management = host.get("management") or {}
+    return str(management["serial"]) if "serial" in management else host["hostname"]
+
+
+def stage_iso(image, kernel, staging_mode):
+    """
+    Stages the ISO with the packages in /mnt/modified_content, in an overlay or as a full copy, and adds the
+    repository, kernel and extra files to ws-auto (ansible/iso/iso-playbook.yaml).
+    """
+    image_path = f"{ISO_AUTOMATOR_PATH}/modified_image/{image}"
+    if not os.path.isfile(image_path):
+        raise Exception(f"Ubuntu image iso {image_path} doesn't exist")
+
+    _umount(MODIFIED_CONTENT_PATH)
+    for path in (
+        MODIFIED_CONTENT_PATH,
+        f"{OVERLAY_PATH}/upper",
+        f"{OVERLAY_PATH}/work",
+    ):
+        _remove(path)
+    _umount(BASE_CONTENT_PATH)
+    os.makedirs(BASE_CONTENT_PATH, exist_ok=True)
+    _run(["mount", "-o", "loop", image_path, BASE_CONTENT_PATH])
+
+    staged = False
+    if staging_mode == "overlay":
+        for path in (
+            MODIFIED_CONTENT_PATH,
+            f"{OVERLAY_PATH}/upper",
+            f"{OVERLAY_PATH}/work",
+        ):
+            os.makedirs(path, exist_ok=True)
+        options = (
+            f"lowerdir={BASE_CONTENT_PATH},upperdir={OVERLAY_PATH}/upper,"
+            f"workdir={OVERLAY_PATH}/work"
+        )
+        mount = run(
+            ["mount", "-t", "overlay", "overlay", "-o", options, MODIFIED_CONTENT_PATH]
+        )
+        staged = mount.returncode == 0
+        if not staged:
+            logging.warning("Unable to mount the overlay, copying the .iso content")
+    if not staged:
+        _run(["cp", "-rT", BASE_CONTENT_PATH, MODIFIED_CONTENT_PATH])
+        _umount(BASE_CONTENT_PATH)
+
+    repository_path = f"{MODIFIED_CONTENT_PATH}/ws-auto/repository"
+    os.makedirs(repository_path, exist_ok=True)
+    shutil.copytree(
+        f"{ANSIBLE_PATH}/iso/files",
+        f"{MODIFIED_CONTENT_PATH}/ws-auto",
+        dirs_exist_ok=True,
+    )
+    shutil.copytree(
+        f"{ISO_AUTOMATOR_PATH}/{kernel}",
+        f"{repository_path}/{kernel}",
+        dirs_exist_ok=True,
+    )
+    try:
+        shutil.copytree(
+            f"{ISO_AUTOMATOR_PATH}/extra_files",
+            f"{repository_path}/extra_files",
+            dirs_exist_ok=True,
+        )
+    except OSError as error:
+        logging.warning(f"Extra files not copied: {error}")
+
+
+def render_grub(data, iso_version):
+    """
+    Renders the grub.cfg of the ISO (ansible/grub/grub-playbook.yaml).
+    """
+    if iso_version not in SUPPORTED_VERSIONS:
+        return
+    render(
+        f"grub/template/grub-{iso_version}.j2",
+        f"{MODIFIED_CONTENT_PATH}/boot/grub/grub.cfg",
+        dict(data, iso_version=iso_version),
+        mode=0o600,
+    )
+
+
+def _deb_path(deb):
+    # Relative paths are looked up like the copy module of ansible
+    for path in (f"{ANSIBLE_PATH}/seed/files", f"{ANSIBLE_PATH}/seed"):
+        if os.path.exists(os.path.join(path, deb)):
+            return os.path.join(path, deb)
+    return deb
+
+
+def _host_templates(data, iso_version, host):
+    """
+    Returns:
+        dict: The template of every config file of a host.
+    """
+    templates = {}
+    if iso_version in SUPPORTED_VERSIONS:
+        name = "user-data" if data["manual_installation"] else "autoinstall.yaml"
+        templates[name] = f"seed/template/autoinstall-{iso_version}.j2"
+    templates["netplan_generator.sh"] = "seed/template/netplan_generator.sh.j2"
+    templates["deploy.sh"] = "seed/template/deploy.sh.j2"
+    if "management" in host:
+        templates["hp_user.xml"] = "seed/template/hp_user.xml.j2"
+    return templates
+
+
+def _init_render(data, iso_version):
+    _render_data.update(data=data, iso_version=iso_version)
+
+
+def _render_host(host):
+    """
+    Renders the config files of a host, in the process that has the data of the templates.
+
+    Returns:
+        tuple: The hostname, the content of every config file and the rendering time.
+    """
+    start_time = time.time()
+    data, iso_version = _render_data["data"], _render_data["iso_version"]
+    context = dict(data, iso_version=iso_version, item=host)
+    contents = {
+        name: _get_template(template).render(context)
+        for name, template in _host_templates(data, iso_version, host).items()
+    }
+    return host["hostname"], contents, time.time() - start_time
+
+
+def _render_hosts(data, iso_version):
+    """
+    Renders the config files of all the hosts, across RENDER_WORKERS processes when there are many hosts.
+
+    Returns:
+        list: The hostname, the content of every config file and the rendering time of each host.
+    """
+    hosts = data["host_list"]
+    # Compiled before the processes are started, which inherit them or load them from the bytecode cache
+    for host in hosts:
+        for template in _host_templates(data, iso_version, host).values():
+            _get_template(template)
+
+    workers = min(RENDER_WORKERS, len(hosts))
+    if workers <= 1:
+        _init_render(data, iso_version)
+        return [_render_host(host) for host in hosts]
+    # The data is sent once to every process, and only the host to each task
+    data = dict(data, host_list=[])
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_render, initargs=(data, iso_version)
+    ) as executor:
+        chunksize = max(1, len(hosts) // (workers * 4))
+        return list(executor.map(_render_host, hosts, chunksize=chunksize))
+
+
+def _write_files(contents):
+    """
+    Writes all the rendered files in one pass, creating every directory once.
+    """
+    for directory in sorted({os.path.dirname(path) for path in contents}):
+        os.makedirs(directory, exist_ok=True)
+    for path, content in contents.items():
+        with open(path, "w") as file:
+            file.write(content)
+
+
+def render_host_configs(data, iso_version, host_configs_path):
+    """
+    Renders the configs of every host in host_configs_path/<serial or hostname>. Used by both build engines, the
+    playbooks don't render the per-host configs.
+    """
+    start_time = time.time()
+    contents = {}
+    for host, (hostname, host_contents, render_time) in zip(
+        data["host_list"], _render_hosts(data, iso_version)
+    ):
+        logging.info(f"Configs of {hostname} rendered in {render_time:.3f} secs")
+        host_path = os.path.join(host_configs_path, host_dir(host))
+        contents.update(
+            {
+                os.path.join(host_path, name): content
+                for name, content in host_contents.items()
+            }
+        )
+    _write_files(contents)
+
+    for host in data["host_list"]:
+        debs = (host.get("packages") or {}).get("deb") or []
+        debs_path = os.path.join(host_configs_path, host_dir(host), "debs")
+        if debs:
+            os.makedirs(debs_path, exist_ok=True)
+        for deb in debs:
+            shutil.copy(_deb_path(deb), debs_path)
+    logging.info(
+        f"Configs of {len(data['host_list'])} hosts rendered in {time.time() - start_time} secs"
+    )
+
+
+def render_configs(data, iso_version):
+    """
+    Renders the configs of the ISO in ws-auto/configs (ansible/seed/preseed-playbook.yaml).
+    """
+    os.makedirs(CONFIGS_PATH, exist_ok=True)
+    # In seed mode the per-host configs are not part of the iso, they are created by render_seeds
+    if not data["seed_mode"]:
+        render_host_configs(data, iso_version, CONFIGS_PATH)
+
+    context = dict(data, iso_version=iso_version)
+    if data["manual_installation"]:
+        for host in data["host_list"]:
+            os.makedirs(os.path.join(CONFIGS_PATH, host["hostname"]), exist_ok=True)
+            open(os.path.join(CONFIGS_PATH, host["hostname"], "meta-data"), "a").close()
+    else:
+        open(os.path.join(CONFIGS_PATH, "meta-data"), "a").close()
+        if not data["dry_run"]:
+            render(
+                "seed/template/user-data.j2",
+                os.path.join(CONFIGS_PATH, "user-data"),
+                context,
+            )
+    if data["dry_run"]:
+        render(
+            "seed/template/dry-run-user-data.j2",
+            os.path.join(CONFIGS_PATH, "user-data"),
+            context,
+        )
+
+    shutil.copy(f"{ANSIBLE_PATH}/seed/files/clean.py", CONFIGS_PATH)
+    for name in sorted(os.listdir(f"{ANSIBLE_PATH}/seed/files")):
+        if name.endswith(".py"):
+            shutil.copy(
+                f"{ANSIBLE_PATH}/seed/files/{name}",
+                f"{MODIFIED_CONTENT_PATH}/ws-auto/repository/",
+            )
+    shutil.copytree(CONFIGS_PATH, f"{ISO_AUTOMATOR_PATH}/debug", dirs_exist_ok=True)
+
+
+def render_seed_configs(data, iso_version):
+    """
+    Renders the configs of every host in its seed directory, replacing its previous seed.
+    """
+    seeds_path = data["seeds_path"]
+    # Only the seeds of these hosts, the rest of the seeds can be in use by a running rollout
+    for host in data["host_list"]:
+        _remove(os.path.join(seeds_path, host_dir(host)))
+        _remove(os.path.join(seeds_path, f"{host_dir(host)}.iso"))
+    render_host_configs(data, iso_version, seeds_path)
+
+
+def render_seeds(data, iso_version):
+    """
+    Renders the NoCloud seed of every host, as a directory and as a CIDATA image
+    (ansible/seed/seeds-playbook.yaml).
+    """
+    seeds_path = data["seeds_path"]
+    render_seed_configs(data, iso_version)
+
+    # Read by cloud-init when the seed is attached, so it mounts the CIDATA volume instead of downloading the seed
+    context = dict(data, iso_version=iso_version, seed_source="cidata")
+    user_data = "dry-run-user-data.j2" if data["dry_run"] else "user-data.j2"
+    for host in data["host_list"]:
+        host_path = os.path.join(seeds_path, host_dir(host))
+        open(os.path.join(host_path, "meta-data"), "w").close()
+        render(
+            f"seed/template/{user_data}", os.path.join(host_path, "user-data"), context
+        )
+        _run(
+            [
+                "xorriso",
+                "-as",
+                "mkisofs",
+                "-r",
+                "-J",
+                "-V",
+                "CIDATA",
+                "-o",
+                f"{host_path}.iso",
+                host_path,
+            ],
+            stdout=DEVNULL,
+            stderr=DEVNULL,
+        )
+    shutil.copytree(seeds_path, f"{ISO_AUTOMATOR_PATH}/debug", dirs_exist_ok=True)
+
+
+def _replay_iso(image, output):
+    """
+    Replays the boot setup of the ISO with the packages and replaces the added files, the rest of the content is
+    streamed from the input ISO.
+    """
+    added = ["/ws-auto", "/boot/grub/grub.cfg"]
+    cmd = [
+        "xorriso",
+        "-indev",
+        f"{ISO_AUTOMATOR_PATH}/modified_image/{image}",
+        "-outdev",
+        output,
+        "-volid",
+        "ATTENDLESS_UBUNTU",
+        "-map",
+        f"{MODIFIED_CONTENT_PATH}/ws-auto",
+        "/ws-auto",
+        "-map",
+        f"{MODIFIED_CONTENT_PATH}/boot/grub/grub.cfg",
+        "/boot/grub/grub.cfg",
+    ]
+    cmd += ["-chmod_r", "a+r,a-w", *added, "--"]
+    cmd += ["-chown_r", "0", *added, "--"]
+    cmd += ["-chgrp_r", "0", *added, "--"]
+    cmd += ["-boot_image", "any", "replay"]
+    return run(cmd).returncode == 0
+
+
+def _search(pattern, text, group=1):
+    match = re.search(pattern, text)
+    if not match:
+        raise Exception(f"Boot parameter {pattern} not found in the base image")
+    return match.group(group)
+
+
+def _master_iso(image, iso_version, output):
+    """
+    Masters a new ISO from /mnt/modified_content.
+    """
+    if iso_version == "ubuntu-20":
+        _run(
+            [
+                "xorriso",
+                "-as",
+                "mkisofs",
+                "-r",
+                "-V",
+                "ATTENDLESS_UBUNTU",
+                "-cache-inodes",
+                "-J",
+                "-l",
+                "-b",
+                "isolinux/isolinux.bin",
+                "-c",
+                "isolinux/boot.cat",
+                "-b",
+                "isolinux/isolinux.bin",
+                "-no-emul-boot",
+                "-boot-load-size",
+                "4",
+                "-boot-info-table",
+                "-eltorito-alt-boot",
+                "-e",
+                "boot/grub/efi.img",
+                "-no-emul-boot",
+                "-isohybrid-gpt-basdat",
+                "-o",
+                output,
+                MODIFIED_CONTENT_PATH,
+            ],
+            cwd=f"{ANSIBLE_PATH}/mounting",
+        )
+    elif iso_version == "ubuntu-22":
+        report = _run(
+            ["xorriso", "-indev", image, "-report_el_torito", "as_mkisofs"],
+            cwd=f"{ISO_AUTOMATOR_PATH}/base_image",
+            capture_output=True,
+            text=True,
+        ).stdout
+        _run(
+            [
+                "xorriso",
+                "-as",
+                "mkisofs",
+                "-r",
+                "-V",
+                "ATTENDLESS_UBUNTU",
+                "--grub2-mbr",
+                "files/1-Boot-NoEmul.img",
+                "-partition_offset",
+                "16",
+                "--mbr-force-bootable",
+                "-append_partition",
+                "2",
+                _search(r"-append_partition 2 (\w+)", report),
+                "files/2-Boot-NoEmul.img",
+                "-appended_part_as_gpt",
+                "-iso_mbr_part_type",
+                _search(r"-iso_mbr_part_type (\w+)", report),
+                "-c",
+                _search(r"-c '/([^']*)'", report),
+                "-b",
+                _search(r"-b '/([^']*)'", report),
+                "-no-emul-boot",
+                "-boot-load-size",
+                "4",
+                "-boot-info-table",
+                "--grub2-boot-info",
+                "-eltorito-alt-boot",
+                "-e",
+                _search(
+                    r"--interval:appended_partition_2_start_\d+s_size_\d+d:all::",
+                    report,
+                    0,
+                ),
+                "-no-emul-boot",
+                "-o",
+                output,
+                MODIFIED_CONTENT_PATH,
+            ],
+            cwd=f"{ANSIBLE_PATH}/mounting",
+        )
+
+
+def master_iso(image, iso_version, mastering_mode, output):
+    """
+    Writes the final ISO, unmounts the staged content and removes the ISO with the packages
+    (ansible/mounting/mounting-playbook.yaml).
+    """
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    replayed = mastering_mode == "replay" and _replay_iso(image, output)
+    if not replayed:
+        if mastering_mode == "replay":
+            logging.warning("Unable to replay the iso, mastering a new one")
+        _remove(output)
+        _master_iso(image, iso_version, output)
+    os.chmod(output, 0o755)
+
+    # Only mounted when the .iso content is staged in an overlay
+    _umount(MODIFIED_CONTENT_PATH)
+    _umount(BASE_CONTENT_PATH)
+    _remove(f"{ISO_AUTOMATOR_PATH}/modified_image")
+    _remove(f"{OVERLAY_PATH}/upper")
+    _remove(f"{OVERLAY_PATH}/work")
+
+
+def run_step(description, step, *args):
+    """
+    Runs a step of the build and logs its duration.
+
+    Returns:
+        int: 0 if the step succeeded, 1 otherwise.
+    """
+    start_time = time.time()
+    try:
+        step(*args)
+    except Exception as error:
+        logging.error(f"{description} failed: {error}")
+        return 1
+    logging.info(f"{description} done in {time.time() - start_time} secs")
+    return 0
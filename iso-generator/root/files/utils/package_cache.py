@@ -0,0 +1,335 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from typing import List
+from urllib.parse import unquote
+
+import yaml
+
+from livefs_edit.actions import (
+    add_debs_to_pool,
+    cache_for_dir,
+    get_squash_names,
+    register_action,
+)
+from utils.build_cache import build_key
+
+# Directory where the downloaded .debs and python packages are kept between builds
+PACKAGE_CACHE_PATH = os.getenv("PACKAGE_CACHE_PATH", "/etc/iso-automator/packages")
+# Adds the packages from the cache, only the missing ones are downloaded
+PACKAGE_CACHE = os.getenv("PACKAGE_CACHE", "true").lower() in ["true", "1", "yes"]
+# Maximum size of the cache in MB, the least recently used packages are removed
+PACKAGE_CACHE_SIZE = int(os.getenv("PACKAGE_CACHE_SIZE", "10240"))
+# Seconds a resolved package list is reused before the mirrors are queried again
+PACKAGE_CACHE_TTL = int(os.getenv("PACKAGE_CACHE_TTL", "86400"))
+
+# Packages requested for the ISO and the versions they were resolved to
+PACKAGE_LOCK_PATH = os.getenv("PACKAGE_LOCK_PATH", "/etc/iso-automator/packages.lock")
+
+CHUNK_SIZE = 1024 * 1024
+# Directory of the installer filesystem where the python packages are staged
+PIP_STAGING_PATH = "/tmp/ws-auto-pip"
+
+
+def _normalize(kind, package):
+    """
+    Returns the canonical form of a requested package: without extra whitespace, and with the lowercase name of apt
+    packages and the normalized name (PEP 503) of python packages.
+    """
+    package = " ".join(str(package).split())
+    if kind == "apt":
+        name, separator, version = package.partition("=")
+        return f"{name.lower()}{separator}{version}"
+    if kind == "pip":
+        name = re.match(r"[A-Za-z0-9._-]*", package).group(0)
+        return re.sub(r"[-_.]+", "-", name).lower() + package[len(name) :]
+    return package
+
+
+def resolve_packages(default_packages, user_packages):
+    """
+    Resolves the package lists of the ISO: the default packages (unless use_default_packages is false) and the
+    packages of servers.yml, normalized, without duplicates and sorted, so the same inputs always render the same
+    config.yaml.
+
+    Returns:
+        dict: The apt_list, pip_list, deb_list and repositories_list.
+    """
+    data = {}
+    for key, value in default_packages.items():
+        packages = []
+        if user_packages.get("use_default_packages", True):
+            packages = value
+        data[key + "_list"] = sorted(
+            {
+                _normalize(key, package)
+                for package in packages + user_packages.get(key, [])
+            }
+        )
+    return data
+
+
+def _write_lock(lock):
+    # Replaces the file, which can be a hard link to the lock of a cached build
+    with open(f"{PACKAGE_LOCK_PATH}.tmp", "w") as file:
+        yaml.safe_dump(lock, file, default_flow_style=False)
+    os.replace(f"{PACKAGE_LOCK_PATH}.tmp", PACKAGE_LOCK_PATH)
+
+
+def write_package_lock(data):
+    """
+    Writes the lock manifest of the requested packages. The versions they are resolved to are added by the actions
+    of the package cache.
+    """
+    requested = {
+        key: data[f"{key}_list"] for key in ("apt", "pip", "deb", "repositories")
+    }
+    _write_lock({"requested": requested, "resolved": {}})
+
+
+def _package_version(kind, filename):
+    if kind == "apt":
+        # name_version_arch.deb, the epoch of the version is quoted
+        name, version = filename.split("_")[:2]
+        return name, unquote(version)
+    if filename.endswith(".whl"):
+        # name-version-...whl, the name of a wheel has no dashes
+        name, version = filename.split("-")[:2]
+    else:
+        # name-version.tar.gz or name-version.zip
+        name, version = re.sub(r"(\.tar\.gz|\.zip)$", "", filename).rsplit("-", 1)
+    return re.sub(r"[-_.]+", "-", name).lower(), version
+
+
+def _lock_versions(kind, paths):
+    """
+    Adds the versions of the packages of the ISO to the lock manifest, if there is one.
+    """
+    try:
+        with open(PACKAGE_LOCK_PATH) as file:
+            lock = yaml.safe_load(file)
+    except OSError:
+        return
+    lock["resolved"][kind] = dict(
+        sorted(_package_version(kind, os.path.basename(path)) for path in paths)
+    )
+    _write_lock(lock)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_path(kind, sha256, filename):
+    return os.path.join(PACKAGE_CACHE_PATH, kind, sha256, filename)
+
+
+def _lookup(kind, sha256, filename):
+    """
+    Returns:
+        str: The path of the cached package, None if it is not in the cache.
+    """
+    path = _entry_path(kind, sha256, filename)
+    if not os.path.isfile(path):
+        return None
+    # The modification time orders the packages by last use
+    os.utime(os.path.dirname(path))
+    return path
+
+
+def _store(kind, source):
+    """
+    Adds a package to the cache, addressed by its SHA-256, so the same file is only stored once.
+
+    Returns:
+        str: The path of the cached package.
+    """
+    filename = os.path.basename(source)
+    sha256 = _sha256(source)
+    path = _lookup(kind, sha256, filename)
+    if path:
+        return path
+    path = _entry_path(kind, sha256, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.copy2(source, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def _evict():
+    """
+    Removes the least recently used packages until the cache fits in PACKAGE_CACHE_SIZE.
+    """
+    entries = []
+    for kind in ("debs", "pip"):
+        kind_path = os.path.join(PACKAGE_CACHE_PATH, kind)
+        if not os.path.isdir(kind_path):
+            continue
+        for name in os.listdir(kind_path):
+            entry = os.path.join(kind_path, name)
+            size = sum(
+                os.path.getsize(os.path.join(entry, filename))
+                for filename in os.listdir(entry)
+            )
+            entries.append((os.path.getmtime(entry), size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= PACKAGE_CACHE_SIZE * 1024 * 1024:
+            break
+        logging.info(f"Removing the cached package {entry}")
+        shutil.rmtree(entry)
+        total -= size
+
+
+def _resolution_key(ctxt, kind, packages):
+    """
+    Returns the key of a package list for the ISO: the packages that are resolved from the list depend on the release
+    and architecture of the ISO.
+    """
+    with open(ctxt.p("old/iso/.disk/info")) as file:
+        disk_info = file.read()
+    return build_key(kind, sorted(packages), disk_info, ctxt.get_arch())
+
+
+def _resolution_path(key):
+    return os.path.join(PACKAGE_CACHE_PATH, "resolutions", f"{key}.json")
+
+
+def _load_resolution(kind, key):
+    """
+    Returns:
+        list: The cached packages a package list was resolved to, None if the resolution expired or any of its
+        packages is no longer in the cache.
+    """
+    try:
+        with open(_resolution_path(key)) as file:
+            resolution = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if resolution["expires"] < time.time():
+        return None
+    paths = [
+        _lookup(kind, sha256, filename) for sha256, filename in resolution["files"]
+    ]
+    if None in paths:
+        return None
+    return paths
+
+
+def _save_resolution(key, paths):
+    os.makedirs(os.path.dirname(_resolution_path(key)), exist_ok=True)
+    files = [
+        [os.path.basename(os.path.dirname(path)), os.path.basename(path)]
+        for path in paths
+    ]
+    with open(_resolution_path(key), "w") as file:
+        json.dump({"files": files, "expires": time.time() + PACKAGE_CACHE_TTL}, file)
+
+
+def _resolve_debs(ctxt, packages):
+    """
+    Resolves the packages and their dependencies with the apt sources of the ISO, like add-packages-to-pool, and
+    downloads the .debs that are neither in the pool of the ISO nor in the cache.
+
+    Returns:
+        list: The cached .debs to add to the pool.
+    """
+    # pylint: disable=import-outside-toplevel
+    from apt.progress.text import AcquireProgress
+
+    squash = ctxt.mount_squash(get_squash_names(ctxt)[0])
+    overlay = ctxt.add_overlay(squash, ctxt.tmpdir())
+    cache = cache_for_dir(ctxt, overlay.p())
+    with ctxt.logged("** updating apt lists... **", "** updating apt lists done **"):
+        cache.update(AcquireProgress())
+    cache.open()
+    for package in packages:
+        with ctxt.logged(f"marking {package} for installation"):
+            if "=" in package:
+                package_name, package_version = package.split("=")
+                candidate = cache[package_name]
+                candidate.candidate = candidate.versions.get(package_version)
+                candidate.mark_install()
+            else:
+                cache[package].mark_install()
+
+    pool_debs = set()
+    for _, _, filenames in os.walk(ctxt.p("new/iso/pool")):
+        pool_debs.update(name for name in filenames if name.endswith(".deb"))
+    tmpdir = ctxt.tmpdir()
+    debs = []
+    for change in cache.get_changes():
+        version = change.candidate
+        filename = os.path.basename(version.filename)
+        if filename in pool_debs:
+            continue
+        path = _lookup("debs", version.sha256, filename)
+        if path is None:
+            path = _store("debs", version.fetch_binary(tmpdir))
+        debs.append(path)
+    return sorted(debs, key=os.path.basename)
+
+
+@register_action()
+def add_cached_packages_to_pool(ctxt, packages: List[str]):
+    """
+    add-packages-to-pool with the .debs of the package cache. The list is only resolved again with the mirrors when
+    its resolution expires, so rebuilding the same list doesn't download anything.
+    """
+    key = _resolution_key(ctxt, "debs", packages)
+    debs = _load_resolution("debs", key)
+    if debs is None:
+        debs = _resolve_debs(ctxt, packages)
+        _save_resolution(key, debs)
+    else:
+        ctxt.log(f"** adding {len(debs)} cached .debs to the pool **")
+    add_debs_to_pool(ctxt, debs=debs)
+    _lock_versions("apt", debs)
+    _evict()
+
+
+@register_action()
+def install_cached_pip_packages(ctxt, packages: List[str]):
+    """
+    install-pip-packages with the python packages of the package cache. They are downloaded in the installer
+    filesystem, which has the python version they are built for, only when the resolution of the list expires.
+    """
+    env = os.environ.copy()
+    env["DEBIAN_FRONTEND"] = "noninteractive"
+    env["LANG"] = "C.UTF-8"
+    base = ctxt.edit_squashfs(get_squash_names(ctxt)[0])
+    staging_path = f"{base}{PIP_STAGING_PATH}"
+    os.makedirs(staging_path, exist_ok=True)
+
+    key = _resolution_key(ctxt, "pip", packages)
+    paths = _load_resolution("pip", key)
+    if paths is None:
+        ctxt.run(
+            ["chroot", base, "pip3", "download", "-d", PIP_STAGING_PATH] + packages,
+            env=env,
+        )
+        paths = [
+            _store("pip", os.path.join(staging_path, name))
+            for name in sorted(os.listdir(staging_path))
+        ]
+        _save_resolution(key, paths)
+    else:
+        for path in paths:
+            shutil.copy(path, staging_path)
+    ctxt.run(
+        ["chroot", base, "pip3", "install", "--no-index", "--find-links"]
+        + [PIP_STAGING_PATH]
+        + packages,
+        env=env,
+    )
+    shutil.rmtree(staging_path)
+    _lock_versions("pip", paths)
+    _evict()
@@ -1,11 +1,32 @@
+import functools
+import hashlib
+import json
 import logging
+import re
 import time
 import os
 import yaml
 import copy
 from subprocess import call, run
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from utils.build_cache import BUILD_CACHE, BUILD_CACHE_PATH
+
+# Directory where the compiled templates are kept between runs
+JINJA_CACHE_PATH = os.getenv("JINJA_CACHE_PATH", f"{BUILD_CACHE_PATH}/jinja")
+# Kernel files of the folders that passed the validation, with their size, modification time and SHA-256
+KERNEL_FINGERPRINTS = f"{BUILD_CACHE_PATH}/kernel-fingerprints.json"
+# Manifest of the kernel PPA, with the SHA-256 of every .deb file
+KERNEL_CHECKSUMS = "CHECKSUMS"
+CHUNK_SIZE = 1024 * 1024
+
+# Options of openssl passwd for the hash types of the password_hash filter
+PASSWORD_HASH_METHODS = {
+    "sha512": "-6",
+    "sha256": "-5",
+    "md5": "-1",
+}
 
 
 def merge(source, destination):
@@ -93,13 +114,46 @@ def write_dict_to_ansible_vars(path_vars_file, consolidated_dic):
     pxe_file.close()
 
 
-def render_jinja_template(template_file, output_file, data):
-    template_loader = FileSystemLoader(searchpath="/")
-    jinja_env = Environment(
+@functools.lru_cache(maxsize=None)
+def _password_hash(password, hashtype="sha512", salt=None):
+    """
+    The password_hash filter of ansible, which is not part of jinja2_ansible_filters. The crypt hash is computed by
+    openssl passwd, the password is sent on its standard input so it doesn't show in the process list. Every password
+    is hashed once per process, the hosts that share a password share its hash.
+    """
+    command = ["openssl", "passwd", PASSWORD_HASH_METHODS[hashtype], "-stdin"]
+    if salt is not None:
+        command += ["-salt", salt]
+    result = run(command, input=str(password), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"Unable to hash the password: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def jinja_environment(searchpath, trim_blocks=False):
+    """
+    Returns the Jinja environment of the templates under searchpath. It is created once, so every template is
+    compiled once per process, and the compiled templates are kept on disk for the next runs.
+    """
+    bytecode_cache = None
+    try:
+        os.makedirs(JINJA_CACHE_PATH, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_PATH)
+    except OSError as error:
+        logging.warning(f"Compiled templates not cached: {error}")
+    environment = Environment(
         extensions=["jinja2_ansible_filters.AnsibleCoreFiltersExtension"],
-        loader=template_loader,
+        loader=FileSystemLoader(searchpath=searchpath),
+        bytecode_cache=bytecode_cache,
+        trim_blocks=trim_blocks,
     )
-    template = jinja_env.get_template(template_file)
+    environment.filters["password_hash"] = _password_hash
+    return environment
+
+
+def render_jinja_template(template_file, output_file, data):
+    template = jinja_environment("/").get_template(template_file)
     rendered_template = template.render(data)
     # save yaml
     yaml_data = yaml.safe_load(rendered_template)
@@ -112,6 +166,91 @@ def _check_deb_files_integrity(file_path):
     return deb_info.returncode
 
 
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_checksums(manifest):
+    """
+    Returns:
+        dict: The SHA-256 of every file of a CHECKSUMS manifest, whose SHA-1 lines are ignored.
+    """
+    checksums = {}
+    with open(manifest) as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) == 2 and re.fullmatch(r"[0-9a-fA-F]{64}", fields[0]):
+                checksums[fields[1].lstrip("*")] = fields[0].lower()
+    return checksums
+
+
+def _stat(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _load_kernel_fingerprints():
+    try:
+        with open(KERNEL_FINGERPRINTS) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_kernel_fingerprint(folder_path, fingerprint):
+    fingerprints = _load_kernel_fingerprints()
+    fingerprints[str(folder_path)] = fingerprint
+    try:
+        os.makedirs(BUILD_CACHE_PATH, exist_ok=True)
+        with open(KERNEL_FINGERPRINTS, "w") as file:
+            json.dump(fingerprints, file)
+    except OSError as error:
+        logging.warning(f"Unable to record the validated kernel files: {error}")
+
+
+def _is_validated(folder_path, files, manifest):
+    """
+    Returns True if the files and manifest of the folder have the same size and modification time as when they were
+    validated.
+    """
+    fingerprint = _load_kernel_fingerprints().get(str(folder_path))
+    if not fingerprint:
+        return False
+    manifest_stat = _stat(manifest) if os.path.isfile(manifest) else None
+    if fingerprint["manifest"] != manifest_stat:
+        return False
+    if set(fingerprint["files"]) != set(files):
+        return False
+    return all(fingerprint["files"][path][:2] == _stat(path) for path in files)
+
+
+def _validate_deb(file_path, checksums):
+    """
+    Checks a .deb file with dpkg and, if there is a manifest, its SHA-256.
+
+    Returns:
+        str: The SHA-256 of the file, None if the file is damaged.
+    """
+    stat = _stat(file_path)
+    if _check_deb_files_integrity(file_path) != 0:
+        logging.error(f"The file {file_path} is damaged !")
+        return None
+    sha256 = _sha256(file_path)
+    if checksums is not None:
+        expected = checksums.get(os.path.basename(file_path))
+        if expected is None:
+            logging.error(f"The file {file_path} is not in {KERNEL_CHECKSUMS} !")
+            return None
+        if expected != sha256:
+            logging.error(f"The checksum of the file {file_path} doesn't match !")
+            return None
+    return [*stat, sha256]
+
+
 def _check_kernel_files(version, folder_path):
     # Define the expected patterns using the provided kernel version
     file_patterns = [
@@ -121,19 +260,41 @@ def _check_kernel_files(version, folder_path):
         f"linux-modules-{version}-*generic_{version}-*.deb",
     ]
 
+    files = []
     for pattern in file_patterns:
         matched_files = list(folder_path.glob(pattern))
         # Just one file should match the pattern
-        if len(matched_files) == 1:
-            # Get the path as a string
-            file_path = matched_files[0].as_posix()
-            if _check_deb_files_integrity(file_path) != 0:
-                logging.error(f"The file {file_path} is damaged !")
-                return False
-        else:
+        if len(matched_files) != 1:
             logging.error(f"No file match the pattern {pattern} !")
             return False
+        # Get the path as a string
+        files.append(matched_files[0].as_posix())
+
+    manifest = (folder_path / KERNEL_CHECKSUMS).as_posix()
+    if BUILD_CACHE and _is_validated(folder_path, files, manifest):
+        logging.info(f"Kernel files v{version} unchanged since their validation")
+        return True
 
+    checksums = None
+    if os.path.isfile(manifest):
+        checksums = _read_checksums(manifest)
+    else:
+        logging.warning(
+            f"No {KERNEL_CHECKSUMS} file in {folder_path}, the checksums of the kernel files are not verified"
+        )
+    with ThreadPoolExecutor(max_workers=len(files)) as executor:
+        results = list(executor.map(lambda path: _validate_deb(path, checksums), files))
+    if None in results:
+        return False
+
+    if BUILD_CACHE:
+        _save_kernel_fingerprint(
+            folder_path,
+            {
+                "manifest": _stat(manifest) if checksums is not None else None,
+                "files": dict(zip(files, results)),
+            },
+        )
     logging.info(f"All the files exists for kernel v{version}")
     return True
 
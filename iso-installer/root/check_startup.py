@@ -0,0 +1,39 @@
+"""
+Checks the startup of the iso-installer: importing iso_installer must not load the server drivers, their vendor
+libraries nor the Netbox client, which are only imported when a host uses them, and must take less than
+STARTUP_BUDGET seconds.
+"""
+import importlib
+import os
+import sys
+import time
+
+# Maximum seconds to import iso_installer
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "2"))
+# Libraries that are only imported when a host or a safety check needs them
+LAZY_LIBRARIES = ("hpilo", "dracclient", "pynetbox", "livefs_edit")
+
+
+def main():
+    sys.path.insert(
+        0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+    )
+    start_time = time.monotonic()
+    importlib.import_module("iso_installer")
+    duration = time.monotonic() - start_time
+
+    drivers = importlib.import_module("server_management.base.server_factory").DRIVERS
+    lazy_modules = list(LAZY_LIBRARIES) + [
+        driver.split(":")[0] for driver in drivers.values()
+    ]
+    loaded = [module for module in lazy_modules if module in sys.modules]
+    print(f"iso_installer imported in {duration:.2f} seconds")
+    if loaded:
+        print(f"Modules loaded at startup: {', '.join(loaded)}")
+    if duration > STARTUP_BUDGET:
+        print(f"The startup takes more than {STARTUP_BUDGET} seconds")
+    return 1 if loaded or duration > STARTUP_BUDGET else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,11 +2,14 @@ import yaml
 import os
 import asyncio
 import logging
-from livefs_edit import __main__  # noqa: F401
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from server_management.base.redfish_client import RedfishClient
 from server_management.base.server_factory import ServerFactory
+from security.security_mechanism import check_safety_features
 from utils.utils_iso_automator import (
+    discover_hosts,
     process_server,
     check_existence,
 )
@@ -19,6 +22,8 @@ ISO_IMAGE_NAME = ""
 KERNEL_FOLDER_NAME = ""
 ISO_BASE_PATH = f"{ISO_AUTOMATOR_PATH}/base_image"
 ISO_IMAGE_VERSION = os.getenv("ISO_IMAGE_VERSION")
+# Maximum number of hosts provisioned at the same time
+MAX_CONCURRENT_HOSTS = int(os.getenv("MAX_CONCURRENT_HOSTS", "10"))
 # Default package and repository configurations
 DEFAULT_PACKAGES = {
     "apt": ["hp-scripting-tools", "hponcfg", "srvadmin-idracadm8", "python3-pip"],
@@ -31,8 +36,8 @@ DEFAULT_PACKAGES = {
 }
 
 
-def add_configuration(content_servers):
-    consolidated_info = []
+async def add_configuration(content_servers):
+    hosts = []
     # Consolidate all the information
     servers = os.environ.get("SERVERS", "")
     if servers:
@@ -41,7 +46,16 @@ def add_configuration(content_servers):
         for server in content_servers["servers"][role]:
             if servers and (server not in servers):
                 continue
-            process_server(server, role, content_servers, consolidated_info)
+            hosts.append(process_server(server, role, content_servers))
+
+    # Reads the serial number and boot options of all the BMCs at once
+    hosts = await discover_hosts(hosts)
+
+    # Validates the safety features of all the hosts at once
+    report = await check_safety_features(hosts)
+    consolidated_info = [
+        host["host"] for host in hosts if report[host["host"]["hostname"]]
+    ]
 
     if not consolidated_info:
         logging.error("There is no content in consolidated_info.")
@@ -50,53 +64,86 @@ def add_configuration(content_servers):
     return consolidated_info
 
 
-def install_iso(consolidated_info):
+async def install_iso(consolidated_info):
     # Configures virtual media and sets some boot things.
     iso_url = f"{os.environ.get('SERVER_URL')}/autoinstall.iso"
     logging.info("Sets virtual media url to iso-automator NGINX for all servers.")
-    for host in consolidated_info:
+    return await start_install(consolidated_info, iso_url)
+
+
+async def deploy(content_servers):
+    try:
+        consolidated_info = await add_configuration(content_servers)
+        return await install_iso(consolidated_info)
+    finally:
+        await RedfishClient.close_all()
+
+
+async def manage_server(host, iso_url, semaphore):
+    """
+    Runs the whole provisioning pipeline of a single host: virtual media configuration followed by the power cycle
+    that boots the server from the ISO. A failure only stops the pipeline of the affected host.
+
+    Args:
+        host (dict): Consolidated information of the host.
+        iso_url (str): URL of the autoinstall.iso served by the iso-automator NGINX.
+        semaphore (asyncio.Semaphore): Limits the number of hosts provisioned at the same time.
+
+    Returns:
+        bool: True if the host was provisioned, False otherwise.
+    """
+    hostname = host["hostname"]
+    async with semaphore:
         try:
             server = ServerFactory.get_server(
                 management_type=host["management"]["type"],
                 host=host["management"]["address"],
                 user=host["management"]["user"],
                 password=host["management"]["password"],
-                hostname=host["hostname"],
+                hostname=hostname,
             )
-            logging.info("Removing old virtual media if it exists")
-            server.eject_virtual_media()
-            logging.info("Configuring UEFI mode")
-            server.set_uefi_mode()
-            logging.info(f"Inserting the URL {iso_url} as virtual media")
-            server.insert_virtual_media(iso_url)
-            logging.info("Configuring the virtual media")
-            server.config_virtual_media()
-        except Exception as error:
-            logging.error(f"{error}")
-            return
-    asyncio.run(start_install(consolidated_info))
-
+            logging.info(f"Removing old virtual media if it exists for host {hostname}")
+            await server.eject_virtual_media()
+            logging.info(f"Configuring UEFI mode for host {hostname}")
+            await server.set_uefi_mode()
+            logging.info(
+                f"Inserting the URL {iso_url} as virtual media for host {hostname}"
+            )
+            await server.insert_virtual_media(iso_url)
+            logging.info(f"Configuring the virtual media for host {hostname}")
+            await server.config_virtual_media()
 
-async def manage_server(host):
-    hostname = host["hostname"]
-    server = ServerFactory.get_server(
-        management_type=host["management"]["type"],
-        host=host["management"]["address"],
-        user=host["management"]["user"],
-        password=host["management"]["password"],
-        hostname=hostname,
-    )
+            await server.power_on_server_after_media_config()
+        except Exception as error:
+            logging.error(f"Host {hostname}: {error}")
+            return False
+    return True
 
-    await server.power_on_server_after_media_config()
 
+async def start_install(consolidated_info, iso_url):
+    """
+    Provisions all the hosts concurrently, running at most MAX_CONCURRENT_HOSTS pipelines at the same time.
 
-async def start_install(consolidated_info):
-    tasks = []
-    for host in consolidated_info:
-        task = asyncio.create_task(manage_server(host))
-        tasks.append(task)
+    Returns:
+        list: Hostnames whose provisioning failed.
+    """
+    max_concurrent_hosts = max(1, min(MAX_CONCURRENT_HOSTS, len(consolidated_info)))
+    logging.info(
+        f"Provisioning {len(consolidated_info)} hosts, {max_concurrent_hosts} at the same time."
+    )
+    # Blocking BMC calls (hpilo) run in this executor, one worker per concurrent host
+    executor = ThreadPoolExecutor(max_workers=max_concurrent_hosts)
+    asyncio.get_running_loop().set_default_executor(executor)
+    semaphore = asyncio.Semaphore(max_concurrent_hosts)
 
-    await asyncio.gather(*tasks)
+    results = await asyncio.gather(
+        *(manage_server(host, iso_url, semaphore) for host in consolidated_info)
+    )
+    return [
+        host["hostname"]
+        for host, provisioned in zip(consolidated_info, results)
+        if not provisioned
+    ]
 
 
 def main():
@@ -128,8 +175,12 @@ def main():
     check_existence(ISO_AUTOMATOR_PATH, KERNEL_FOLDER_NAME, is_file=False)
     logging.info(f"{ISO_IMAGE_NAME} exists.")
 
-    consolidated_info = add_configuration(content_servers)
-    install_iso(consolidated_info)
+    failed_hosts = asyncio.run(deploy(content_servers))
+    if failed_hosts:
+        logging.error(
+            f"The installation failed for the hosts: {', '.join(failed_hosts)}"
+        )
+        exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,250 @@
+import errno
+import ipaddress
+import logging
+import os
+import selectors
+import select
+import socket
+import struct
+import time
+
+# Seconds to wait for the replies of all the addresses
+PING_TIMEOUT = float(os.environ.get("PING_TIMEOUT", "3"))
+# Echo requests sent to every address that didn't reply yet, spread over PING_TIMEOUT
+PING_COUNT = 3
+# Ports probed when ICMP sockets are not available. A refused connection also means the host is up.
+TCP_PROBE_PORTS = (22, 80, 443)
+# Maximum addresses probed with TCP at the same time, bounds the number of open sockets
+TCP_PROBE_BATCH = 128
+
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+ICMP_PROTOCOL = {
+    socket.AF_INET: socket.IPPROTO_ICMP,
+    socket.AF_INET6: socket.IPPROTO_ICMPV6,
+}
+PAYLOAD = b"iso-automator-sweep"
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _echo_request(family, identifier, sequence):
+    header = struct.pack(
+        "!BBHHH", ICMP_ECHO_REQUEST[family], 0, 0, identifier, sequence
+    )
+    # The kernel computes the checksum of ICMPv6 messages
+    if family == socket.AF_INET:
+        checksum = _checksum(header + PAYLOAD)
+        header = struct.pack(
+            "!BBHHH", ICMP_ECHO_REQUEST[family], 0, checksum, identifier, sequence
+        )
+    return header + PAYLOAD
+
+
+def _open_icmp_socket(family):
+    """
+    Returns:
+        tuple: The ICMP socket and whether it is a raw socket, or (None, False) if ICMP sockets are not allowed.
+    """
+    for sock_type in (socket.SOCK_RAW, socket.SOCK_DGRAM):
+        try:
+            sock = socket.socket(family, sock_type, ICMP_PROTOCOL[family])
+            sock.setblocking(False)
+            return sock, sock_type == socket.SOCK_RAW
+        except OSError:
+            continue
+    return None, False
+
+
+def _parse_reply(family, is_raw, packet, identifier):
+    """
+    Returns:
+        bool: True if the packet is an echo reply to this sweep.
+    """
+    # Raw IPv4 sockets receive the IP header too
+    if family == socket.AF_INET and is_raw:
+        packet = packet[(packet[0] & 0x0F) * 4 :]
+    if len(packet) < 8:
+        return False
+    icmp_type, _, _, reply_identifier, _ = struct.unpack("!BBHHH", packet[:8])
+    if icmp_type != ICMP_ECHO_REPLY[family]:
+        return False
+    # Non raw sockets only receive the replies of their own requests, and the kernel rewrites the identifier
+    return not is_raw or reply_identifier == identifier
+
+
+def _icmp_sweep(family, addresses, timeout):
+    """
+    Sends echo requests to all the addresses at once and collects the replies until the deadline.
+
+    Returns:
+        set: The addresses that replied, or None if ICMP sockets are not allowed.
+    """
+    sock, is_raw = _open_icmp_socket(family)
+    if sock is None:
+        return None
+    identifier = os.getpid() & 0xFFFF
+    targets = set(addresses)
+    alive = set()
+    deadline = time.monotonic() + timeout
+    resend_interval = timeout / PING_COUNT
+    next_send = time.monotonic()
+    sequence = 0
+    try:
+        while targets - alive:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_send and sequence < PING_COUNT:
+                sequence += 1
+                for address in targets - alive:
+                    try:
+                        sock.sendto(
+                            _echo_request(family, identifier, sequence), (address, 0)
+                        )
+                    except OSError as error:
+                        logging.debug(
+                            f"Unable to send an echo request to {address}: {error}"
+                        )
+                next_send = now + resend_interval
+            readable, _, _ = select.select(
+                [sock], [], [], max(0, min(deadline, next_send) - now)
+            )
+            if not readable:
+                continue
+            while True:
+                try:
+                    packet, source = sock.recvfrom(2048)
+                except BlockingIOError:
+                    break
+                address = ipaddress.ip_address(source[0].split("%")[0]).compressed
+                if address in targets and _parse_reply(
+                    family, is_raw, packet, identifier
+                ):
+                    alive.add(address)
+    finally:
+        sock.close()
+    return alive
+
+
+def _arp_resolved(addresses):
+    """
+    Returns:
+        set: The addresses with a complete entry in the ARP table of the host.
+    """
+    resolved = set()
+    try:
+        with open("/proc/net/arp") as arp_table:
+            next(arp_table)
+            for line in arp_table:
+                fields = line.split()
+                # Flags 0x2: the MAC address of the entry is resolved
+                if (
+                    len(fields) >= 4
+                    and fields[0] in addresses
+                    and int(fields[2], 16) & 0x2
+                ):
+                    resolved.add(fields[0])
+    except (OSError, StopIteration, ValueError):
+        pass
+    return resolved
+
+
+def _tcp_sweep(addresses, timeout):
+    """
+    Opens non-blocking TCP connections to TCP_PROBE_PORTS of the addresses at once (TCP_PROBE_BATCH addresses at a
+    time). An accepted or a refused connection means that the host is up. Hosts in the same L2 segment are also
+    detected through the ARP table, which is filled by the connection attempts.
+
+    Returns:
+        set: The addresses that replied.
+    """
+    addresses = sorted(addresses)
+    alive = set()
+    for index in range(0, len(addresses), TCP_PROBE_BATCH):
+        alive |= _tcp_probe(addresses[index : index + TCP_PROBE_BATCH], timeout)
+    return alive | _arp_resolved(set(addresses))
+
+
+def _tcp_probe(addresses, timeout):
+    alive = set()
+    pending = selectors.DefaultSelector()
+    for address in addresses:
+        family = socket.AF_INET6 if ":" in address else socket.AF_INET
+        for port in TCP_PROBE_PORTS:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            result = sock.connect_ex((address, port))
+            if result in (0, errno.ECONNREFUSED):
+                alive.add(address)
+                sock.close()
+            elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                pending.register(sock, selectors.EVENT_WRITE, address)
+            else:
+                sock.close()
+    deadline = time.monotonic() + timeout
+    try:
+        while pending.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in pending.select(remaining):
+                pending.unregister(key.fileobj)
+                if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) in (
+                    0,
+                    errno.ECONNREFUSED,
+                ):
+                    alive.add(key.data)
+                key.fileobj.close()
+    finally:
+        for key in list(pending.get_map().values()):
+            key.fileobj.close()
+        pending.close()
+    return alive
+
+
+def sweep(addresses, timeout=PING_TIMEOUT):
+    """
+    Checks the reachability of many addresses at once with a single deadline, using ICMP echo requests (raw sockets,
+    or unprivileged ICMP sockets) and falling back to TCP/ARP probes if ICMP sockets are not allowed.
+
+    Args:
+        addresses (list): IPv4 and IPv6 addresses to probe.
+        timeout (float): Seconds to wait for the replies.
+
+    Returns:
+        set: The addresses that replied.
+    """
+    by_family = {socket.AF_INET: set(), socket.AF_INET6: set()}
+    for address in addresses:
+        ip_address = ipaddress.ip_address(address)
+        family = socket.AF_INET6 if ip_address.version == 6 else socket.AF_INET
+        by_family[family].add(ip_address.compressed)
+
+    alive = set()
+    without_icmp = set()
+    for family, family_addresses in by_family.items():
+        if not family_addresses:
+            continue
+        replies = _icmp_sweep(family, family_addresses, timeout)
+        if replies is None:
+            without_icmp |= family_addresses
+        else:
+            alive |= replies
+    if without_icmp:
+        logging.warning(
+            "ICMP sockets are not allowed, probing the addresses with TCP/ARP."
+        )
+        alive |= _tcp_sweep(without_icmp, timeout)
+    return {
+        address
+        for address in addresses
+        if ipaddress.ip_address(address).compressed in alive
+    }
@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Values of a multi-value filter (address=, device=) sent in one request, bounds the length of the URLs
+NETBOX_FILTER_BATCH = int(os.environ.get("NETBOX_FILTER_BATCH", "50"))
+# Requests sent to Netbox at the same time
+NETBOX_WORKERS = int(os.environ.get("NETBOX_WORKERS", "8"))
+# Optional file where the IPAM lookups are kept between runs
+NETBOX_CACHE = os.environ.get("NETBOX_CACHE", "")
+# Seconds an IPAM lookup of the on-disk cache is reused
+NETBOX_CACHE_TTL = int(os.environ.get("NETBOX_CACHE_TTL", "600"))
+
+# Owner of the addresses that are not assigned to any interface
+FREE_IP = "freeIP"
+
+_clients = {}
+
+
+def get_client(url, token):
+    """
+    Returns the pynetbox client of a Netbox server. The client is shared, so all the requests reuse the connections of
+    one HTTP session, and the pages of a query are fetched concurrently.
+    """
+    if (url, token) not in _clients:
+        # Imported with the first client, the rollouts without the netbox check don't load pynetbox
+        import pynetbox  # pylint: disable=import-outside-toplevel
+
+        client = pynetbox.api(url, token=token, threading=True)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=NETBOX_WORKERS, pool_maxsize=NETBOX_WORKERS
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        client.http_session = session
+        _clients[(url, token)] = client
+    return _clients[(url, token)]
+
+
+def _batches(values):
+    values = sorted(values)
+    return [
+        values[index : index + NETBOX_FILTER_BATCH]
+        for index in range(0, len(values), NETBOX_FILTER_BATCH)
+    ]
+
+
+def _owner(ip_address):
+    interface = ip_address.assigned_object
+    if not interface:
+        return FREE_IP
+    device = getattr(interface, "device", None) or getattr(
+        interface, "virtual_machine", None
+    )
+    return str(device) if device else FREE_IP
+
+
+class NetboxIndex:
+    """
+    Index of the IPAM of Netbox, limited to the addresses and devices of a rollout. It maps every address to the
+    devices it is assigned to (FREE_IP if it is not assigned to any interface). The addresses that don't exist in
+    Netbox are not in the index.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.addresses = {}
+        self.cache = {"addresses": {}, "devices": {}}
+
+    def _load_cache(self):
+        if not NETBOX_CACHE:
+            return
+        try:
+            with open(NETBOX_CACHE) as file:
+                cache = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError as error:
+            logging.warning(f"Ignoring the Netbox cache: {error}")
+            return
+        now = time.time()
+        for kind in self.cache:
+            self.cache[kind] = {
+                key: entry
+                for key, entry in cache.get(kind, {}).items()
+                if entry["expires"] > now
+            }
+
+    def _save_cache(self):
+        if not NETBOX_CACHE:
+            return
+        # Replaces the file at once, every rollout writes its own temporary file
+        temporary_path = f"{NETBOX_CACHE}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "w") as file:
+                json.dump(self.cache, file)
+            os.replace(temporary_path, NETBOX_CACHE)
+        except OSError as error:
+            logging.warning(f"Unable to write the Netbox cache: {error}")
+
+    def _fetch(self, filters):
+        """
+        Returns:
+            list: (address, owner) of the IP addresses that match the filters.
+        """
+        return [
+            (ip_address.address.split("/")[0], _owner(ip_address))
+            for ip_address in self.client.ipam.ip_addresses.filter(**filters)
+        ]
+
+    def load(self, addresses, devices):
+        """
+        Indexes the addresses, and all the addresses assigned to the devices. Only the lookups that are not in the
+        on-disk cache are queried, with multi-value address= and device= filters sent concurrently.
+
+        Args:
+            addresses (iterable): IP addresses to index.
+            devices (iterable): Names of the devices whose addresses are indexed.
+        """
+        self._load_cache()
+        missing_addresses = set(addresses) - set(self.cache["addresses"])
+        missing_devices = set(devices) - set(self.cache["devices"])
+        queries = [{"address": batch} for batch in _batches(missing_addresses)] + [
+            {"device": batch} for batch in _batches(missing_devices)
+        ]
+        if queries:
+            logging.info(
+                f"Querying Netbox for {len(missing_addresses)} addresses and {len(missing_devices)} devices"
+            )
+            with ThreadPoolExecutor(max_workers=NETBOX_WORKERS) as executor:
+                results = list(executor.map(self._fetch, queries))
+
+            expires = time.time() + NETBOX_CACHE_TTL
+            for address in missing_addresses:
+                self.cache["addresses"][address] = {"owners": [], "expires": expires}
+            for device in missing_devices:
+                self.cache["devices"][device] = {"addresses": [], "expires": expires}
+            for query, result in zip(queries, results):
+                for address, owner in result:
+                    if "address" in query:
+                        self.cache["addresses"].setdefault(
+                            address, {"owners": [], "expires": expires}
+                        )["owners"].append(owner)
+                    elif owner in missing_devices:
+                        self.cache["devices"][owner]["addresses"].append(address)
+            self._save_cache()
+
+        for address in addresses:
+            for owner in self.cache["addresses"][address]["owners"]:
+                self.addresses.setdefault(address, set()).add(owner)
+        for device in devices:
+            for address in self.cache["devices"][device]["addresses"]:
+                self.addresses.setdefault(address, set()).add(device)
+        return self
+
+    def devices(self):
+        """
+        Returns:
+            dict: The indexed addresses of every device, and the free ones under FREE_IP.
+        """
+        devices = {FREE_IP: set()}
+        for address, owners in self.addresses.items():
+            for owner in owners:
+                devices.setdefault(owner, set()).add(address)
+        return devices
+
+
+def get_netbox_ips(url, token, addresses, devices):
+    """
+    Builds the IPAM index of the addresses and devices of a rollout.
+
+    Returns:
+        dict: The indexed addresses of every device, and the free ones under FREE_IP.
+    """
+    return NetboxIndex(get_client(url, token)).load(addresses, devices).devices()
+
+
+def _device_statuses(client, hostnames):
+    return [
+        (str(device.name), getattr(device.status, "label", str(device.status)))
+        for device in client.dcim.devices.filter(name=hostnames)
+    ]
+
+
+def get_device_statuses(url, token, hostnames):
+    """
+    Looks up the devices of many hostnames at once, with multi-value name= filters sent concurrently.
+
+    Returns:
+        dict: The status label of every hostname that is a device in Netbox.
+    """
+    client = get_client(url, token)
+    batches = _batches(hostnames)
+    if not batches:
+        return {}
+    with ThreadPoolExecutor(max_workers=NETBOX_WORKERS) as executor:
+        results = executor.map(lambda batch: _device_statuses(client, batch), batches)
+        return {name: status for result in results for name, status in result}
@@ -0,0 +1,101 @@
+import logging
+import os
+import re
+import requests
+from urllib.parse import urlparse
+
+# Seconds before a request to the Prometheus API is considered failed
+PROMETHEUS_TIMEOUT = int(os.environ.get("PROMETHEUS_TIMEOUT", "30"))
+# Addresses and hostnames covered by each request, bounds the size of the matchers and of the replies
+PROMETHEUS_BATCH_SIZE = int(os.environ.get("PROMETHEUS_BATCH_SIZE", "100"))
+
+
+def series_url(prometheus_url):
+    # if path is not part of URL, default path is used
+    if not urlparse(prometheus_url).path:
+        return f"{prometheus_url}/api/v1/series"
+    return prometheus_url
+
+
+def _regex(values):
+    return "|".join(re.escape(value) for value in values)
+
+
+def _matcher(label, regex):
+    # Backslashes of the regex must be escaped inside a PromQL string
+    escaped = regex.replace("\\", "\\\\")
+    return f'{{{label}=~"{escaped}"}}'
+
+
+def _get_series(session, api_url, matchers):
+    """
+    Returns the label sets of the series that match any of the matchers. The matchers are sent in the body of a POST
+    request so that their size is not limited by the length of the URL.
+
+    Raises:
+        Exception: If the HTTP request fails or returns a non-success status code.
+    """
+    params = [("match[]", matcher) for matcher in matchers]
+    response = session.post(api_url, data=params, timeout=PROMETHEUS_TIMEOUT)
+    if response.status_code == 405:
+        response = session.get(api_url, params=params, timeout=PROMETHEUS_TIMEOUT)
+    if response.status_code != 200:
+        logging.info(f"Request error: {response.status_code} {response.text}")
+        raise Exception("Prometheus server failed to reply.")
+    return response.json().get("data") or []
+
+
+def find_hosts_with_metrics(prometheus_url, hosts):
+    """
+    Looks up the series of many hosts at once: every request matches a batch of addresses (by the instance label,
+    with or without port) and of hostnames (by the alias label), and the returned series are mapped back to the
+    hosts they belong to.
+
+    Args:
+        prometheus_url (str): URL of the Prometheus server.
+        hosts (dict): For every hostname, the list of its IP addresses.
+
+    Returns:
+        dict: For every hostname with metrics in Prometheus, the sorted list of its addresses and hostname found in
+        the series.
+
+    Raises:
+        Exception: If a request to Prometheus fails.
+    """
+    api_url = series_url(prometheus_url)
+    address_hosts = {}
+    for hostname, addresses in hosts.items():
+        for address in addresses:
+            address_hosts.setdefault(address, set()).add(hostname)
+    addresses = sorted(address_hosts)
+    hostnames = sorted(hosts)
+
+    found = {}
+    with requests.Session() as session:
+        for index in range(
+            0, max(len(addresses), len(hostnames)), PROMETHEUS_BATCH_SIZE
+        ):
+            batch_addresses = addresses[index : index + PROMETHEUS_BATCH_SIZE]
+            batch_hostnames = hostnames[index : index + PROMETHEUS_BATCH_SIZE]
+            matchers = []
+            instance_pattern = None
+            if batch_addresses:
+                instance_regex = f"({_regex(batch_addresses)})(:[0-9]+)?"
+                matchers.append(_matcher("instance", instance_regex))
+                instance_pattern = re.compile(f"^{instance_regex}$")
+            if batch_hostnames:
+                matchers.append(_matcher("alias", _regex(batch_hostnames)))
+
+            for labels in _get_series(session, api_url, matchers):
+                match = instance_pattern and instance_pattern.match(
+                    labels.get("instance", "")
+                )
+                if match:
+                    for hostname in address_hosts[match.group(1)]:
+                        found.setdefault(hostname, set()).add(match.group(1))
+                if labels.get("alias") in batch_hostnames:
+                    found.setdefault(labels["alias"], set()).add(labels["alias"])
+
+    for hostname, matches in found.items():
+        logging.info(f"Metrics found for host {hostname}: {', '.join(sorted(matches))}")
+    return {hostname: sorted(matches) for hostname, matches in found.items()}
@@ -1,225 +1,253 @@
+import asyncio
+import functools
 import logging
 import os
-import requests
-import pynetbox
-from subprocess import run
-from urllib.parse import urlparse
+from security.icmp_sweeper import sweep
+from security.netbox_index import get_device_statuses, get_netbox_ips
+from security.prometheus_series import find_hosts_with_metrics
 
 
-global NETBOX_URL, NETBOX_TOKEK, NETBOX_IPS
+global NETBOX_URL, NETBOX_TOKEK
 
 NETBOX_URL = os.environ.get("NETBOX_URL")
 NETBOX_TOKEN = os.environ.get("NETBOX_TOKEN")
-NETBOX_IPS = []
+# Seconds before a safety check of a host is considered failed
+SAFETY_CHECK_TIMEOUT = int(os.environ.get("SAFETY_CHECK_TIMEOUT", "120"))
 
 
-def _get_ips_from_netbox():
-    """
-    Get the list of all the IPs that are inside the Netbox Server integrated with ISO-Automator.
-    This list will be used when checking the Netbox Safety Feature.
+async def _run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
 
-    If the NETBOX_IPs list is empty, it doesn't mean that the check is a failure; we simply return
-    an empty list for the rest of the checks.
-    """
 
-    netbox_client = pynetbox.api(NETBOX_URL, token=NETBOX_TOKEN)
+async def _check_boot(server, addresses, hostname, lookup=None):
+    if lookup is None:
+        await server.check_boot_options()
+    else:
+        # Read during the discovery of the host
+        await asyncio.shield(lookup)
 
-    device_addresses = netbox_client.ipam.ip_addresses.all()
 
-    devices = {"freeIP": set()}
+def _sweep_hosts(hosts):
+    return sweep(
+        sorted({address for addresses in hosts.values() for address in addresses})
+    )
 
-    for device_address in device_addresses:
-        device_interface = device_address.assigned_object
-        ip_address = device_address.address.split("/")[0]
 
-        if device_interface:
-            device = str(device_interface.device)
-            devices.setdefault(device, set()).add(ip_address)
-        else:
-            devices["freeIP"].add(ip_address)
+async def _check_ping(server, addresses, hostname, lookup=None):
+    if lookup is None:
+        lookup = _run_blocking(sweep, addresses)
+    # The sweep is shared, the timeout of this host must not cancel it
+    alive = await asyncio.shield(lookup)
+    reachable = [address for address in addresses if address in alive]
+    if reachable:
+        raise Exception(f"there is ping connectivity to IPs {', '.join(reachable)}")
+
+
+def _find_series(hosts):
+    prometheus_url = os.environ.get("PROMETHEUS_URL")
+    if not prometheus_url:
+        raise Exception("Prometheus URL is not set.")
+    return find_hosts_with_metrics(prometheus_url, hosts)
+
+
+async def _check_prometheus(server, addresses, hostname, lookup=None):
+    if lookup is None:
+        lookup = _run_blocking(_find_series, {hostname: addresses})
+    # The lookup is shared, the timeout of this host must not cancel it
+    found = (await asyncio.shield(lookup)).get(hostname)
+    if found:
+        raise Exception(f"Error: Active metrics found for {', '.join(found)}.")
+
+
+def _index_netbox(hosts):
+    if not NETBOX_TOKEN:
+        raise Exception("There is not token defined for netbox.")
+    if not NETBOX_URL:
+        raise Exception("netbox URL is not set.")
+    return {
+        "devices": get_device_statuses(NETBOX_URL, NETBOX_TOKEN, set(hosts)),
+        "ips": get_netbox_ips(
+            NETBOX_URL,
+            NETBOX_TOKEN,
+            {address for addresses in hosts.values() for address in addresses},
+            set(hosts),
+        ),
+    }
+
+
+def _validate_netbox(hostname, addresses, netbox):
+    # StopIteration can't be raised through a future
+    try:
+        return validate_netbox_security(
+            hostname, addresses, netbox["ips"], netbox["devices"]
+        )
+    except StopIteration as error:
+        raise Exception(str(error))
 
-    return devices
 
+async def _check_netbox(server, addresses, hostname, lookup=None):
+    if lookup is None:
+        lookup = _run_blocking(_index_netbox, {hostname: addresses})
+    # The lookup is shared, the timeout of this host must not cancel it
+    netbox = await asyncio.shield(lookup)
+    await _run_blocking(_validate_netbox, hostname, set(addresses), netbox)
 
-if NETBOX_URL and NETBOX_TOKEN:
-    NETBOX_IPS = _get_ips_from_netbox()
 
+SAFETY_CHECKS = {
+    "boot": _check_boot,
+    "ping": _check_ping,
+    "prometheus": _check_prometheus,
+    "netbox": _check_netbox,
+}
 
-def check_safety_feature(server, addresses, hostname, safety_features):
-    """
-    Validates the specified safety features of a server to ensure its readiness and compliance. Skips the features specified in safety_features.
+# Checks that are answered for all the hosts of the rollout at once. Every function receives a dict with the addresses
+# of each hostname and its result is shared by the checks of the hosts.
+SHARED_LOOKUPS = {
+    "ping": _sweep_hosts,
+    "prometheus": _find_series,
+    "netbox": _index_netbox,
+}
 
-    Parameters:
-        server (Server object): The server instance to perform operations on.
-        addresses (list): A list of IP addresses to check for connectivity and Prometheus security.
-        hostname (str): The hostname associated with the server, used for logging.
-        safety_features (list): A list of safety features that should be validated.
 
+async def _run_safety_check(check):
+    """
     Returns:
-        bool: True if all enabled checks pass, False if any fail.
+        str: None if the check passed, the reason of the failure otherwise.
     """
-    if "boot" in safety_features:
-        logging.info(f"Starting boot options validation for host {hostname}.")
-        try:
-            server.check_boot_options()
-        except Exception as error:
-            logging.error(error)
-            return False
-    else:
-        logging.info(
-            f"Skipping boot options check for host {hostname} as per configuration."
-        )
-
-    if "ping" in safety_features:
-        logging.info(f"Starting ping connectivity check for host {hostname}.")
-        for address in addresses:
-            if check_ping(address):
-                logging.error(
-                    f"Server: {hostname}, there is ping connectivity to IP {address}, skipping"
-                )
-                return False
-    else:
-        logging.info(f"Skipping ping check for host {hostname} as per configuration.")
-
-    if "prometheus" in safety_features:
-        logging.info(f"Starting Prometheus security validation for host {hostname}.")
-        prometheus_url = os.environ.get("PROMETHEUS_URL")
-        if prometheus_url:
-            try:
-                for address in addresses:
-                    validate_prometheus_security(prometheus_url, address, hostname)
-            except Exception as error:
-                logging.error(error)
-                return False
-        else:
-            logging.error("Prometheus URL is not set.")
-            return False
-    else:
-        logging.info(
-            f"Skipping Prometheus security check for host {hostname} as per configuration."
-        )
-
-    if "netbox" in safety_features:
-        logging.info(f"Starting Netbox security validation for host {hostname}.")
-        if not NETBOX_TOKEN:
-            logging.error("There is not token defined for netbox.")
-            return False
-        if NETBOX_URL:
-            try:
-                validate_netbox_security(hostname, set(addresses))
-            except StopIteration as error:
-                logging.error(error)
-                return False
-        else:
-            logging.error("netbox URL is not set.")
-            return False
-    else:
-        logging.info(
-            f"Skipping Netbox security check for host {hostname} as per configuration."
-        )
-    return True
-
-
-def check_ping(address):
-    logging.info(f"Checking ping to {address}")
-    return (
-        run(["ping", "-c", "3", address], capture_output=True, text=True).returncode
-        == 0
-    )
+    try:
+        await asyncio.wait_for(check, SAFETY_CHECK_TIMEOUT)
+    except asyncio.TimeoutError:
+        return f"timeout after {SAFETY_CHECK_TIMEOUT} seconds"
+    except Exception as error:
+        return str(error)
+    return None
 
 
-def validate_prometheus_security(prometheus_url, host_ip, hostname):
+async def check_safety_feature(
+    server, addresses, hostname, safety_features, lookups=None
+):
     """
-    Validates that a server, which is about to have an operating system installed, is not
-    sending metrics to the Prometheus server. Validation is performed using
-    both the server's IP address and hostname.
+    Validates the specified safety features of a server to ensure its readiness and compliance. Skips the features
+    that are not in safety_features. The checks run concurrently, each one with a timeout of SAFETY_CHECK_TIMEOUT.
 
-    Args:
-        prometheus_url (str): URL of the Prometheus server.
-        host_ip (str): IP address of the host to validate.
-        hostname (str): Hostname of the server to validate.
+    Parameters:
+        server (Server object): The server instance to perform operations on.
+        addresses (list): A list of IP addresses to check for connectivity and Prometheus security.
+        hostname (str): The hostname associated with the server, used for logging.
+        safety_features (list): A list of safety features that should be validated.
+        lookups (dict): Futures of the SHARED_LOOKUPS of several hosts, by feature. The features without a shared
+        lookup query the data of this host alone.
 
-    Raises:
-        Exception: If metrics are found for the host or if there is an error in the request.
+    Returns:
+        dict: The result of every safety feature: None if it passed, "skipped" or the reason of the failure.
     """
-    # if path is not part of URL, default path is used
-    if not urlparse(prometheus_url).path:
-        prometheus_url = f"{prometheus_url}/api/v1/series"
-
-    queries = [f'{{instance=~"{host_ip}(:[0-9]+)?"}}', f'{{alias="{hostname}"}}']
-
-    # Check each match queries
-    for query in queries:
-        if check_metrics(query, prometheus_url):
-            raise Exception(f"Error: Active metrics found for {host_ip} or {hostname}.")
-
-
-def check_metrics(match_query, api_url):
+    features = [feature for feature in SAFETY_CHECKS if feature in safety_features]
+    for feature in SAFETY_CHECKS:
+        if feature not in features:
+            logging.info(
+                f"Skipping {feature} check for host {hostname} as per configuration."
+            )
+    lookups = lookups or {}
+    checks = [
+        SAFETY_CHECKS[feature](server, addresses, hostname, lookups.get(feature))
+        for feature in features
+    ]
+    results = await asyncio.gather(*(_run_safety_check(check) for check in checks))
+    report = {feature: "skipped" for feature in SAFETY_CHECKS}
+    report.update(zip(features, results))
+    return report
+
+
+async def check_safety_features(hosts):
     """
-    Checks for the existence of metrics in Prometheus based on a given match query.
+    Validates the safety features of all the hosts of the rollout concurrently and logs an aggregated report.
 
     Args:
-        match_query (str): The Prometheus match expression to query.
-        api_url (str): Full API URL of Prometheus to query the series.
+        hosts (list): Dicts with the "host" (consolidated info with its hostname), its "server", "addresses",
+        "safety_features" and the "boot_options" read during the discovery, as returned by discover_hosts.
 
     Returns:
-        bool: True if metrics are found, False otherwise.
-
-    Raises:
-        Exception: If the HTTP request fails or returns a non-success status code.
+        dict: For every hostname, True if all enabled checks passed, False if any failed.
     """
-    query_params = {"match[]": match_query}
-    response = requests.get(api_url, params=query_params)
-
-    if response.status_code == 200:
-        data = response.json()
-        if data.get("data"):
-            logging.info(f"Metrics found for the query: {match_query}")
-            return True
-        logging.info(f"No metrics found for the query: {match_query}")
-        return False
-    else:
-        logging.info(f"Request error: {response.status_code} {response.text}")
-        raise Exception("Prometheus server failed to reply.")
+    logging.info(f"Starting safety validation for {len(hosts)} hosts.")
+    # A single sweep, a single batch of Prometheus queries and a single Netbox index cover all the hosts at once
+    lookups = {}
+    for feature, lookup in SHARED_LOOKUPS.items():
+        feature_hosts = {
+            host["host"]["hostname"]: host["addresses"]
+            for host in hosts
+            if feature in host["safety_features"]
+        }
+        if feature_hosts:
+            lookups[feature] = asyncio.ensure_future(
+                _run_blocking(lookup, feature_hosts)
+            )
+    reports = await asyncio.gather(
+        *(
+            check_safety_feature(
+                host["server"],
+                host["addresses"],
+                host["host"]["hostname"],
+                host["safety_features"],
+                dict(lookups, boot=host.get("boot_options")),
+            )
+            for host in hosts
+        )
+    )
+    validated_hosts = {}
+    logging.info("Safety checks report:")
+    for host, report in zip(hosts, reports):
+        hostname = host["host"]["hostname"]
+        validated_hosts[hostname] = all(
+            result in (None, "skipped") for result in report.values()
+        )
+        summary = ", ".join(
+            f"{feature} {'OK' if result is None else result}"
+            for feature, result in report.items()
+        )
+        if validated_hosts[hostname]:
+            logging.info(f"  Host {hostname} is validated: {summary}")
+        else:
+            logging.error(f"  Security checks failed for host {hostname}: {summary}")
+    return validated_hosts
 
 
-def check_netbox_hostname(netbox_client, hostname):
+def check_netbox_hostname(device_statuses, hostname):
     """
     Check if the specified hostname already exists in the Netbox Server
 
     Args:
-        netbox_client: pynetbox.api client that let the code interact with the Netbox server
+        device_statuses (dict): Status label of the devices in Netbox (see get_device_statuses), it must include the
+        hostname if it exists.
         hostname: Hostname of the server to validate.
 
     Returns:
         bool: True if the server exists and is not in an "Active" or "Failed" status, False otherwise.
 
     Raises:
-        Exception: If the netbox_client request fails or returns a non-success status code.
+        StopIteration: If the server doesn't exist or its status is "Active" or "Failed".
     """
-    devices = netbox_client.dcim.devices.filter(hostname)
-
-    try:
-        device_info = next(devices.response)
-    except StopIteration:
+    if hostname not in device_statuses:
         raise StopIteration(f"There is not a server {hostname} in Netbox")
 
-    if device_info:
-        if device_info.get("status").get("label") not in ("Active", "Failed"):
-            return True
+    if device_statuses[hostname] not in ("Active", "Failed"):
+        return True
 
     raise StopIteration(
-        f"The device {hostname} status is {device_info.get('status').get('label')}. Stoping the installation"
+        f"The device {hostname} status is {device_statuses[hostname]}. Stoping the installation"
     )
 
 
-def check_netbox_ip(addresses, hostname):
+def check_netbox_ip(addresses, hostname, netbox_ips):
     """
     Check if the addresses provided already exists in the Netbox server
 
     Args:
         addresses (set): Set of addresses to validate.
         hostname (str): Hostname of the server to validate.
+        netbox_ips (dict): The addresses of every device in Netbox (see get_netbox_ips), it must include the addresses
+        and the hostname.
 
     Returns:
         bool: True if none of the addresses exist in the Netbox server, they are associated to the same hostname
@@ -229,26 +257,28 @@ def check_netbox_ip(addresses, hostname):
         StopIteration: The IP address already exists in the Netbox server and is associated to a different server than the
         hostname
     """
-    if not NETBOX_IPS:
+    if not any(netbox_ips.values()):
         logging.info(f"The server {hostname} doesn't have any IP associated")
         return True
 
-    if addresses == NETBOX_IPS[hostname]:
+    host_ips = netbox_ips.get(hostname, set())
+
+    if addresses == host_ips:
         logging.info(
             f"The IPs from the ISO-Automator are the same that in Netbox for host {hostname}"
         )
         return True
 
-    diff_ip = addresses - NETBOX_IPS[hostname]
+    diff_ip = addresses - host_ips
 
     if not diff_ip:
         logging.info(
             f"The IPs {addresses} are a subset of the ones in Netbox for server {hostname}"
         )
-        logging.warning(f"The IPs {NETBOX_IPS[hostname] - addresses} are missing !")
+        logging.warning(f"The IPs {host_ips - addresses} are missing !")
         return True
 
-    servers = [key for key, ip_set in NETBOX_IPS.items() if diff_ip.issubset(ip_set)]
+    servers = [key for key, ip_set in netbox_ips.items() if diff_ip.issubset(ip_set)]
 
     if not servers:
         logging.warning(
@@ -264,13 +294,19 @@ def check_netbox_ip(addresses, hostname):
         )
 
 
-def validate_netbox_security(hostname, addresses):
+def validate_netbox_security(
+    hostname, addresses, netbox_ips=None, device_statuses=None
+):
     """
     Checks for the existence and status of the server in Netbox.
 
     Args:
         hostname (str): Hostname of the server to validate.
-        token (str): Netbox's service Token
+        addresses (set): Set of addresses to validate.
+        netbox_ips (dict): IPAM index shared by several hosts (see get_netbox_ips). If it is not set, the addresses and
+        the hostname are looked up.
+        device_statuses (dict): Device statuses shared by several hosts (see get_device_statuses). If it is not set,
+        the hostname is looked up.
 
     Returns:
         bool: True if the server exists and is not in an "Active" or "Failed" status, False otherwise.
@@ -278,11 +314,14 @@ def validate_netbox_security(hostname, addresses):
     Raises:
         StopIteration: If the HTTP request fails or returns a non-success status code.
     """
-    netbox_client = pynetbox.api(NETBOX_URL, token=NETBOX_TOKEN)
+    if netbox_ips is None:
+        netbox_ips = get_netbox_ips(NETBOX_URL, NETBOX_TOKEN, addresses, [hostname])
+    if device_statuses is None:
+        device_statuses = get_device_statuses(NETBOX_URL, NETBOX_TOKEN, [hostname])
 
     try:
-        if check_netbox_hostname(netbox_client, hostname):
-            return check_netbox_ip(addresses, hostname)
+        if check_netbox_hostname(device_statuses, hostname):
+            return check_netbox_ip(addresses, hostname, netbox_ips)
     except StopIteration as error:
         raise error
     else:
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import aiohttp
+from server_management.base.session_cache import SessionCache
+
+# Keep-alive connections opened against the same BMC
+REDFISH_POOL_SIZE = int(os.getenv("REDFISH_POOL_SIZE", "4"))
+# Seconds before a Redfish request is considered failed
+REDFISH_TIMEOUT = int(os.getenv("REDFISH_TIMEOUT", "120"))
+
+
+class RedfishResponse:
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+
+class RedfishClient:
+    """
+    Asynchronous Redfish transport. There is one client per BMC and event loop, and every client keeps a pool of
+    keep-alive connections, so polling a BMC doesn't pay for a new TLS handshake on every request.
+
+    Requests are authenticated with basic auth, or with a Redfish session token taken from SessionCache when session
+    authentication is enabled for the BMC.
+    """
+
+    _clients = {}
+
+    def __init__(self, host, user, password, session_auth=False):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.base_url = f"https://{host}"
+        self.session_auth = session_auth
+        self._basic_auth = aiohttp.BasicAuth(user, password)
+        self._loop = asyncio.get_running_loop()
+        self._session = None
+        self._events = None
+        self._events_task = None
+
+    @classmethod
+    def get_client(cls, host, user, password, session_auth=False):
+        """
+        Returns the client of the BMC, creating it on first use. Must be called from a running event loop.
+        """
+        key = (host, user)
+        client = cls._clients.get(key)
+        if client is None or client._loop is not asyncio.get_running_loop():
+            client = cls(host, user, password, session_auth)
+            cls._clients[key] = client
+        client.session_auth = client.session_auth or session_auth
+        return client
+
+    @classmethod
+    async def close_all(cls):
+        """
+        Closes the connection pools of all the clients of the running event loop. A client that fails to close
+        doesn't keep the others open.
+        """
+        loop = asyncio.get_running_loop()
+        clients = [
+            (key, client)
+            for key, client in cls._clients.items()
+            if client._loop is loop
+        ]
+        results = await asyncio.gather(
+            *(client.close() for _, client in clients), return_exceptions=True
+        )
+        for (key, client), result in zip(clients, results):
+            del cls._clients[key]
+            if isinstance(result, Exception):
+                logging.warning(
+                    f"Unable to close the connections to {client.host}: {result}"
+                )
+        SessionCache.save_store()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                ssl=False, limit=REDFISH_POOL_SIZE, keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REDFISH_TIMEOUT),
+            )
+        return self._session
+
+    def _url(self, path):
+        if path.startswith("https://") or path.startswith("http://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    async def request(
+        self,
+        method,
+        path,
+        json=None,
+        headers=None,
+        raise_for_status=True,
+        authenticate=True,
+    ):
+        """
+        Sends a request to the BMC.
+
+        Args:
+            method (str): HTTP method.
+            path (str): Redfish path (e.g. /redfish/v1/Systems/1) or full URL.
+            json (dict): Body of the request.
+            headers (dict): Extra headers of the request.
+            raise_for_status (bool): Raises aiohttp.ClientResponseError if the BMC replies with an error status.
+            authenticate (bool): Adds the credentials of the client to the request.
+
+        Returns:
+            RedfishResponse: Status, headers and decoded JSON body (None if the body is not JSON).
+        """
+        request_headers = dict(headers or {})
+        token, auth = await self._credentials(request_headers, authenticate)
+        response = await self._get_session().request(
+            method, self._url(path), json=json, headers=request_headers, auth=auth
+        )
+        if response.status == 401 and token:
+            # The BMC closed the cached session, logs in again and retries once
+            response.release()
+            SessionCache.invalidate(self, token)
+            request_headers["X-Auth-Token"] = await SessionCache.get_token(self)
+            response = await self._get_session().request(
+                method, self._url(path), json=json, headers=request_headers
+            )
+        try:
+            try:
+                data = await response.json(content_type=None)
+            except ValueError:
+                data = None
+            if raise_for_status and response.status >= 400:
+                logging.debug(f"Redfish error from {self.host}: {data}")
+                response.raise_for_status()
+            return RedfishResponse(response.status, response.headers, data)
+        finally:
+            # Gives the connection back to the pool of the BMC
+            response.release()
+
+    async def _credentials(self, headers, authenticate):
+        """
+        Adds the session token to the headers when session authentication is enabled.
+
+        Returns:
+            tuple: The session token and the basic auth of the request (one of them is None).
+        """
+        if authenticate and self.session_auth:
+            token = await SessionCache.get_token(self)
+            headers["X-Auth-Token"] = token
+            return token, None
+        if authenticate:
+            return None, self._basic_auth
+        return None, None
+
+    async def subscribe_events(self):
+        """
+        Opens the Server-Sent Events stream of the BMC (EventService.ServerSentEventUri).
+
+        Returns:
+            asyncio.Event: Set every time the BMC sends an event, or None if the BMC doesn't support SSE.
+        """
+        if self._events is not None:
+            return self._events
+        try:
+            service = await self.get("/redfish/v1/EventService", raise_for_status=False)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logging.info(f"The EventService of {self.host} is not available: {error}")
+            return None
+        uri = (service.data or {}).get("ServerSentEventUri")
+        if service.status >= 400 or not uri:
+            return None
+        self._events = asyncio.Event()
+        self._events_task = asyncio.ensure_future(self._read_events(uri))
+        return self._events
+
+    async def _read_events(self, uri):
+        headers = {"Accept": "text/event-stream"}
+        try:
+            _, auth = await self._credentials(headers, authenticate=True)
+            response = await self._get_session().get(
+                self._url(uri),
+                headers=headers,
+                auth=auth,
+                timeout=aiohttp.ClientTimeout(total=None),
+            )
+            try:
+                response.raise_for_status()
+                async for line in response.content:
+                    if line.startswith(b"data:"):
+                        self._events.set()
+            finally:
+                response.release()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logging.info(f"The event stream of {self.host} was closed: {error}")
+        # Without stream the waiters go back to polling
+        self._events = None
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, json=None, **kwargs):
+        return await self.request("POST", path, json=json, **kwargs)
+
+    async def patch(self, path, json=None, **kwargs):
+        return await self.request("PATCH", path, json=json, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request("DELETE", path, **kwargs)
+
+    async def close(self):
+        if self._events_task is not None:
+            self._events_task.cancel()
+        if self._session is not None and not self._session.closed:
+            if self.session_auth:
+                await SessionCache.release(self)
+            await self._session.close()
@@ -1,39 +1,203 @@
+import asyncio
+import functools
+import logging
+import os
 from abc import ABC, abstractmethod
+from server_management.base.redfish_client import RedfishClient
+
+# First and maximum seconds between two checks of wait_for, the interval doubles after every check
+WAIT_INITIAL_INTERVAL = float(os.getenv("WAIT_INITIAL_INTERVAL", "2"))
+WAIT_MAX_INTERVAL = float(os.getenv("WAIT_MAX_INTERVAL", "30"))
+# Seconds to wait for a power transition of the server
+POWER_STATE_TIMEOUT = int(os.getenv("POWER_STATE_TIMEOUT", "300"))
+# Calls of a BMC operation before it is considered failed, see ServerBase.retry
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+# Wakes up the waiters with the Redfish EventService (SSE) of the BMCs that support it
+REDFISH_EVENTS = os.getenv("REDFISH_EVENTS", "").lower() in ["true", "1", "yes"]
 
 
 class ServerBase(ABC):
+    # Authenticates Redfish requests with a cached session token instead of basic auth
+    redfish_session_auth = False
+    # The driver manages the server through Redfish
+    redfish_driver = False
+
     def __init__(self, host, user, password, hostname):
         self.host = host
         self.hostname = hostname
         self.user = user
         self.password = password
 
+    @property
+    def redfish(self):
+        """
+        Redfish client of the BMC, shared by all the drivers that manage the same BMC.
+        """
+        return RedfishClient.get_client(
+            self.host, self.user, self.password, self.redfish_session_auth
+        )
+
+    @staticmethod
+    async def run_blocking(func, *args, **kwargs):
+        """
+        Runs a blocking BMC call in the event loop executor, so that several hosts can be managed at the same time.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(func, *args, **kwargs)
+        )
+
+    async def wait_for(
+        self,
+        condition,
+        timeout,
+        description,
+        initial_interval=WAIT_INITIAL_INTERVAL,
+        max_interval=WAIT_MAX_INTERVAL,
+    ):
+        """
+        Waits until a condition of the server is met. The condition is checked right away and then with an exponential
+        backoff, so fast hardware is not delayed by long fixed sleeps. If the BMC sends Redfish events, every event
+        triggers a new check before the end of the interval.
+
+        Args:
+            condition (coroutine function): Returns a truthy value when the condition is met.
+            timeout (float): Deadline in seconds.
+            description (str): Description of the condition, used for logging.
+            initial_interval (float): Seconds before the second check.
+            max_interval (float): Maximum seconds between two checks.
+
+        Returns:
+            The value returned by the condition.
+
+        Raises:
+            TimeoutError: If the condition is not met before the deadline.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interval = initial_interval
+        events = await self.subscribe_events()
+        while True:
+            if events is not None:
+                # Cleared before the check, so an event received during the check wakes the next wait
+                events.clear()
+            result = await condition()
+            if result:
+                return result
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"Host {self.hostname}: timeout after {timeout} seconds waiting for {description}"
+                )
+            logging.debug(f"Host {self.hostname}: waiting for {description}")
+            if events is not None:
+                try:
+                    await asyncio.wait_for(events.wait(), min(interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_interval)
+
+    async def wait_for_power_state(self, state, timeout=POWER_STATE_TIMEOUT):
+        """
+        Waits until the power state of the server is `state` (e.g. On, Off).
+        """
+
+        async def has_power_state():
+            return str(await self.get_power_status()).lower() == state.lower()
+
+        await self.wait_for(has_power_state, timeout, f"power state {state}")
+
+    async def ensure_power_off(self):
+        """
+        Powers off the server if it is on, and waits until it is off.
+        """
+        if str(await self.get_power_status()).lower() == "on":
+            logging.info(f"Powering off the server {self.hostname}")
+            await self.power_off()
+            await self.wait_for_power_state("Off")
+
+    async def retry(
+        self, operation, description, attempts=RETRY_ATTEMPTS, on_error=None
+    ):
+        """
+        Calls an operation of the BMC until it succeeds. The attempts are spaced with the exponential backoff of
+        wait_for, and the sleeps don't block the other hosts.
+
+        Args:
+            operation (coroutine function): The operation, called without arguments.
+            description (str): Description of the operation, used for logging.
+            attempts (int): Maximum number of calls.
+            on_error (coroutine function): Called after every failed attempt but the last, e.g. ensure_power_off.
+
+        Returns:
+            The value returned by the operation.
+
+        Raises:
+            Exception: If all the attempts fail.
+        """
+        interval = WAIT_INITIAL_INTERVAL
+        for attempt in range(1, attempts + 1):
+            try:
+                return await operation()
+            except Exception as error:
+                logging.error(
+                    f"Host {self.hostname}: {description} failed ({attempt}/{attempts}): {error}"
+                )
+                if attempt == attempts:
+                    raise Exception(
+                        f"Host {self.hostname}: {description} failed after {attempts} attempts"
+                    ) from error
+            if on_error is not None:
+                await on_error()
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, WAIT_MAX_INTERVAL)
+        return None
+
+    async def subscribe_events(self):
+        """
+        Returns:
+            asyncio.Event: Set when the BMC sends a Redfish event, or None if events are disabled or not supported.
+        """
+        if not (REDFISH_EVENTS and self.redfish_driver):
+            return None
+        return await self.redfish.subscribe_events()
+
+    async def get_inventory(self):
+        """
+        Returns:
+            dict: The data of the server that doesn't change between runs: its "serial" and, if the BMC reports them
+            in the same request, its "model" and "boot_mode".
+        """
+        return {"serial": await self.get_serial_number()}
+
     @abstractmethod
-    def get_power_status(self):
+    async def get_power_status(self):
         pass
 
     @abstractmethod
-    def get_serial_number(self):
+    async def get_serial_number(self):
         pass
 
     @abstractmethod
-    def power_on(self):
+    async def power_on(self):
         pass
 
     @abstractmethod
-    def power_off(self):
+    async def power_off(self):
         pass
 
     @abstractmethod
-    def insert_virtual_media(self, iso_url):
+    async def insert_virtual_media(self, iso_url):
         pass
 
     @abstractmethod
-    def eject_virtual_media(self):
+    async def eject_virtual_media(self):
         pass
 
     @abstractmethod
-    def config_virtual_media(self):
+    async def config_virtual_media(self):
         pass
 
     @abstractmethod
@@ -41,9 +205,9 @@ class ServerBase(ABC):
         pass
 
     @abstractmethod
-    def set_uefi_mode(self):
+    async def set_uefi_mode(self):
         pass
 
     @abstractmethod
-    def check_boot_options(self):
+    async def check_boot_options(self):
         pass
@@ -1,16 +1,52 @@
-from server_management.dell.dell_idrac import Idrac
-from server_management.xfusion.xfusion_ibmc import Ibmc
-from server_management.hp.hp_ilo import Ilo
+import functools
+import importlib
+from importlib.metadata import entry_points
+
+# Drivers shipped with the iso-installer, by management type. The modules are only imported when a host of servers.yml
+# uses their management type.
+DRIVERS = {
+    "idrac": "server_management.dell.dell_idrac:Idrac",
+    "ilo": "server_management.hp.hp_ilo:Ilo",
+    "ibmc": "server_management.xfusion.xfusion_ibmc:Ibmc",
+    "redfish": "server_management.redfish.redfish_server:Redfish",
+}
+# Entry point group of the drivers of other packages, the name of the entry point is the management type
+DRIVERS_ENTRY_POINT_GROUP = "iso_automator.server_drivers"
+
+
+def _driver_entry_point(management_type):
+    group = entry_points()
+    # Python < 3.10 returns a dict of groups
+    if hasattr(group, "select"):
+        group = group.select(group=DRIVERS_ENTRY_POINT_GROUP)
+    else:
+        group = group.get(DRIVERS_ENTRY_POINT_GROUP, [])
+    return next(
+        (entry_point for entry_point in group if entry_point.name == management_type),
+        None,
+    )
 
 
 class ServerFactory:
     @staticmethod
-    def get_server(management_type, host, user, password, hostname):
-        if management_type == "idrac":
-            return Idrac(host, user, password, hostname)
-        elif management_type == "ilo":
-            return Ilo(host, user, password, hostname)
-        elif management_type == "ibmc":
-            return Ibmc(host, user, password, hostname)
-        else:
+    @functools.lru_cache(maxsize=None)
+    def get_driver(management_type):
+        """
+        Imports the driver class of a management type, from DRIVERS or from the entry points of the
+        iso_automator.server_drivers group.
+
+        Raises:
+            ValueError: If no driver is registered for the management type.
+        """
+        if management_type in DRIVERS:
+            module_name, class_name = DRIVERS[management_type].split(":")
+            return getattr(importlib.import_module(module_name), class_name)
+        entry_point = _driver_entry_point(management_type)
+        if entry_point is None:
             raise ValueError(f"Unsupported provider: {management_type}")
+        return entry_point.load()
+
+    @staticmethod
+    def get_server(management_type, host, user, password, hostname):
+        driver = ServerFactory.get_driver(management_type)
+        return driver(host, user, password, hostname)
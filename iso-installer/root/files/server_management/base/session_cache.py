@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+# Seconds a Redfish session is reused after its last request. Must be lower than the session timeout of the BMCs.
+REDFISH_SESSION_TTL = int(os.getenv("REDFISH_SESSION_TTL", "1200"))
+# Optional file where the sessions are kept between runs instead of being closed on shutdown
+REDFISH_SESSION_STORE = os.getenv("REDFISH_SESSION_STORE", "")
+
+
+class SessionCache:
+    """
+    Redfish session tokens (X-Auth-Token) keyed by BMC address and user. Every driver and every phase of the installer
+    that talks to the same BMC reuses one session instead of creating a new login, which would leak sessions until they
+    time out on the BMC.
+    """
+
+    _sessions = {}
+    _locks = {}
+    _store_loaded = False
+
+    @staticmethod
+    def _key(client):
+        return f"{client.user}@{client.host}"
+
+    @classmethod
+    def _lock(cls, key):
+        if key not in cls._locks:
+            cls._locks[key] = asyncio.Lock()
+        return cls._locks[key]
+
+    @classmethod
+    def _load_store(cls):
+        if cls._store_loaded or not REDFISH_SESSION_STORE:
+            return
+        cls._store_loaded = True
+        try:
+            with open(REDFISH_SESSION_STORE) as file:
+                sessions = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError as error:
+            logging.warning(f"Ignoring the Redfish session store: {error}")
+            return
+        now = time.time()
+        for key, session in sessions.items():
+            if session["expires"] > now:
+                cls._sessions.setdefault(key, session)
+
+    @classmethod
+    def save_store(cls):
+        """
+        Called once on shutdown: writes the valid sessions to the on-disk store, if it is enabled.
+        """
+        if not REDFISH_SESSION_STORE:
+            return
+        now = time.time()
+        sessions = {
+            key: session
+            for key, session in cls._sessions.items()
+            if session["expires"] > now
+        }
+        temporary_path = f"{REDFISH_SESSION_STORE}.{os.getpid()}.tmp"
+        try:
+            # Tokens are credentials, the file is only readable by its owner
+            file_descriptor = os.open(
+                temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(file_descriptor, "w") as file:
+                json.dump(sessions, file)
+            os.replace(temporary_path, REDFISH_SESSION_STORE)
+        except OSError as error:
+            logging.warning(f"Unable to write the Redfish session store: {error}")
+
+    @classmethod
+    async def get_token(cls, client):
+        """
+        Returns a valid session token for the BMC of the client, logging in only if there is no cached session.
+        """
+        key = cls._key(client)
+        async with cls._lock(key):
+            cls._load_store()
+            session = cls._sessions.get(key)
+            if session and session["expires"] > time.time():
+                session["expires"] = time.time() + REDFISH_SESSION_TTL
+                return session["token"]
+
+            logging.info(f"Creating a Redfish session on {client.host}")
+            response = await client.request(
+                "POST",
+                "/redfish/v1/SessionService/Sessions",
+                json={"UserName": client.user, "Password": client.password},
+                headers={"Content-Type": "application/json"},
+                authenticate=False,
+            )
+            location = response.headers.get("Location") or (response.data or {}).get(
+                "@odata.id"
+            )
+            cls._sessions[key] = {
+                "token": response.headers["X-Auth-Token"],
+                "location": location,
+                "expires": time.time() + REDFISH_SESSION_TTL,
+            }
+            return cls._sessions[key]["token"]
+
+    @classmethod
+    def invalidate(cls, client, token):
+        """
+        Forgets the session of the BMC, e.g. after the BMC rejected its token.
+        """
+        key = cls._key(client)
+        session = cls._sessions.get(key)
+        if session and session["token"] == token:
+            del cls._sessions[key]
+
+    @classmethod
+    async def release(cls, client):
+        """
+        Called on shutdown: keeps the session for the on-disk store if it is enabled (see save_store), otherwise logs
+        out of the BMC so that the session doesn't take a slot of its session table until it times out.
+        """
+        key = cls._key(client)
+        if REDFISH_SESSION_STORE:
+            return
+        session = cls._sessions.pop(key, None)
+        if not session or not session["location"]:
+            return
+        try:
+            await client.request(
+                "DELETE",
+                session["location"],
+                headers={"X-Auth-Token": session["token"]},
+                raise_for_status=False,
+                authenticate=False,
+            )
+        except Exception as error:
+            logging.warning(
+                f"Unable to close the Redfish session on {client.host}: {error}"
+            )
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+
+# Seconds between two polls of the outstanding Redfish tasks
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "2"))
+# Seconds before an outstanding Redfish task is considered failed
+TASK_TIMEOUT = int(os.getenv("TASK_TIMEOUT", "200"))
+# Task states after which a Redfish task doesn't change anymore
+FINISHED_TASK_STATES = ("Completed", "Exception", "Killed", "Cancelled")
+
+
+def _task_message(task):
+    """
+    Returns:
+        dict: Last message of a Redfish task (xFusion BMCs return a single message instead of a list).
+    """
+    messages = task.get("Messages") or {}
+    if isinstance(messages, list):
+        messages = messages[-1] if messages else {}
+    return messages
+
+
+def _task_result(task):
+    """
+    Returns:
+        dict: Status and message of a finished task, None if the task is still running.
+    """
+    messages = _task_message(task)
+    message = messages.get("Message", "")
+    if messages.get("Severity") == "OK":
+        return {"status": True, "message": message}
+    if task.get("TaskState") in FINISHED_TASK_STATES:
+        success = task["TaskState"] == "Completed" and task.get("TaskStatus") == "OK"
+        return {"status": success, "message": message or task["TaskState"]}
+    return None
+
+
+class TaskMonitor:
+    """
+    Tracks the outstanding Redfish tasks of all the BMCs. A single coroutine polls every outstanding task at once on
+    each interval and resolves the future of the task when it finishes, so waiting for the tasks of many servers costs
+    the same as waiting for the slowest one.
+    """
+
+    _monitors = {}
+
+    def __init__(self):
+        self._tasks = {}
+        self._poller = None
+
+    @classmethod
+    def get_monitor(cls):
+        """
+        Returns the monitor of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in cls._monitors:
+            cls._monitors[loop] = cls()
+        return cls._monitors[loop]
+
+    def track(self, client, task_uri, timeout=TASK_TIMEOUT):
+        """
+        Starts tracking a Redfish task.
+
+        Args:
+            client (RedfishClient): Client of the BMC that runs the task.
+            task_uri (str): Redfish path of the task (e.g. /redfish/v1/TaskService/Tasks/1).
+            timeout (float): Seconds before the task is considered failed.
+
+        Returns:
+            asyncio.Future: Resolved with {"status": bool, "message": str} when the task finishes.
+        """
+        key = (client.host, task_uri)
+        if key not in self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks[key] = {
+                "client": client,
+                "uri": task_uri,
+                "future": loop.create_future(),
+                "deadline": loop.time() + timeout,
+                "message": "",
+            }
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll())
+        return self._tasks[key]["future"]
+
+    async def wait(self, client, task_uri, timeout=TASK_TIMEOUT):
+        return await self.track(client, task_uri, timeout)
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        while self._tasks:
+            await asyncio.sleep(TASK_POLL_INTERVAL)
+            tasks = list(self._tasks.items())
+            responses = await asyncio.gather(
+                *(
+                    task["client"].get(task["uri"], raise_for_status=False)
+                    for _, task in tasks
+                ),
+                return_exceptions=True,
+            )
+            for (key, task), response in zip(tasks, responses):
+                result = None
+                if isinstance(response, Exception):
+                    logging.warning(
+                        f"Unable to get the task {task['uri']} of {task['client'].host}: {response}"
+                    )
+                elif response.data:
+                    result = _task_result(response.data)
+                    task["message"] = _task_message(response.data).get(
+                        "Message", task["message"]
+                    )
+                if result is None and loop.time() >= task["deadline"]:
+                    result = {
+                        "status": False,
+                        "message": task["message"]
+                        or f"Timeout waiting for the task {task['uri']}",
+                    }
+                if result is not None:
+                    del self._tasks[key]
+                    if not task["future"].done():
+                        task["future"].set_result(result)
@@ -1,77 +1,73 @@
-import requests
-from requests.auth import HTTPBasicAuth
+import aiohttp
 from server_management.base.server_base import ServerBase
 import logging
-import time
+import asyncio
+import os
+
+# Uses X-Auth-Token sessions instead of basic auth on every request
+IDRAC_SESSION_AUTH = os.getenv("IDRAC_SESSION_AUTH", "").lower() in ["true", "1", "yes"]
+# Maximum seconds between the power on and the boot from virtual media
+VIRTUAL_MEDIA_BOOT_TIMEOUT = int(os.getenv("VIRTUAL_MEDIA_BOOT_TIMEOUT", "300"))
+# BootProgress states reported once the server is booting the OS loader
+OS_BOOT_STATES = ("OSBootStarted", "OSRunning")
 
 
 class Idrac(ServerBase):
+    redfish_session_auth = IDRAC_SESSION_AUTH
+    redfish_driver = True
+
     def __init__(self, host, user, password, hostname):
         super().__init__(host, user, password, hostname)
         self.urls = {
-            "system_info": f"https://{self.host}/redfish/v1/Systems/System.Embedded.1",
-            "system_power": f"https://{self.host}/redfish/v1/Systems/System.Embedded.1/Actions"
-            f"/ComputerSystem.Reset",
-            "insert_virtual_media": f"https://{self.host}/redfish/v1/Managers/iDRAC.Embedded.1/VirtualMedia"
-            f"/CD/Actions/VirtualMedia.InsertMedia",
-            "eject_virtual_media": f"https://{self.host}/redfish/v1/Managers/iDRAC.Embedded.1/VirtualMedia"
-            f"/CD/Actions/VirtualMedia.EjectMedia",
-            "config_virtual_media": f"https://{self.host}/redfish/v1/Managers/iDRAC.Embedded.1/Actions/Oem"
-            f"/EID_674_Manager.ImportSystemConfiguration",
-            "boot_info": f"https://{self.host}/redfish/v1/Systems/System.Embedded.1/BootOptions",
+            "system_info": "/redfish/v1/Systems/System.Embedded.1",
+            "system_power": "/redfish/v1/Systems/System.Embedded.1/Actions"
+            "/ComputerSystem.Reset",
+            "insert_virtual_media": "/redfish/v1/Managers/iDRAC.Embedded.1/VirtualMedia"
+            "/CD/Actions/VirtualMedia.InsertMedia",
+            "eject_virtual_media": "/redfish/v1/Managers/iDRAC.Embedded.1/VirtualMedia"
+            "/CD/Actions/VirtualMedia.EjectMedia",
+            "config_virtual_media": "/redfish/v1/Managers/iDRAC.Embedded.1/Actions/Oem"
+            "/EID_674_Manager.ImportSystemConfiguration",
+            "boot_info": "/redfish/v1/Systems/System.Embedded.1/BootOptions",
         }
 
-    def get_power_status(self):
+    async def get_power_status(self):
         url = self.urls["system_info"]
-        response = requests.get(
-            url, auth=HTTPBasicAuth(self.user, self.password), verify=False
-        )
         try:
-            response.raise_for_status()
-            status = response.json()["PowerState"]
-        except requests.exceptions.HTTPError as error:
+            response = await self.redfish.get(url)
+            status = response.data["PowerState"]
+        except aiohttp.ClientResponseError as error:
             status = error
         return status
 
-    def get_serial_number(self):
+    async def get_serial_number(self):
         url = self.urls["system_info"]
-        response = requests.get(
-            url,
-            auth=HTTPBasicAuth(self.user, self.password),
-            verify=False,
-        )
-        response.raise_for_status()
-        return response.json()["SKU"]
+        response = await self.redfish.get(url)
+        return response.data["SKU"]
 
-    def power_on(self):
+    async def get_inventory(self):
+        response = await self.redfish.get(self.urls["system_info"])
+        return {
+            "serial": response.data["SKU"],
+            "model": response.data.get("Model"),
+            "boot_mode": response.data.get("Boot", {}).get("BootSourceOverrideMode"),
+        }
+
+    async def power_on(self):
         url = self.urls["system_power"]
         requests_body = {"ResetType": "On"}
-        response = requests.post(
-            url,
-            auth=HTTPBasicAuth(self.user, self.password),
-            json=requests_body,
-            verify=False,
-        )
-        response.raise_for_status()
+        await self.redfish.post(url, json=requests_body)
 
-    def insert_virtual_media(self, iso_url):
+    async def insert_virtual_media(self, iso_url):
         url = self.urls["insert_virtual_media"]
         requests_body = {"Image": f"{iso_url}"}
-        response = requests.post(
-            url,
-            auth=HTTPBasicAuth(self.user, self.password),
-            json=requests_body,
-            verify=False,
-        )
-        response.raise_for_status()
+        await self.redfish.post(url, json=requests_body)
 
-    def eject_virtual_media(self):
+    async def eject_virtual_media(self):
         url = self.urls["eject_virtual_media"]
-        requests.post(
-            url, auth=HTTPBasicAuth(self.user, self.password), json={}, verify=False
-        )
+        await self.redfish.post(url, json={}, raise_for_status=False)
 
-    def config_virtual_media(self):
+    async def config_virtual_media(self):
         url = self.urls["config_virtual_media"]
         headers = {
             "Content-Type": "application/json",
@@ -83,16 +79,9 @@ class Idrac(ServerBase):
             "ImportBuffer": "<SystemConfiguration><Component FQDD=\"iDRAC.Embedded.1\"><Attribute Name=\"ServerBoot.1#BootOnce\">Enabled</Attribute><Attribute Name=\"ServerBoot.1#FirstBootDevice\">VCD-DVD</Attribute></Component></SystemConfiguration>",
         }
         # fmt: on
-        response = requests.post(
-            url,
-            auth=HTTPBasicAuth(self.user, self.password),
-            json=requests_body,
-            headers=headers,
-            verify=False,
-        )
-        response.raise_for_status()
+        await self.redfish.post(url, json=requests_body, headers=headers)
 
-    def __set_hdd_as_next_boot_device(self):
+    async def __set_hdd_as_next_boot_device(self):
         url = self.urls["system_info"]
         headers = {
             "Content-Type": "application/json",
@@ -103,62 +92,70 @@ class Idrac(ServerBase):
                 "BootSourceOverrideEnabled": "Continuous",
             }
         }
-        response = requests.patch(
-            url,
-            auth=HTTPBasicAuth(self.user, self.password),
-            json=requests_body,
-            headers=headers,
-            verify=False,
-        )
-        response.raise_for_status()
+        await self.redfish.patch(url, json=requests_body, headers=headers)
 
-    def power_off(self):
+    async def power_off(self):
         url = self.urls["system_power"]
         requests_body = {"ResetType": "ForceOff"}
-        response = requests.post(
-            url,
-            auth=HTTPBasicAuth(self.user, self.password),
-            json=requests_body,
-            verify=False,
-        )
-        response.raise_for_status()
+        await self.redfish.post(url, json=requests_body)
+
+    async def __wait_for_virtual_media_boot(self):
+        """
+        Waits until the server starts booting from the virtual media, using the BootProgress of the system. If the
+        iDRAC doesn't report it, waits VIRTUAL_MEDIA_BOOT_TIMEOUT seconds.
+        """
+        previous_states = []
+
+        async def boot_started():
+            response = await self.redfish.get(
+                self.urls["system_info"], raise_for_status=False
+            )
+            boot_progress = (response.data or {}).get("BootProgress") or {}
+            last_state = boot_progress.get("LastState")
+            if last_state in OS_BOOT_STATES:
+                # Right after the power on, the state of the previous boot can still be reported
+                return bool(previous_states)
+            if last_state:
+                previous_states.append(last_state)
+            return False
+
+        try:
+            await self.wait_for(
+                boot_started, VIRTUAL_MEDIA_BOOT_TIMEOUT, "the boot from virtual media"
+            )
+        except TimeoutError:
+            logging.info(
+                f"Host {self.hostname}: BootProgress not reported, assuming the server booted from virtual media"
+            )
 
     async def power_on_server_after_media_config(self):
-        attempts = 0
-        if self.get_power_status() == "Off":
+        power_status = await self.get_power_status()
+        if power_status == "Off":
             logging.info(f"Powering on the Host: {self.hostname}")
-            self.power_on()
-        elif self.get_power_status() == "On":
+            await self.power_on()
+        elif power_status == "On":
             logging.info(f"Rebooting Host: {self.hostname}")
-            self.power_off()
-            while attempts < 3:
-                time.sleep(60)
-                if self.get_power_status() == "Off":
-                    self.power_on()
-                    break
-                attempts += 1
-        # sleep 5 minutes until the server starts booting from virtual media
-        time.sleep(300)
-        self.__set_hdd_as_next_boot_device()
-
-    def check_boot_options(self):
+            await self.power_off()
+            await self.wait_for_power_state("Off")
+            await self.power_on()
+        await self.__wait_for_virtual_media_boot()
+        await self.__set_hdd_as_next_boot_device()
+
+    async def check_boot_options(self):
         url = self.urls["boot_info"]
-        response_json = requests.get(
-            url,
-            auth=HTTPBasicAuth(self.user, self.password),
-            verify=False,
-        ).json()
-        for item in response_json["Members"]:
-            url = f"https://{self.host}{item['@odata.id']}"
-            response_data = requests.get(
-                url,
-                auth=HTTPBasicAuth(self.user, self.password),
-                verify=False,
-            ).json()["DisplayName"]
+        response_json = (await self.redfish.get(url, raise_for_status=False)).data
+        boot_options = await asyncio.gather(
+            *(
+                self.redfish.get(item["@odata.id"], raise_for_status=False)
+                for item in response_json["Members"]
+            )
+        )
+        for boot_option in boot_options:
+            response_data = boot_option.data["DisplayName"]
             if "ubuntu" in response_data.lower():
                 raise Exception(
                     f"There is a ubuntu installation in Boot Option of the host {self.hostname}. UEFI Boot option: {response_data}"
                 )
 
-    def set_uefi_mode(self):
+    async def set_uefi_mode(self):
         pass
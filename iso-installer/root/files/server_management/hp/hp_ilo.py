@@ -1,105 +1,276 @@
-from hpilo import Ilo as Ilo_lib
-from server_management.base.server_base import ServerBase
+import functools
 import logging
+import os
 import time
+from server_management.base.server_base import ServerBase
+from server_management.redfish.redfish_server import Redfish
+
+# Manages the iLOs through Redfish, the operations that the Redfish service of the iLO lacks fall back to RIBCL
+ILO_REDFISH = os.getenv("ILO_REDFISH", "").lower() in ["true", "1", "yes"]
+# Uses X-Auth-Token sessions instead of basic auth on every Redfish request
+ILO_SESSION_AUTH = os.getenv("ILO_SESSION_AUTH", "true").lower() in ["true", "1", "yes"]
+# Seconds a power state read from the iLO is reused
+ILO_POWER_STATE_TTL = float(os.getenv("ILO_POWER_STATE_TTL", "2"))
+# Reset types used to reboot a server that is on, in order of preference
+RESTART_RESET_TYPES = ("ForceRestart", "PowerCycle")
+
+
+def _virtual_media_error(hostname, error):
+    if "VIRTUAL_MEDIA_PRIV" in str(error) or "InsufficientPrivilege" in str(error):
+        return Exception(
+            f"ERROR: The user of the host {hostname} doesn't have the privilege "
+            "VIRTUAL_MEDIA_PRIV. This is a protection mechanism. "
+            "DO NOT ACTIVATE THIS PRIVILEGE UNLESS YOU KNOW WHAT YOU'RE DOING."
+        )
+    return Exception(f"ERROR: The user of the host {hostname}\n{str(error)}")
+
+
+def _ribcl_fallback(capability=None):
+    """
+    Runs the method of IloRibcl instead if the iLO is not managed through Redfish, or if its Redfish service lacks
+    the capability used by the method (see redfish_capabilities).
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if await self.has_redfish(capability):
+                return await method(self, *args, **kwargs)
+            try:
+                return await getattr(self.ribcl, method.__name__)(*args, **kwargs)
+            finally:
+                # RIBCL operations can change the power state without going through the Redfish reset
+                self._power_state = None
+
+        return wrapper
+
+    return decorator
 
 
-class Ilo(ServerBase):
+class IloRibcl(ServerBase):
+    """
+    HP driver over RIBCL, for the iLOs without Redfish. The hpilo library is blocking, so every call runs in the
+    event loop executor.
+    """
+
     def __init__(self, host, user, password, hostname):
         super().__init__(host, user, password, hostname)
+        # pylint: disable=import-outside-toplevel
+        # hpilo is only needed by the iLOs without Redfish
+        from hpilo import Ilo as Ilo_lib
+
         self.ilo = Ilo_lib(self.host, self.user, self.password)
 
-    def get_power_status(self):
-        return self.ilo.get_host_power_status()
+    async def get_power_status(self):
+        return await self.run_blocking(self.ilo.get_host_power_status)
 
-    def get_serial_number(self):
-        return self.ilo.get_host_data()[1]["Serial Number"]
+    async def get_serial_number(self):
+        return (await self.run_blocking(self.ilo.get_host_data))[1]["Serial Number"]
 
-    def power_on(self):
-        self.ilo.set_host_power(host_power=True)
+    async def get_inventory(self):
+        system = (await self.run_blocking(self.ilo.get_host_data))[1]
+        return {"serial": system["Serial Number"], "model": system.get("Product Name")}
 
-    def insert_virtual_media(self, iso_url):
+    async def power_on(self):
+        await self.run_blocking(self.ilo.set_host_power, host_power=True)
+
+    async def insert_virtual_media(self, iso_url):
         try:
-            self.ilo.insert_virtual_media("cdrom", f"{iso_url}")
+            await self.run_blocking(
+                self.ilo.insert_virtual_media, "cdrom", f"{iso_url}"
+            )
         except Exception as error:
-            if "VIRTUAL_MEDIA_PRIV" in str(error):
-                error_msg = (
-                    f"ERROR: The user of the host {self.hostname} doesn't have the privilege "
-                    "VIRTUAL_MEDIA_PRIV. This is a protection mechanism. "
-                    "DO NOT ACTIVATE THIS PRIVILEGE UNLESS YOU KNOW WHAT YOU'RE DOING."
-                )
-            else:
-                error_msg = f"ERROR: The user of the host {self.hostname}\n{str(error)}"
-            raise Exception(error_msg)
-        self.ilo.set_vm_status(
-            device="cdrom", boot_option="boot_always", write_protect=True
+            raise _virtual_media_error(self.hostname, error) from error
+        await self.run_blocking(
+            self.ilo.set_vm_status,
+            device="cdrom",
+            boot_option="boot_always",
+            write_protect=True,
         )
 
-    def set_uefi_mode(self):
+    async def set_uefi_mode(self):
         logging.info(f"Configuring UEFI mode on the {self.hostname} server")
-        if self.ilo.get_current_boot_mode() == "UEFI":
+        if await self.run_blocking(self.ilo.get_current_boot_mode) == "UEFI":
             return
         logging.info(
             f"The server {self.hostname} is not in UEFI mode. Trying to set UEFI mode."
         )
-        attempts = 0
-        success = False
-        while attempts < 3 and not success:
-            try:
-                self.ilo.set_pending_boot_mode("UEFI")
-                success = True
-            except Exception as error:
-                logging.error(error)
-
-                if self.ilo.get_host_power_status() == "ON":
-                    logging.info(f"Powering off the server {self.hostname}")
-                    self.ilo.set_host_power(host_power=False)
-                    logging.info("Waiting 60 seconds..")
-                    time.sleep(60)
-
-                attempts += 1
-        if not success:
-            raise Exception(f"The server {self.host} gets 3 attempts")
+        await self.retry(
+            lambda: self.run_blocking(self.ilo.set_pending_boot_mode, "UEFI"),
+            "setting the UEFI mode",
+            on_error=self.ensure_power_off,
+        )
 
-    def eject_virtual_media(self):
+    async def eject_virtual_media(self):
         pass
 
-    def config_virtual_media(self):
-        attempts = 0
-        success = False
+    async def config_virtual_media(self):
         logging.info(f"Configuring virtual media on the {self.hostname} server")
+        await self.retry(
+            lambda: self.run_blocking(self.ilo.set_one_time_boot, "cdrom"),
+            "configuring the virtual media",
+            on_error=self.ensure_power_off,
+        )
+
+    async def power_off(self):
+        await self.run_blocking(self.ilo.set_host_power, host_power=False)
+
+    async def check_boot_options(self):
+        for item in await self.run_blocking(self.ilo.get_persistent_boot):
+            if "ubuntu" in item:
+                raise Exception(
+                    f"There is a ubuntu boot in the host {self.hostname}. BOOT OPTION: {item}"
+                )
+
+    async def power_on_server_after_media_config(self):
+        power_status = await self.get_power_status()
+        if power_status == "OFF":
+            logging.info(f"Powering on the Host: {self.hostname}")
+            await self.power_on()
+        elif power_status == "ON":
+            logging.info(f"Rebooting Host: {self.hostname}")
+            await self.run_blocking(self.ilo.warm_boot_server)
 
-        while attempts < 3 and not success:
+
+class Ilo(Redfish):
+    """
+    HP driver. With ILO_REDFISH, the iLO is managed through its Redfish service with the pooled connections and
+    sessions of the other Redfish drivers. Otherwise, and for the operations whose resources the Redfish service of
+    the iLO lacks (e.g. the BIOS of the iLO 4), it is managed with RIBCL (IloRibcl).
+    """
+
+    redfish_session_auth = ILO_SESSION_AUTH
+    # The boot mode of the iLOs is a BIOS setting, see set_uefi_mode
+    boot_override_mode = False
+
+    def __init__(self, host, user, password, hostname):
+        super().__init__(host, user, password, hostname)
+        self._redfish = None if ILO_REDFISH else False
+        self._ribcl = None
+        # Last power state read from the iLO and when it was read
+        self._power_state = None
+
+    @property
+    def ribcl(self):
+        if self._ribcl is None:
+            self._ribcl = IloRibcl(self.host, self.user, self.password, self.hostname)
+        return self._ribcl
+
+    async def has_redfish(self, capability=None):
+        """
+        Args:
+            capability (str): Capability of the Redfish service needed by the operation, e.g. "reset".
+
+        Returns:
+            bool: The iLO is managed through Redfish and its Redfish service has the capability. The Redfish service
+            is probed on the first call.
+        """
+        if self._redfish is None:
             try:
-                self.ilo.set_one_time_boot("cdrom")
-                success = True
+                await self.get_capabilities()
+                self._redfish = True
             except Exception as error:
-                logging.error(error)
-                if self.ilo.get_host_power_status() == "ON":
-                    logging.info(f"Powering off the server {self.hostname}")
-                    self.ilo.set_host_power(host_power=False)
-                    logging.info("Waiting 15 seconds..")
-                    time.sleep(15)
+                logging.info(
+                    f"Host {self.hostname}: the iLO has no Redfish service, using RIBCL. {error}"
+                )
+                self._redfish = False
+        if not self._redfish or capability is None:
+            return self._redfish
+        return bool((await self.get_capabilities()).get(capability))
 
-                attempts += 1
+    async def get_power_status(self):
+        """
+        Returns the power state of the server (On, Off). A state read less than ILO_POWER_STATE_TTL seconds ago is
+        reused, as the same phase often reads it several times in a row.
+        """
+        if self._power_state is not None:
+            power_state, read_time = self._power_state
+            if time.monotonic() - read_time < ILO_POWER_STATE_TTL:
+                return power_state
+        if await self.has_redfish():
+            power_state = await super().get_power_status()
+        else:
+            power_state = await self.ribcl.get_power_status()
+        if isinstance(power_state, str):
+            # RIBCL reports ON and OFF
+            power_state = power_state.capitalize()
+            self._power_state = (power_state, time.monotonic())
+        return power_state
 
-        if not success:
-            raise Exception(f"The server {self.hostname} gets 3 attempts")
+    async def _reset(self, reset_types):
+        try:
+            await super()._reset(reset_types)
+        finally:
+            self._power_state = None
 
-    def power_off(self):
-        self.ilo.set_host_power(host_power=False)
+    @_ribcl_fallback()
+    async def get_serial_number(self):
+        return await super().get_serial_number()
 
-    def check_boot_options(self):
-        for item in self.ilo.get_persistent_boot():
-            if "ubuntu" in item:
-                raise Exception(
-                    f"There is a ubuntu boot in the host {self.hostname}. BOOT OPTION: {item}"
-                )
+    @_ribcl_fallback()
+    async def get_inventory(self):
+        return await super().get_inventory()
+
+    @_ribcl_fallback("reset")
+    async def power_on(self):
+        await super().power_on()
+
+    @_ribcl_fallback("reset")
+    async def power_off(self):
+        await super().power_off()
+
+    @_ribcl_fallback("virtual_media")
+    async def insert_virtual_media(self, iso_url):
+        try:
+            await super().insert_virtual_media(iso_url)
+        except Exception as error:
+            raise _virtual_media_error(self.hostname, error) from error
+
+    @_ribcl_fallback("virtual_media")
+    async def eject_virtual_media(self):
+        await super().eject_virtual_media()
+
+    # iLO 4 only reports its BIOS settings in its OEM resources
+    @_ribcl_fallback("bios")
+    async def set_uefi_mode(self):
+        logging.info(f"Configuring UEFI mode on the {self.hostname} server")
+        bios = await self._request("GET", lambda caps: caps["bios"]["path"])
+        if (bios.data or {}).get("Attributes", {}).get("BootMode") == "Uefi":
+            return
+        logging.info(
+            f"The server {self.hostname} is not in UEFI mode. Trying to set UEFI mode."
+        )
+        # The pending BIOS setting is applied by the reboot of power_on_server_after_media_config
+        await self.retry(
+            lambda: self._patch(
+                lambda caps: caps["bios"]["settings"],
+                {"Attributes": {"BootMode": "Uefi"}},
+                "BIOS settings",
+            ),
+            "setting the UEFI mode",
+            on_error=self.ensure_power_off,
+        )
+
+    # The one-time boot goes with the virtual media inserted by the same protocol
+    @_ribcl_fallback("virtual_media")
+    async def config_virtual_media(self):
+        logging.info(f"Configuring virtual media on the {self.hostname} server")
+        await self.retry(
+            super().config_virtual_media,
+            "configuring the virtual media",
+            on_error=self.ensure_power_off,
+        )
+
+    @_ribcl_fallback("boot_options")
+    async def check_boot_options(self):
+        await super().check_boot_options()
 
+    @_ribcl_fallback("reset")
     async def power_on_server_after_media_config(self):
-        if self.ilo.get_host_power_status() == "OFF":
+        power_status = await self.get_power_status()
+        if power_status == "Off":
             logging.info(f"Powering on the Host: {self.hostname}")
-            self.ilo.set_host_power(host_power=True)
-        elif self.ilo.get_host_power_status() == "ON":
+            await self.power_on()
+        elif power_status == "On":
             logging.info(f"Rebooting Host: {self.hostname}")
-            self.ilo.warm_boot_server()
+            await self._reset(RESTART_RESET_TYPES)
@@ -0,0 +1,221 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+
+# File where the Redfish resources discovered on every BMC are kept between runs
+REDFISH_CAPABILITIES_PATH = os.getenv(
+    "REDFISH_CAPABILITIES_PATH", "/etc/iso-automator/redfish-capabilities.json"
+)
+# Seconds the capabilities of a BMC are reused, 0 disables the cache
+REDFISH_CAPABILITIES_TTL = int(os.getenv("REDFISH_CAPABILITIES_TTL", "604800"))
+# Media types of the virtual media used to boot the ISO
+VIRTUAL_MEDIA_TYPES = ("CD", "DVD")
+
+
+@functools.lru_cache(maxsize=None)
+def _load_capabilities():
+    """
+    Returns:
+        dict: The capabilities of the BMCs by address.
+    """
+    if REDFISH_CAPABILITIES_TTL <= 0:
+        return {}
+    try:
+        with open(REDFISH_CAPABILITIES_PATH) as file:
+            cache = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as error:
+        logging.warning(f"Ignoring the Redfish capabilities cache: {error}")
+        return {}
+    now = time.time()
+    return {
+        address: capabilities
+        for address, capabilities in cache.items()
+        if capabilities["expires"] > now
+    }
+
+
+def _save_capabilities():
+    if REDFISH_CAPABILITIES_TTL <= 0:
+        return
+    try:
+        with open(f"{REDFISH_CAPABILITIES_PATH}.tmp", "w") as file:
+            json.dump(_load_capabilities(), file, indent=2, sort_keys=True)
+        os.replace(f"{REDFISH_CAPABILITIES_PATH}.tmp", REDFISH_CAPABILITIES_PATH)
+    except OSError as error:
+        logging.warning(f"Unable to write the Redfish capabilities cache: {error}")
+
+
+def _odata_id(resource, *keys):
+    """
+    Returns the @odata.id of a link of a resource (e.g. _odata_id(system, "Links", "ManagedBy")), None if the
+    resource doesn't have it. The first element of a list of links is used.
+    """
+    for key in keys:
+        if isinstance(resource, list):
+            resource = resource[0] if resource else None
+        if not isinstance(resource, dict):
+            return None
+        resource = resource.get(key)
+    if isinstance(resource, list):
+        resource = resource[0] if resource else None
+    if isinstance(resource, dict):
+        return resource.get("@odata.id")
+    return None
+
+
+def model(system):
+    """
+    Returns the model of a system, used to detect that another server answers at the address of a BMC.
+    """
+    return f"{system.get('Manufacturer') or ''} {system.get('Model') or ''}".strip()
+
+
+async def get_members(client, path, expand):
+    """
+    Returns the members of a Redfish collection, in a single request if the service supports $expand.
+    """
+    if expand:
+        response = await client.get(f"{path}?$expand=.($levels=1)")
+        members = response.data.get("Members", [])
+        # Services that ignore the query only return the links of the members
+        if all(len(member) > 1 for member in members):
+            return members
+    else:
+        response = await client.get(path)
+        members = response.data.get("Members", [])
+    responses = await asyncio.gather(
+        *(client.get(member["@odata.id"]) for member in members)
+    )
+    return [response.data for response in responses]
+
+
+async def _action(client, resource, name, parameter):
+    """
+    Returns:
+        dict: The target of an action of a resource and the allowable values of one of its parameters (None if the
+        service doesn't report them), None if the resource doesn't support the action.
+    """
+    action = resource.get("Actions", {}).get(f"#{name}")
+    if not action:
+        return None
+    allowable_values = action.get(f"{parameter}@Redfish.AllowableValues")
+    if allowable_values is None and action.get("@Redfish.ActionInfo"):
+        response = await client.get(
+            action["@Redfish.ActionInfo"], raise_for_status=False
+        )
+        for info in (response.data or {}).get("Parameters", []):
+            if info.get("Name") == parameter:
+                allowable_values = info.get("AllowableValues")
+    return {"target": action["target"], "allowable_values": allowable_values}
+
+
+async def _virtual_media(client, system, manager, expand):
+    """
+    Returns:
+        dict: The path of the virtual CD/DVD and the targets of its insert and eject actions (None if the service
+        only supports PATCH on the resource), None if the BMC has no virtual CD/DVD.
+    """
+    paths = [_odata_id(system, "VirtualMedia"), _odata_id(manager, "VirtualMedia")]
+    for path in filter(None, paths):
+        for media in await get_members(client, path, expand):
+            if not set(media.get("MediaTypes", [])) & set(VIRTUAL_MEDIA_TYPES):
+                continue
+            insert = await _action(client, media, "VirtualMedia.InsertMedia", "Image")
+            eject = await _action(client, media, "VirtualMedia.EjectMedia", "Image")
+            return {
+                "path": media["@odata.id"],
+                "insert": insert and insert["target"],
+                "eject": eject and eject["target"],
+            }
+    return None
+
+
+async def _bios(client, system):
+    """
+    Returns:
+        dict: The path of the BIOS attributes and of their pending settings, None if the system has no BIOS resource.
+    """
+    path = _odata_id(system, "Bios")
+    if not path:
+        return None
+    response = await client.get(path, raise_for_status=False)
+    settings = _odata_id(response.data or {}, "@Redfish.Settings", "SettingsObject")
+    return {"path": path, "settings": settings or path}
+
+
+async def _discover(client, root, system):
+    expand_query = root.get("ProtocolFeaturesSupported", {}).get("ExpandQuery", {})
+    expand = bool(expand_query.get("Levels") or expand_query.get("ExpandAll"))
+    boot = system.get("Boot", {})
+    manager = {}
+    if _odata_id(system, "Links", "ManagedBy"):
+        manager = (await client.get(_odata_id(system, "Links", "ManagedBy"))).data
+    return {
+        "system": system["@odata.id"],
+        "model": model(system),
+        "firmware": manager.get("FirmwareVersion"),
+        "expand": expand,
+        "reset": await _action(client, system, "ComputerSystem.Reset", "ResetType"),
+        "virtual_media": await _virtual_media(client, system, manager, expand),
+        "boot_targets": boot.get("BootSourceOverrideTarget@Redfish.AllowableValues"),
+        "boot_mode": "BootSourceOverrideMode" in boot,
+        "boot_options": _odata_id(boot, "BootOptions"),
+        "bios": await _bios(client, system),
+        # Learned on the first PATCH rejected without If-Match
+        "etag": False,
+        "expires": time.time() + REDFISH_CAPABILITIES_TTL,
+    }
+
+
+def get_cached_capabilities(address):
+    """
+    Returns:
+        dict: The capabilities of a BMC, None if the BMC must be probed.
+    """
+    return _load_capabilities().get(address)
+
+
+async def probe(client):
+    """
+    Walks the Redfish service of a BMC from /redfish/v1: the system, its reset types, boot override, BIOS and
+    virtual media. The resource paths differ between BMCs of the same model and between firmware versions, so the
+    result is cached by BMC address, with the model and firmware version of the BMC.
+
+    Returns:
+        dict: The capabilities of the BMC.
+
+    Raises:
+        Exception: If the service has no system.
+    """
+    root = (await client.get("/redfish/v1")).data
+    systems = _odata_id(root, "Systems")
+    members = (await client.get(systems)).data.get("Members", []) if systems else []
+    if not members:
+        raise Exception(f"BMC {client.host}: the Redfish service has no system")
+    system = (await client.get(members[0]["@odata.id"])).data
+    logging.info(f"BMC {client.host}: discovering the Redfish resources")
+    capabilities = await _discover(client, root, system)
+    if REDFISH_CAPABILITIES_TTL > 0:
+        _load_capabilities()[client.host] = capabilities
+        _save_capabilities()
+    return capabilities
+
+
+def learn_etag(capabilities):
+    """
+    Records that a BMC requires If-Match on PATCH.
+    """
+    capabilities["etag"] = True
+    _save_capabilities()
+
+
+def invalidate(address):
+    """
+    Forgets the capabilities of a BMC, e.g. after one of its cached resources was not found.
+    """
+    _load_capabilities().pop(address, None)
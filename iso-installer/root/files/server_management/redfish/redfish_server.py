@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import os
+from server_management.base.server_base import ServerBase
+from server_management.redfish import redfish_capabilities
+
+# Uses X-Auth-Token sessions instead of basic auth on every request
+REDFISH_DRIVER_SESSION_AUTH = os.getenv("REDFISH_DRIVER_SESSION_AUTH", "").lower() in [
+    "true",
+    "1",
+    "yes",
+]
+# Reset types used to power the server on and off, in order of preference
+POWER_ON_RESET_TYPES = ("On", "ForceOn")
+POWER_OFF_RESET_TYPES = ("ForceOff", "GracefulShutdown")
+# Status codes of a PATCH rejected because it has no If-Match header
+PRECONDITION_STATUSES = (412, 428)
+
+
+class Redfish(ServerBase):
+    """
+    Driver of any BMC that follows the DMTF Redfish schemas. Instead of vendor URLs, the resources and actions of the
+    BMC are discovered from /redfish/v1 (see redfish_capabilities) and every operation is a direct request.
+    """
+
+    redfish_session_auth = REDFISH_DRIVER_SESSION_AUTH
+    redfish_driver = True
+    # Sets the UEFI mode with the boot override, if the BMC supports it
+    boot_override_mode = True
+
+    def __init__(self, host, user, password, hostname):
+        super().__init__(host, user, password, hostname)
+        self._capabilities = None
+        self._cached = False
+
+    async def get_capabilities(self, refresh=False):
+        """
+        Returns the capabilities of the BMC, from the cache or probed once for all the concurrent operations of the
+        host. A failed probe is not kept, the next call probes again.
+        """
+        if refresh:
+            redfish_capabilities.invalidate(self.host)
+            self._capabilities = None
+        if self._capabilities is None:
+            cached = redfish_capabilities.get_cached_capabilities(self.host)
+            self._cached = cached is not None
+            if self._cached:
+                self._capabilities = asyncio.get_running_loop().create_future()
+                self._capabilities.set_result(cached)
+            else:
+                self._capabilities = asyncio.ensure_future(
+                    redfish_capabilities.probe(self.redfish)
+                )
+        capabilities = self._capabilities
+        try:
+            return await capabilities
+        except Exception:
+            # e.g. a timeout or a 503 while the BMC boots
+            if self._capabilities is capabilities:
+                self._capabilities = None
+            raise
+
+    async def _request(self, method, resource, raise_for_status=True, **kwargs):
+        """
+        Sends a request to a resource of the BMC. If the resource comes from the cache and the BMC doesn't have it,
+        the BMC is probed again and the request is retried once.
+
+        Args:
+            method (str): HTTP method.
+            resource (function): Returns the path of the resource from the capabilities of the BMC.
+            raise_for_status (bool): Raises an exception if the BMC replies with an error status.
+
+        Returns:
+            RedfishResponse: The response of the BMC.
+        """
+        capabilities = await self.get_capabilities()
+        path = resource(capabilities)
+        response = await self.redfish.request(
+            method, path, raise_for_status=False, **kwargs
+        )
+        if response.status == 404 and self._cached:
+            logging.info(
+                f"Host {self.hostname}: {path} not found, discovering the Redfish resources again"
+            )
+            path = resource(await self.get_capabilities(refresh=True))
+            response = await self.redfish.request(
+                method, path, raise_for_status=False, **kwargs
+            )
+        if raise_for_status and response.status >= 400:
+            raise Exception(
+                f"Host {self.hostname}: {method} {path} failed with status {response.status}: {response.data}"
+            )
+        return response
+
+    async def _get_system(self):
+        system = (await self._request("GET", lambda caps: caps["system"])).data
+        capabilities = await self.get_capabilities()
+        if self._cached and redfish_capabilities.model(system) != capabilities["model"]:
+            logging.info(
+                f"Host {self.hostname}: the BMC now reports the model {redfish_capabilities.model(system)}, "
+                "discovering the Redfish resources again"
+            )
+            await self.get_capabilities(refresh=True)
+        return system
+
+    async def _patch(self, resource, body, description):
+        """
+        Patches a resource of the BMC, with the ETag of the resource if the BMC requires it.
+
+        Args:
+            resource (function): Returns the path of the resource from the capabilities of the BMC.
+            body (dict): Properties to patch.
+            description (str): Description of the resource used in the error message.
+        """
+        capabilities = await self.get_capabilities()
+        headers = {"Content-Type": "application/json"}
+        if capabilities["etag"]:
+            response = await self._request("GET", resource)
+            headers["If-Match"] = response.headers.get("ETag") or (
+                response.data or {}
+            ).get("@odata.etag", "*")
+        response = await self._request(
+            "PATCH",
+            resource,
+            json=body,
+            headers=headers,
+            raise_for_status=False,
+        )
+        # The BMC is probed again by _request if the resource was not found
+        capabilities = await self.get_capabilities()
+        if response.status in PRECONDITION_STATUSES and not capabilities["etag"]:
+            redfish_capabilities.learn_etag(capabilities)
+            await self._patch(resource, body, description)
+        elif response.status >= 400:
+            raise Exception(
+                f"Host {self.hostname}: unable to patch the {description}: {response.data}"
+            )
+
+    async def _patch_system(self, body):
+        await self._patch(lambda caps: caps["system"], body, "system")
+
+    async def _reset(self, reset_types):
+        capabilities = await self.get_capabilities()
+        reset = capabilities["reset"]
+        if not reset:
+            raise Exception(f"Host {self.hostname}: the BMC doesn't support resets")
+        allowable_values = reset["allowable_values"]
+        reset_type = next(
+            (
+                reset_type
+                for reset_type in reset_types
+                if allowable_values is None or reset_type in allowable_values
+            ),
+            None,
+        )
+        if reset_type is None:
+            raise Exception(
+                f"Host {self.hostname}: the BMC doesn't support the reset types {reset_types}. "
+                f"Supported: {allowable_values}"
+            )
+        await self._request(
+            "POST",
+            lambda caps: caps["reset"]["target"],
+            json={"ResetType": reset_type},
+            headers={"Content-Type": "application/json"},
+        )
+
+    async def _get_virtual_media(self):
+        capabilities = await self.get_capabilities()
+        if not capabilities["virtual_media"]:
+            raise Exception(f"Host {self.hostname}: the BMC has no virtual CD/DVD")
+        return capabilities["virtual_media"]
+
+    async def get_power_status(self):
+        try:
+            status = (await self._get_system())["PowerState"]
+        except Exception as error:
+            status = error
+        return status
+
+    async def get_serial_number(self):
+        return (await self._get_system())["SerialNumber"]
+
+    async def get_inventory(self):
+        system = await self._get_system()
+        return {
+            "serial": system["SerialNumber"],
+            "model": system.get("Model"),
+            "boot_mode": system.get("Boot", {}).get("BootSourceOverrideMode"),
+        }
+
+    async def power_on(self):
+        await self._reset(POWER_ON_RESET_TYPES)
+
+    async def power_off(self):
+        await self._reset(POWER_OFF_RESET_TYPES)
+
+    async def insert_virtual_media(self, iso_url):
+        virtual_media = await self._get_virtual_media()
+        headers = {"Content-Type": "application/json"}
+        if virtual_media["insert"]:
+            await self._request(
+                "POST",
+                lambda caps: caps["virtual_media"]["insert"],
+                json={"Image": iso_url},
+                headers=headers,
+            )
+        else:
+            # Services without the InsertMedia action mount the image with a PATCH of the virtual media
+            await self._request(
+                "PATCH",
+                lambda caps: caps["virtual_media"]["path"],
+                json={"Image": iso_url, "Inserted": True},
+                headers=headers,
+            )
+
+    async def eject_virtual_media(self):
+        virtual_media = await self._get_virtual_media()
+        headers = {"Content-Type": "application/json"}
+        if virtual_media["eject"]:
+            await self._request(
+                "POST",
+                lambda caps: caps["virtual_media"]["eject"],
+                json={},
+                headers=headers,
+                raise_for_status=False,
+            )
+        else:
+            await self._request(
+                "PATCH",
+                lambda caps: caps["virtual_media"]["path"],
+                json={"Image": None, "Inserted": False},
+                headers=headers,
+                raise_for_status=False,
+            )
+
+    async def set_uefi_mode(self):
+        # The boot mode is set with the boot override of config_virtual_media, in the same request
+        pass
+
+    async def config_virtual_media(self):
+        capabilities = await self.get_capabilities()
+        boot_targets = capabilities["boot_targets"]
+        if boot_targets is not None and "Cd" not in boot_targets:
+            raise Exception(
+                f"Host {self.hostname}: the BMC can't boot from the virtual CD. Boot targets: {boot_targets}"
+            )
+        boot = {"BootSourceOverrideTarget": "Cd", "BootSourceOverrideEnabled": "Once"}
+        if self.boot_override_mode and capabilities["boot_mode"]:
+            boot["BootSourceOverrideMode"] = "UEFI"
+        await self._patch_system({"Boot": boot})
+
+    async def power_on_server_after_media_config(self):
+        power_status = await self.get_power_status()
+        if power_status == "Off":
+            logging.info(f"Powering on the Host: {self.hostname}")
+            await self.power_on()
+        elif power_status == "On":
+            logging.info(f"Rebooting Host: {self.hostname}")
+            await self.power_off()
+            await self.wait_for_power_state("Off")
+            await self.power_on()
+
+    async def check_boot_options(self):
+        capabilities = await self.get_capabilities()
+        if not capabilities["boot_options"]:
+            return
+        boot_options = await redfish_capabilities.get_members(
+            self.redfish, capabilities["boot_options"], capabilities["expand"]
+        )
+        for boot_option in boot_options:
+            display_name = boot_option.get("DisplayName") or ""
+            if "ubuntu" in display_name.lower():
+                raise Exception(
+                    f"There is a ubuntu installation in Boot Option of the host {self.hostname}. UEFI Boot option: {display_name}"
+                )
@@ -1,104 +1,80 @@
-import requests
-import time
+import aiohttp
 import logging
 from server_management.base.server_base import ServerBase
+from server_management.base.task_monitor import TaskMonitor
 
 
 class Ibmc(ServerBase):
+    # The sessions of the BMC are shared with SessionCache
+    redfish_session_auth = True
+    redfish_driver = True
+
     def __init__(self, host, user, password, hostname):
         super().__init__(host, user, password, hostname)
-        self._token = None
         self.urls = {
-            "system_info": f"https://{self.host}/redfish/v1/Systems/1",
-            "system_power": f"https://{self.host}/redfish/v1/Systems/1/Actions/ComputerSystem.Reset",
-            "system_session": f"https://{self.host}/redfish/v1/SessionService/Sessions",
-            "session_task": f"https://{self.host}/redfish/v1/TaskService/Tasks/",
-            "virtual_media": f"https://{self.host}/redfish/v1/Managers/1/VirtualMedia/CD/Oem/xFusion/Actions"
-            f"/VirtualMedia.VmmControl",
+            "system_info": "/redfish/v1/Systems/1",
+            "system_power": "/redfish/v1/Systems/1/Actions/ComputerSystem.Reset",
+            "session_task": "/redfish/v1/TaskService/Tasks",
+            "virtual_media": "/redfish/v1/Managers/1/VirtualMedia/CD/Oem/xFusion/Actions"
+            "/VirtualMedia.VmmControl",
         }
 
-    def get_serial_number(self):
+    async def get_serial_number(self):
         url = self.urls["system_info"]
-        requests_header = {"X-Auth-Token": self.__get_token()}
-        response = requests.get(url, headers=requests_header, verify=False)
-        response_json = response.json()
-        return response_json["SerialNumber"]
+        response = await self.redfish.get(url)
+        return response.data["SerialNumber"]
 
-    def __get_token(self):
-        if not self._token:
-            url = self.urls["system_session"]
-            requests_header = {"Content-Type": "application/json"}
-            requests_body = {"UserName": self.user, "Password": self.password}
-            response = requests.post(
-                url, json=requests_body, headers=requests_header, verify=False
-            )
-            response.raise_for_status()
-            self._token = response.headers["X-Auth-Token"]
-        return self._token
+    async def get_inventory(self):
+        response = await self.redfish.get(self.urls["system_info"])
+        return {
+            "serial": response.data["SerialNumber"],
+            "model": response.data.get("Model"),
+            "boot_mode": response.data.get("Boot", {}).get("BootSourceOverrideMode"),
+        }
 
-    def get_power_status(self):
+    async def get_power_status(self):
         url = self.urls["system_info"]
-        requests_header = {"X-Auth-Token": self.__get_token()}
-        response = requests.get(url, headers=requests_header, verify=False)
         try:
-            response.raise_for_status()
-            response_json = response.json()
-            status = response_json["PowerState"]
-        except requests.exceptions.HTTPError as error:
+            response = await self.redfish.get(url)
+            status = response.data["PowerState"]
+        except aiohttp.ClientResponseError as error:
             status = error
         return status
 
-    def power_on(self):
+    async def power_on(self):
         url = self.urls["system_power"]
         requests_body = {"ResetType": "On"}
-        requests_header = {
-            "X-Auth-Token": self.__get_token(),
-            "Content-Type": "application/json",
-        }
-        response = requests.post(
-            url, json=requests_body, headers=requests_header, verify=False
-        )
-        response.raise_for_status()
+        requests_header = {"Content-Type": "application/json"}
+        await self.redfish.post(url, json=requests_body, headers=requests_header)
 
-    def insert_virtual_media(self, iso_url):
+    async def insert_virtual_media(self, iso_url):
         url = self.urls["virtual_media"]
         requests_body = {"VmmControlType": "Connect", "Image": f"{iso_url}"}
         logging.info(requests_body)
-        requests_header = {
-            "X-Auth-Token": self.__get_token(),
-            "Content-Type": "application/json",
-        }
-        response = requests.post(
-            url, json=requests_body, headers=requests_header, verify=False
+        requests_header = {"Content-Type": "application/json"}
+        response = await self.redfish.post(
+            url, json=requests_body, headers=requests_header
         )
-        response.raise_for_status()
-        response_json = response.json()
-        status = self.get_task_status(response_json["Id"])
+        status = await self.get_task_status(response.data["Id"])
         if not status["status"]:
             raise Exception(status["message"])
 
-    def eject_virtual_media(self):
+    async def eject_virtual_media(self):
         url = self.urls["virtual_media"]
         requests_body = {"VmmControlType": "Disconnect"}
-        token = self.__get_token()
-        logging.info(token)
-        requests_header = {
-            "X-Auth-Token": token,
-            "Content-Type": "application/json",
-        }
-        requests.post(url, json=requests_body, headers=requests_header, verify=False)
+        requests_header = {"Content-Type": "application/json"}
+        await self.redfish.post(
+            url, json=requests_body, headers=requests_header, raise_for_status=False
+        )
 
-    def config_virtual_media(self):
+    async def config_virtual_media(self):
         pass
 
-    def set_uefi_mode(self):
+    async def set_uefi_mode(self):
         url = self.urls["system_info"]
-        requests_header_etag = {"X-Auth-Token": self.__get_token()}
-        response = requests.get(url, headers=requests_header_etag, verify=False)
-        response.raise_for_status()
+        response = await self.redfish.get(url)
         etag = response.headers["etag"]
         requests_header = {
-            "X-Auth-Token": self.__get_token(),
             "Content-Type": "application/json",
             "If-Match": etag,
         }
@@ -109,53 +85,31 @@ class Ibmc(ServerBase):
                 "BootSourceOverrideMode": "UEFI",
             }
         }
-        requests.patch(url, headers=requests_header, json=requests_body, verify=False)
+        await self.redfish.patch(
+            url, headers=requests_header, json=requests_body, raise_for_status=False
+        )
 
-    def get_task_status(self, task_id):
+    async def get_task_status(self, task_id):
+        # The task is polled together with the tasks of the other BMCs
         url = f"{self.urls['session_task']}/{task_id}"
-        requests_header = {"X-Auth-Token": self.__get_token()}
-        attempts = 0
-        success = False
-        msg = ""
-        while attempts < 100:
-            time.sleep(2)
-            response_json = requests.get(
-                url, headers=requests_header, verify=False
-            ).json()
-            if response_json["Messages"]["Severity"] == "OK":
-                success = True
-                msg = response_json["Messages"]["Message"]
-                break
-            msg = response_json["Messages"]["Message"]
-            attempts += 1
-        return {"status": success, "message": msg}
+        return await TaskMonitor.get_monitor().wait(self.redfish, url)
 
-    def power_off(self):
-        url = f"https://{self.host}/redfish/v1/Systems/1/Actions/ComputerSystem.Reset"
+    async def power_off(self):
+        url = self.urls["system_power"]
         requests_body = {"ResetType": "ForceOff"}
-        requests_header = {
-            "X-Auth-Token": self.__get_token(),
-            "Content-Type": "application/json",
-        }
-        response = requests.post(
-            url, json=requests_body, headers=requests_header, verify=False
-        )
-        response.raise_for_status()
+        requests_header = {"Content-Type": "application/json"}
+        await self.redfish.post(url, json=requests_body, headers=requests_header)
 
     async def power_on_server_after_media_config(self):
-        attempts = 0
-        if self.get_power_status() == "Off":
+        power_status = await self.get_power_status()
+        if power_status == "Off":
             logging.info(f"Powering on the Host: {self.hostname}")
-            self.power_on()
-        elif self.get_power_status() == "On":
+            await self.power_on()
+        elif power_status == "On":
             logging.info(f"Rebooting Host: {self.hostname}")
-            self.power_off()
-            while attempts < 3:
-                time.sleep(60)
-                if self.get_power_status() == "Off":
-                    self.power_on()
-                    break
-                attempts += 1
+            await self.power_off()
+            await self.wait_for_power_state("Off")
+            await self.power_on()
 
-    def check_boot_options(self):
+    async def check_boot_options(self):
         pass
@@ -0,0 +1,94 @@
+import functools
+import json
+import logging
+import os
+import time
+
+# File where the inventory of the BMCs is kept between runs
+BMC_INVENTORY_PATH = os.getenv(
+    "BMC_INVENTORY_PATH", "/etc/iso-automator/bmc-inventory.json"
+)
+# Seconds the inventory of a BMC is reused, 0 disables the cache
+BMC_INVENTORY_TTL = int(os.getenv("BMC_INVENTORY_TTL", "86400"))
+# Reads the inventory of all the BMCs again, and refreshes the cache
+BMC_INVENTORY_REFRESH = os.getenv("BMC_INVENTORY_REFRESH", "").lower() in [
+    "true",
+    "1",
+    "yes",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def _load_inventories():
+    try:
+        with open(BMC_INVENTORY_PATH) as file:
+            inventories = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as error:
+        logging.warning(f"Ignoring the BMC inventory cache: {error}")
+        return {}
+    now = time.time()
+    return {
+        address: entry
+        for address, entry in inventories.items()
+        if entry["expires"] > now
+    }
+
+
+def get_inventory(address, management_type, hostname):
+    """
+    Returns the cached inventory of a BMC. The entry is invalidated if the BMC address now belongs to another host or
+    management type. The caller checks that the BMC still reports the cached serial number.
+
+    Returns:
+        dict: The inventory (see ServerBase.get_inventory), None if it must be read from the BMC.
+    """
+    if BMC_INVENTORY_REFRESH or BMC_INVENTORY_TTL <= 0:
+        return None
+    entry = _load_inventories().get(address)
+    if entry is None:
+        return None
+    if (entry["type"], entry["hostname"]) != (management_type, hostname):
+        logging.info(
+            f"BMC {address}: cached inventory of {entry['hostname']} ({entry['type']}) invalidated"
+        )
+        invalidate(address)
+        return None
+    return entry["inventory"]
+
+
+def set_inventory(address, management_type, hostname, inventory):
+    """
+    Caches the inventory read from a BMC.
+    """
+    previous = _load_inventories().get(address)
+    if previous and previous["inventory"].get("serial") != inventory.get("serial"):
+        logging.warning(
+            f"BMC {address}: serial number changed from {previous['inventory'].get('serial')} to "
+            f"{inventory.get('serial')}"
+        )
+    _load_inventories()[address] = {
+        "type": management_type,
+        "hostname": hostname,
+        "inventory": inventory,
+        "expires": time.time() + BMC_INVENTORY_TTL,
+    }
+
+
+def invalidate(address):
+    _load_inventories().pop(address, None)
+
+
+def save_inventories():
+    """
+    Writes the cache, replacing the file at once.
+    """
+    if BMC_INVENTORY_TTL <= 0:
+        return
+    try:
+        with open(f"{BMC_INVENTORY_PATH}.tmp", "w") as file:
+            json.dump(_load_inventories(), file, indent=2, sort_keys=True)
+        os.replace(f"{BMC_INVENTORY_PATH}.tmp", BMC_INVENTORY_PATH)
+    except OSError as error:
+        logging.warning(f"Unable to write the BMC inventory cache: {error}")
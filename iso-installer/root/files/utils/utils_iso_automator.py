@@ -1,10 +1,20 @@
+import asyncio
 import logging
 import os
 import re
+import time
 import yaml
 import copy
 from server_management.base.server_factory import ServerFactory
-from security.security_mechanism import check_safety_feature
+from utils.bmc_inventory import (
+    get_inventory,
+    invalidate,
+    save_inventories,
+    set_inventory,
+)
+
+# Seconds to read the serial number and boot options of a BMC
+BMC_TIMEOUT = int(os.getenv("BMC_TIMEOUT", "60"))
 
 
 def merge(source, destination):
@@ -55,7 +65,14 @@ def check_existence(path, name, is_file=True):
         raise Exception(f"The {type_str} {full_path} doesn't exist")
 
 
-def process_server(server_dict, role, content_servers, consolidated_info):
+def process_server(server_dict, role, content_servers):
+    """
+    Consolidates the configuration of a host and creates its driver. The BMC is read later by discover_hosts.
+
+    Returns:
+        dict: The consolidated host ("host"), its driver ("server", None for manual installations), the addresses of
+        its netplan ("addresses") and the safety features to validate ("safety_features").
+    """
     safety_features = get_safety_features()
     hostname = next(iter(server_dict))
     dict_host = {}
@@ -86,10 +103,6 @@ def process_server(server_dict, role, content_servers, consolidated_info):
             password=dict_host["management"]["password"],
             hostname=hostname,
         )
-        # Gets Serial Number
-        logging.info(f"Getting serial number of the host {hostname}.")
-        dict_host["management"]["serial"] = server.get_serial_number()
-        logging.info(f"Host {hostname}: S/N {dict_host['management']['serial']}.")
 
     # Extracts address of netplan configuration
     # raw_netplan
@@ -105,12 +118,116 @@ def process_server(server_dict, role, content_servers, consolidated_info):
                 0
             ].split("ip_address: ")[-1]
         ]
-    validated_host = check_safety_feature(server, addresses, hostname, safety_features)
-    if not validated_host:
-        logging.error(f"Security checks failed for host {hostname}.")
-        return
-    logging.info(f"Host {hostname} is validated.")
-    consolidated_info.append(dict_host)
+    return {
+        "host": dict_host,
+        "server": server,
+        "addresses": addresses,
+        "safety_features": safety_features,
+    }
+
+
+async def _read_bmc(read):
+    """
+    Returns:
+        tuple: The value read from the BMC and None, or None and the reason of the failure.
+    """
+    try:
+        return await asyncio.wait_for(read, BMC_TIMEOUT), None
+    except asyncio.TimeoutError:
+        return None, f"timeout after {BMC_TIMEOUT} seconds"
+    except Exception as error:
+        return None, str(error)
+
+
+async def _read_inventory(host):
+    """
+    Returns the inventory of a host, from the cache if the BMC was read in a recent run. A cached inventory is only
+    used if the BMC still reports its serial number, which also tells that the BMC answers. Otherwise the server
+    behind the BMC was replaced, and its inventory is read again.
+
+    Raises:
+        Exception: If the BMC can't be read.
+    """
+    management = host["host"]["management"]
+    key = (management["address"], management["type"], host["host"]["hostname"])
+    inventory = get_inventory(*key)
+    if inventory is not None:
+        serial = await host["server"].get_serial_number()
+        if serial == inventory["serial"]:
+            return inventory
+        logging.warning(
+            f"Host {host['host']['hostname']}: the BMC {management['address']} reports the serial number {serial} "
+            f"instead of the cached {inventory['serial']}, reading its inventory again"
+        )
+        invalidate(management["address"])
+    inventory = await host["server"].get_inventory()
+    set_inventory(*key, inventory)
+    return inventory
+
+
+async def _discover_host(host):
+    """
+    Reads the inventory (serial number...) and boot options of a host at the same time. The inventory comes from
+    the cache of the previous runs if it has not expired. The boot options are read by a task that
+    outlives the timeout, and that the boot safety check awaits instead of reading them again.
+
+    Returns:
+        tuple: The reason why the serial number couldn't be read (None if it was read), and the duration.
+    """
+    start_time = time.time()
+    server = host["server"]
+    hostname = host["host"]["hostname"]
+    reads = [_read_inventory(host)]
+    if "boot" in host["safety_features"]:
+        host["boot_options"] = asyncio.ensure_future(server.check_boot_options())
+        reads.append(asyncio.shield(host["boot_options"]))
+    (inventory, serial_error), *boot = await asyncio.gather(
+        *(_read_bmc(read) for read in reads)
+    )
+
+    if serial_error is None:
+        host["host"]["management"]["serial"] = inventory["serial"]
+        logging.info(f"Host {hostname}: S/N {inventory['serial']}.")
+    if boot and boot[0][1] and boot[0][1].startswith("timeout"):
+        logging.warning(f"Host {hostname}: boot options not read yet, {boot[0][1]}")
+    return serial_error, time.time() - start_time
+
+
+async def discover_hosts(hosts):
+    """
+    Reads the BMCs of all the hosts concurrently, so the discovery takes as long as the slowest BMC, bounded by
+    BMC_TIMEOUT. The hosts without a serial number are dropped and reported. Manual installations have no BMC.
+
+    Args:
+        hosts (list): Hosts returned by process_server.
+
+    Returns:
+        list: The hosts whose serial number was read, and the manual installations.
+    """
+    bmc_hosts = [host for host in hosts if host["server"] is not None]
+    logging.info(f"Getting serial number of {len(bmc_hosts)} hosts.")
+    start_time = time.time()
+    results = await asyncio.gather(*(_discover_host(host) for host in bmc_hosts))
+    save_inventories()
+
+    failed = set()
+    for host, (error, duration) in zip(bmc_hosts, results):
+        if error is not None:
+            logging.error(
+                f"Host {host['host']['hostname']}: BMC not read after {duration:.1f} seconds, {error}"
+            )
+            failed.add(host["host"]["hostname"])
+            if "boot_options" in host:
+                host["boot_options"].cancel()
+    if bmc_hosts:
+        slowest_host, (_, slowest) = max(
+            zip(bmc_hosts, results), key=lambda result: result[1][1]
+        )
+        logging.info(
+            f"Discovery of {len(bmc_hosts)} hosts done in {time.time() - start_time:.1f} seconds, slowest BMC: "
+            f"{slowest_host['host']['hostname']} ({slowest:.1f} seconds)"
+        )
+    return [host for host in hosts if host["host"]["hostname"] not in failed]
 
 
 def get_safety_features():
@@ -37,6 +37,18 @@ function pylint_checker() {
   echo "Finished running pylint"
 }
 
+function startup_checker() {
+  echo "Running startup check"
+  python3 check_startup.py || STARTUP_RC=$?
+  echo "Finished running startup check"
+}
+
+function pytest_checker() {
+  echo "Running pytest"
+  python3 -m pytest tests/ || PYTEST_RC=$?
+  echo "Finished running pytest"
+}
+
 function lint_validate() {
   if (( BLACK_RC != 0 || FLAKE_RC != 0 || PYLINT_RC != 0 )); then
    echo "Linter failed!!"
@@ -54,3 +66,16 @@ for path in "${python_paths[@]}"; do
   lint_validate "${path}"
 done
 
+startup_checker
+if (( STARTUP_RC != 0 )); then
+  echo "Startup check failed!!"
+  exit 1
+fi
+echo "Startup check success!!"
+
+pytest_checker
+if (( PYTEST_RC != 0 )); then
+  echo "Tests failed!!"
+  exit 1
+fi
+echo "Tests success!!"
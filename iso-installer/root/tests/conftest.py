@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules of the installer are imported from files/, as iso_installer.py does
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "files")
+)
@@ -0,0 +1,103 @@
+import json
+import time
+import pytest
+from utils import bmc_inventory
+from utils.bmc_inventory import (
+    get_inventory,
+    invalidate,
+    save_inventories,
+    set_inventory,
+)
+
+INVENTORY = {"serial": "CZ1", "model": "ProLiant DL380 Gen10"}
+
+
+@pytest.fixture
+def inventory_path(tmp_path, monkeypatch):
+    path = tmp_path / "bmc-inventory.json"
+    monkeypatch.setattr(bmc_inventory, "BMC_INVENTORY_PATH", str(path))
+    monkeypatch.setattr(bmc_inventory, "BMC_INVENTORY_TTL", 3600)
+    monkeypatch.setattr(bmc_inventory, "BMC_INVENTORY_REFRESH", False)
+    bmc_inventory._load_inventories.cache_clear()
+    yield path
+    bmc_inventory._load_inventories.cache_clear()
+
+
+def _write(path, entries):
+    path.write_text(json.dumps(entries))
+    bmc_inventory._load_inventories.cache_clear()
+
+
+def test_get_missing(inventory_path):
+    assert get_inventory("10.0.0.1", "ilo", "host-1") is None
+
+
+def test_set_get_and_save(inventory_path):
+    set_inventory("10.0.0.1", "ilo", "host-1", INVENTORY)
+    assert get_inventory("10.0.0.1", "ilo", "host-1") == INVENTORY
+    save_inventories()
+
+    bmc_inventory._load_inventories.cache_clear()
+    assert get_inventory("10.0.0.1", "ilo", "host-1") == INVENTORY
+    assert json.loads(inventory_path.read_text())["10.0.0.1"]["hostname"] == "host-1"
+
+
+def test_expired_entry(inventory_path):
+    _write(
+        inventory_path,
+        {
+            "10.0.0.1": {
+                "type": "ilo",
+                "hostname": "host-1",
+                "inventory": INVENTORY,
+                "expires": time.time() - 1,
+            }
+        },
+    )
+    assert get_inventory("10.0.0.1", "ilo", "host-1") is None
+
+
+@pytest.mark.parametrize(
+    "management_type, hostname", [("idrac", "host-1"), ("ilo", "host-2")]
+)
+def test_address_of_another_host(inventory_path, management_type, hostname):
+    set_inventory("10.0.0.1", "ilo", "host-1", INVENTORY)
+    assert get_inventory("10.0.0.1", management_type, hostname) is None
+    # The entry is dropped
+    assert get_inventory("10.0.0.1", "ilo", "host-1") is None
+
+
+def test_invalidate(inventory_path):
+    set_inventory("10.0.0.1", "ilo", "host-1", INVENTORY)
+    invalidate("10.0.0.1")
+    invalidate("10.0.0.2")
+    assert get_inventory("10.0.0.1", "ilo", "host-1") is None
+
+
+def test_refresh(inventory_path, monkeypatch):
+    set_inventory("10.0.0.1", "ilo", "host-1", INVENTORY)
+    monkeypatch.setattr(bmc_inventory, "BMC_INVENTORY_REFRESH", True)
+    assert get_inventory("10.0.0.1", "ilo", "host-1") is None
+
+
+def test_disabled(inventory_path, monkeypatch):
+    monkeypatch.setattr(bmc_inventory, "BMC_INVENTORY_TTL", 0)
+    set_inventory("10.0.0.1", "ilo", "host-1", INVENTORY)
+    assert get_inventory("10.0.0.1", "ilo", "host-1") is None
+    save_inventories()
+    assert not inventory_path.exists()
+
+
+def test_corrupted_file(inventory_path):
+    inventory_path.write_text("{")
+    assert get_inventory("10.0.0.1", "ilo", "host-1") is None
+
+
+def test_unwritable_file(tmp_path, inventory_path, monkeypatch):
+    monkeypatch.setattr(
+        bmc_inventory,
+        "BMC_INVENTORY_PATH",
+        str(tmp_path / "missing" / "inventory.json"),
+    )
+    set_inventory("10.0.0.1", "ilo", "host-1", INVENTORY)
+    save_inventories()
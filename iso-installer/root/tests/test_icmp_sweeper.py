@@ -0,0 +1,92 @@
+import socket
+import struct
+from security import icmp_sweeper
+from security.icmp_sweeper import _checksum, _echo_request, _parse_reply
+
+IDENTIFIER = 0x1234
+
+
+def _ipv4_header():
+    # Version 4, header of 5 words
+    return bytes([0x45]) + bytes(19)
+
+
+def _reply(icmp_type, identifier=IDENTIFIER):
+    return struct.pack("!BBHHH", icmp_type, 0, 0, identifier, 1) + b"payload"
+
+
+def test_checksum_known_value():
+    # Example of RFC 1071
+    data = bytes([0x00, 0x01, 0xF2, 0x03, 0xF4, 0xF5, 0xF6, 0xF7])
+    assert _checksum(data) == ~0xDDF2 & 0xFFFF
+
+
+def test_checksum_odd_length():
+    assert _checksum(b"\x01") == _checksum(b"\x01\x00")
+
+
+def test_echo_request_ipv4_checksum():
+    packet = _echo_request(socket.AF_INET, IDENTIFIER, 7)
+    icmp_type, code, checksum, identifier, sequence = struct.unpack(
+        "!BBHHH", packet[:8]
+    )
+    assert (icmp_type, code, identifier, sequence) == (8, 0, IDENTIFIER, 7)
+    assert checksum != 0
+    # The checksum of a packet that includes its checksum is 0
+    assert _checksum(packet) == 0
+
+
+def test_echo_request_ipv6_checksum_left_to_kernel():
+    packet = _echo_request(socket.AF_INET6, IDENTIFIER, 1)
+    assert struct.unpack("!BBH", packet[:4]) == (128, 0, 0)
+
+
+def test_parse_reply_raw_ipv4():
+    assert _parse_reply(socket.AF_INET, True, _ipv4_header() + _reply(0), IDENTIFIER)
+
+
+def test_parse_reply_raw_ipv4_other_sweep():
+    packet = _ipv4_header() + _reply(0, identifier=IDENTIFIER + 1)
+    assert not _parse_reply(socket.AF_INET, True, packet, IDENTIFIER)
+
+
+def test_parse_reply_raw_ipv4_echo_request():
+    packet = _ipv4_header() + _reply(8)
+    assert not _parse_reply(socket.AF_INET, True, packet, IDENTIFIER)
+
+
+def test_parse_reply_datagram_identifier_rewritten():
+    assert _parse_reply(socket.AF_INET, False, _reply(0, identifier=99), IDENTIFIER)
+
+
+def test_parse_reply_ipv6():
+    assert _parse_reply(socket.AF_INET6, True, _reply(129), IDENTIFIER)
+    assert not _parse_reply(socket.AF_INET6, True, _reply(128), IDENTIFIER)
+
+
+def test_parse_reply_truncated():
+    assert not _parse_reply(socket.AF_INET, False, b"\x00\x00\x00", IDENTIFIER)
+
+
+def test_sweep_maps_replies_to_the_given_addresses(monkeypatch):
+    replies = {socket.AF_INET: {"10.0.0.1"}, socket.AF_INET6: {"2001:db8::1"}}
+    monkeypatch.setattr(
+        icmp_sweeper, "_icmp_sweep", lambda family, addresses, timeout: replies[family]
+    )
+    addresses = ["10.0.0.1", "10.0.0.2", "2001:0db8:0000::0001"]
+    assert icmp_sweeper.sweep(addresses) == {"10.0.0.1", "2001:0db8:0000::0001"}
+
+
+def test_sweep_falls_back_to_tcp(monkeypatch):
+    probed = []
+    monkeypatch.setattr(
+        icmp_sweeper, "_icmp_sweep", lambda family, addresses, timeout: None
+    )
+
+    def tcp_sweep(addresses, timeout):
+        probed.append(addresses)
+        return {"10.0.0.2"}
+
+    monkeypatch.setattr(icmp_sweeper, "_tcp_sweep", tcp_sweep)
+    assert icmp_sweeper.sweep(["10.0.0.1", "10.0.0.2"]) == {"10.0.0.2"}
+    assert probed == [{"10.0.0.1", "10.0.0.2"}]
@@ -0,0 +1,124 @@
+import json
+import time
+import types
+import pytest
+from security import netbox_index
+from security.netbox_index import FREE_IP, NetboxIndex
+
+# Canned IPAM: address -> device of its interface, None if it is not assigned
+IPAM = {
+    "10.0.0.1": "host-1",
+    "10.0.1.1": "host-1",
+    "10.0.0.2": "host-2",
+    "10.0.0.9": None,
+}
+
+
+def _ip_address(address, device):
+    interface = types.SimpleNamespace(device=device) if device else None
+    return types.SimpleNamespace(address=f"{address}/24", assigned_object=interface)
+
+
+class FakeIpAddresses:
+    def __init__(self):
+        self.queries = []
+
+    def filter(self, address=None, device=None):
+        self.queries.append({"address": address} if address else {"device": device})
+        return [
+            _ip_address(ip, owner)
+            for ip, owner in IPAM.items()
+            if (address and ip in address) or (device and owner in device)
+        ]
+
+
+def _client():
+    return types.SimpleNamespace(
+        ipam=types.SimpleNamespace(ip_addresses=FakeIpAddresses())
+    )
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "netbox-cache.json"
+    monkeypatch.setattr(netbox_index, "NETBOX_CACHE", str(path))
+    return path
+
+
+def test_load_without_cache(monkeypatch):
+    monkeypatch.setattr(netbox_index, "NETBOX_CACHE", "")
+    client = _client()
+    index = NetboxIndex(client).load(["10.0.0.2", "10.0.0.9", "10.0.0.50"], ["host-1"])
+    assert index.devices() == {
+        FREE_IP: {"10.0.0.9"},
+        "host-1": {"10.0.0.1", "10.0.1.1"},
+        "host-2": {"10.0.0.2"},
+    }
+    # The unknown address is not in the index
+    assert "10.0.0.50" not in index.addresses
+
+
+def test_load_batches(monkeypatch):
+    monkeypatch.setattr(netbox_index, "NETBOX_CACHE", "")
+    monkeypatch.setattr(netbox_index, "NETBOX_FILTER_BATCH", 1)
+    client = _client()
+    NetboxIndex(client).load(["10.0.0.1", "10.0.0.2"], ["host-1"])
+    assert sorted(map(str, client.ipam.ip_addresses.queries)) == [
+        "{'address': ['10.0.0.1']}",
+        "{'address': ['10.0.0.2']}",
+        "{'device': ['host-1']}",
+    ]
+
+
+def test_load_reuses_cache(cache_path):
+    NetboxIndex(_client()).load(["10.0.0.2"], ["host-1"])
+    assert cache_path.exists()
+
+    client = _client()
+    index = NetboxIndex(client).load(["10.0.0.2"], ["host-1"])
+    assert client.ipam.ip_addresses.queries == []
+    assert index.devices()["host-1"] == {"10.0.0.1", "10.0.1.1"}
+    assert index.devices()["host-2"] == {"10.0.0.2"}
+
+
+def test_load_queries_only_missing_entries(cache_path):
+    NetboxIndex(_client()).load(["10.0.0.2"], [])
+    client = _client()
+    NetboxIndex(client).load(["10.0.0.2", "10.0.0.9"], ["host-1"])
+    assert client.ipam.ip_addresses.queries == [
+        {"address": ["10.0.0.9"]},
+        {"device": ["host-1"]},
+    ]
+
+
+def test_load_ignores_expired_entries(cache_path):
+    cache_path.write_text(
+        json.dumps(
+            {
+                "addresses": {
+                    "10.0.0.2": {"owners": ["old-host"], "expires": time.time() - 1}
+                },
+                "devices": {},
+            }
+        )
+    )
+    client = _client()
+    index = NetboxIndex(client).load(["10.0.0.2"], [])
+    assert client.ipam.ip_addresses.queries == [{"address": ["10.0.0.2"]}]
+    assert index.addresses == {"10.0.0.2": {"host-2"}}
+
+
+def test_load_ignores_corrupted_cache(cache_path):
+    cache_path.write_text("{")
+    index = NetboxIndex(_client()).load(["10.0.0.2"], [])
+    assert index.addresses == {"10.0.0.2": {"host-2"}}
+    # The cache is written again
+    assert "10.0.0.2" in json.loads(cache_path.read_text())["addresses"]
+
+
+def test_unwritable_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        netbox_index, "NETBOX_CACHE", str(tmp_path / "missing" / "cache.json")
+    )
+    index = NetboxIndex(_client()).load(["10.0.0.2"], [])
+    assert index.addresses == {"10.0.0.2": {"host-2"}}
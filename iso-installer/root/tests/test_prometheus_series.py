@@ -0,0 +1,118 @@
+import pytest
+from security import prometheus_series
+from security.prometheus_series import find_hosts_with_metrics, series_url
+
+
+class FakeResponse:
+    def __init__(self, status_code, series=None):
+        self.status_code = status_code
+        self.text = ""
+        self.series = series
+
+    def json(self):
+        return {"status": "success", "data": self.series}
+
+
+class FakeSession:
+    """
+    requests.Session of a Prometheus server that returns canned series, and records the matchers of every request.
+    """
+
+    def __init__(self, series, post_status=200):
+        self.series = series
+        self.post_status = post_status
+        self.requests = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def post(self, url, data, timeout):
+        self.requests.append(("POST", url, [value for _, value in data]))
+        if self.post_status != 200:
+            return FakeResponse(self.post_status)
+        return FakeResponse(200, self.series)
+
+    def get(self, url, params, timeout):
+        self.requests.append(("GET", url, [value for _, value in params]))
+        return FakeResponse(200, self.series)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    def install(series, post_status=200):
+        fake_session = FakeSession(series, post_status)
+        monkeypatch.setattr(prometheus_series.requests, "Session", lambda: fake_session)
+        return fake_session
+
+    return install
+
+
+def test_series_url():
+    assert (
+        series_url("http://prometheus:9090") == "http://prometheus:9090/api/v1/series"
+    )
+    assert (
+        series_url("http://prometheus:9090/custom") == "http://prometheus:9090/custom"
+    )
+
+
+def test_matchers_escape_the_addresses(session):
+    fake_session = session([])
+    find_hosts_with_metrics("http://prometheus", {"host-1": ["10.0.0.1"]})
+    assert fake_session.requests == [
+        (
+            "POST",
+            "http://prometheus/api/v1/series",
+            [
+                '{instance=~"(10\\\\.0\\\\.0\\\\.1)(:[0-9]+)?"}',
+                '{alias=~"host\\\\-1"}',
+            ],
+        )
+    ]
+
+
+def test_series_mapped_to_hosts(session):
+    session(
+        [
+            {"__name__": "up", "instance": "10.0.0.1:9100"},
+            # Another address that starts like 10.0.0.1
+            {"__name__": "up", "instance": "10.0.0.10:9100"},
+            {"__name__": "up", "instance": "10.0.0.3", "alias": "host-3"},
+            {"__name__": "up", "alias": "unknown"},
+        ]
+    )
+    hosts = {
+        "host-1": ["10.0.0.1"],
+        "host-2": ["10.0.0.2", "10.0.0.1"],
+        "host-3": ["10.0.0.3"],
+        "host-4": ["10.0.0.4"],
+    }
+    assert find_hosts_with_metrics("http://prometheus", hosts) == {
+        "host-1": ["10.0.0.1"],
+        "host-2": ["10.0.0.1"],
+        "host-3": ["10.0.0.3", "host-3"],
+    }
+
+
+def test_requests_are_batched(session, monkeypatch):
+    monkeypatch.setattr(prometheus_series, "PROMETHEUS_BATCH_SIZE", 1)
+    fake_session = session([])
+    find_hosts_with_metrics("http://prometheus", {"a": ["10.0.0.1"], "b": ["10.0.0.2"]})
+    assert [len(matchers) for _, _, matchers in fake_session.requests] == [2, 2]
+
+
+def test_get_when_post_not_allowed(session):
+    fake_session = session([{"instance": "10.0.0.1:9100"}], post_status=405)
+    assert find_hosts_with_metrics("http://prometheus", {"a": ["10.0.0.1"]}) == {
+        "a": ["10.0.0.1"]
+    }
+    assert [method for method, _, _ in fake_session.requests] == ["POST", "GET"]
+
+
+def test_request_error(session):
+    session([], post_status=500)
+    with pytest.raises(Exception, match="Prometheus server failed to reply"):
+        find_hosts_with_metrics("http://prometheus", {"a": ["10.0.0.1"]})
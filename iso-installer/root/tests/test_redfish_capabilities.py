@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+import types
+import pytest
+from server_management.redfish import redfish_capabilities
+from server_management.redfish.redfish_capabilities import (
+    get_cached_capabilities,
+    invalidate,
+    learn_etag,
+    probe,
+)
+
+SYSTEM = {
+    "@odata.id": "/redfish/v1/Systems/1",
+    "Manufacturer": "HPE",
+    "Model": "ProLiant DL380 Gen10",
+    "Bios": {"@odata.id": "/redfish/v1/Systems/1/Bios"},
+    "Boot": {
+        "BootSourceOverrideMode": "UEFI",
+        "BootSourceOverrideTarget@Redfish.AllowableValues": ["None", "Cd", "Pxe"],
+        "BootOptions": {"@odata.id": "/redfish/v1/Systems/1/BootOptions"},
+    },
+    "Links": {"ManagedBy": [{"@odata.id": "/redfish/v1/Managers/1"}]},
+    "Actions": {
+        "#ComputerSystem.Reset": {
+            "target": "/redfish/v1/Systems/1/Actions/ComputerSystem.Reset",
+            "@Redfish.ActionInfo": "/redfish/v1/Systems/1/ResetActionInfo",
+        }
+    },
+}
+
+# Canned Redfish service of a BMC
+RESOURCES = {
+    "/redfish/v1": {"Systems": {"@odata.id": "/redfish/v1/Systems"}},
+    "/redfish/v1/Systems": {"Members": [{"@odata.id": "/redfish/v1/Systems/1"}]},
+    "/redfish/v1/Systems/1": SYSTEM,
+    "/redfish/v1/Systems/1/ResetActionInfo": {
+        "Parameters": [{"Name": "ResetType", "AllowableValues": ["On", "ForceOff"]}]
+    },
+    "/redfish/v1/Systems/1/Bios": {
+        "@Redfish.Settings": {
+            "SettingsObject": {"@odata.id": "/redfish/v1/Systems/1/Bios/Settings"}
+        }
+    },
+    "/redfish/v1/Managers/1": {
+        "FirmwareVersion": "iLO 5 v2.72",
+        "VirtualMedia": {"@odata.id": "/redfish/v1/Managers/1/VirtualMedia"},
+    },
+    "/redfish/v1/Managers/1/VirtualMedia": {
+        "Members": [
+            {"@odata.id": "/redfish/v1/Managers/1/VirtualMedia/1"},
+            {"@odata.id": "/redfish/v1/Managers/1/VirtualMedia/2"},
+        ]
+    },
+    "/redfish/v1/Managers/1/VirtualMedia/1": {
+        "@odata.id": "/redfish/v1/Managers/1/VirtualMedia/1",
+        "MediaTypes": ["Floppy", "USBStick"],
+    },
+    "/redfish/v1/Managers/1/VirtualMedia/2": {
+        "@odata.id": "/redfish/v1/Managers/1/VirtualMedia/2",
+        "MediaTypes": ["CD", "DVD"],
+        "Actions": {
+            "#VirtualMedia.InsertMedia": {
+                "target": "/redfish/v1/Managers/1/VirtualMedia/2/Actions/VirtualMedia.InsertMedia"
+            }
+        },
+    },
+}
+
+
+class FakeClient:
+    def __init__(self, host, resources=None):
+        self.host = host
+        self.resources = RESOURCES if resources is None else resources
+        self.paths = []
+
+    async def get(self, path, raise_for_status=True):
+        self.paths.append(path)
+        if path not in self.resources:
+            if raise_for_status:
+                raise Exception(f"GET {path} failed with status 404")
+            return types.SimpleNamespace(status=404, data=None)
+        return types.SimpleNamespace(status=200, data=self.resources[path])
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "redfish-capabilities.json"
+    monkeypatch.setattr(redfish_capabilities, "REDFISH_CAPABILITIES_PATH", str(path))
+    monkeypatch.setattr(redfish_capabilities, "REDFISH_CAPABILITIES_TTL", 3600)
+    redfish_capabilities._load_capabilities.cache_clear()
+    yield path
+    redfish_capabilities._load_capabilities.cache_clear()
+
+
+def _reload():
+    redfish_capabilities._load_capabilities.cache_clear()
+
+
+def test_probe(cache_path):
+    capabilities = asyncio.run(probe(FakeClient("10.0.0.1")))
+    assert capabilities["system"] == "/redfish/v1/Systems/1"
+    assert capabilities["model"] == "HPE ProLiant DL380 Gen10"
+    assert capabilities["firmware"] == "iLO 5 v2.72"
+    assert capabilities["reset"] == {
+        "target": "/redfish/v1/Systems/1/Actions/ComputerSystem.Reset",
+        "allowable_values": ["On", "ForceOff"],
+    }
+    assert capabilities["virtual_media"] == {
+        "path": "/redfish/v1/Managers/1/VirtualMedia/2",
+        "insert": "/redfish/v1/Managers/1/VirtualMedia/2/Actions/VirtualMedia.InsertMedia",
+        "eject": None,
+    }
+    assert capabilities["boot_targets"] == ["None", "Cd", "Pxe"]
+    assert capabilities["boot_mode"] is True
+    assert capabilities["boot_options"] == "/redfish/v1/Systems/1/BootOptions"
+    assert capabilities["bios"] == {
+        "path": "/redfish/v1/Systems/1/Bios",
+        "settings": "/redfish/v1/Systems/1/Bios/Settings",
+    }
+    assert capabilities["etag"] is False
+
+
+def test_probe_partial_tree(cache_path):
+    resources = dict(RESOURCES)
+    resources["/redfish/v1/Systems/1"] = {
+        "@odata.id": "/redfish/v1/Systems/1",
+        "Manufacturer": "HP",
+        "Model": "ProLiant DL360 Gen9",
+    }
+    capabilities = asyncio.run(probe(FakeClient("10.0.0.1", resources)))
+    assert capabilities["reset"] is None
+    assert capabilities["virtual_media"] is None
+    assert capabilities["bios"] is None
+    assert capabilities["boot_options"] is None
+
+
+def test_probe_without_system(cache_path):
+    resources = {"/redfish/v1": {}}
+    with pytest.raises(Exception, match="no system"):
+        asyncio.run(probe(FakeClient("10.0.0.1", resources)))
+    assert get_cached_capabilities("10.0.0.1") is None
+
+
+def test_cache_keyed_by_address(cache_path):
+    asyncio.run(probe(FakeClient("10.0.0.1")))
+    _reload()
+    assert get_cached_capabilities("10.0.0.1")["system"] == "/redfish/v1/Systems/1"
+    # Another BMC of the same model is probed on its own
+    assert get_cached_capabilities("10.0.0.2") is None
+    assert list(json.loads(cache_path.read_text())) == ["10.0.0.1"]
+
+
+def test_cache_expired(cache_path):
+    asyncio.run(probe(FakeClient("10.0.0.1")))
+    cache = json.loads(cache_path.read_text())
+    cache["10.0.0.1"]["expires"] = time.time() - 1
+    cache_path.write_text(json.dumps(cache))
+    _reload()
+    assert get_cached_capabilities("10.0.0.1") is None
+
+
+def test_cache_disabled(cache_path, monkeypatch):
+    monkeypatch.setattr(redfish_capabilities, "REDFISH_CAPABILITIES_TTL", 0)
+    asyncio.run(probe(FakeClient("10.0.0.1")))
+    assert get_cached_capabilities("10.0.0.1") is None
+    assert not cache_path.exists()
+
+
+def test_cache_corrupted(cache_path):
+    cache_path.write_text("{")
+    assert get_cached_capabilities("10.0.0.1") is None
+
+
+def test_invalidate(cache_path):
+    asyncio.run(probe(FakeClient("10.0.0.1")))
+    invalidate("10.0.0.1")
+    assert get_cached_capabilities("10.0.0.1") is None
+
+
+def test_learn_etag_saved(cache_path):
+    capabilities = asyncio.run(probe(FakeClient("10.0.0.1")))
+    learn_etag(capabilities)
+    _reload()
+    assert get_cached_capabilities("10.0.0.1")["etag"] is True
@@ -0,0 +1,91 @@
+import asyncio
+import types
+from server_management.base import task_monitor
+from server_management.base.task_monitor import TaskMonitor, _task_result
+
+
+class FakeClient:
+    """
+    Client of a BMC that returns canned task resources, one per poll.
+    """
+
+    host = "bmc"
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    async def get(self, path, raise_for_status=True):
+        return types.SimpleNamespace(data=self.responses.pop(0))
+
+
+def test_task_result_running():
+    assert _task_result({"TaskState": "Running", "Messages": []}) is None
+
+
+def test_task_result_completed():
+    task = {
+        "TaskState": "Completed",
+        "TaskStatus": "OK",
+        "Messages": [{"Message": "Started"}, {"Message": "Done"}],
+    }
+    assert _task_result(task) == {"status": True, "message": "Done"}
+
+
+def test_task_result_completed_with_warning():
+    task = {"TaskState": "Completed", "TaskStatus": "Warning", "Messages": []}
+    assert _task_result(task) == {"status": False, "message": "Completed"}
+
+
+def test_task_result_exception():
+    task = {
+        "TaskState": "Exception",
+        "TaskStatus": "Critical",
+        "Messages": [{"Message": "Image not found", "Severity": "Critical"}],
+    }
+    assert _task_result(task) == {"status": False, "message": "Image not found"}
+
+
+def test_task_result_xfusion_dict_message():
+    # xFusion BMCs return a single message, OK before the task state is updated
+    task = {
+        "TaskState": "Running",
+        "Messages": {"Message": "The virtual media is connected", "Severity": "OK"},
+    }
+    assert _task_result(task) == {
+        "status": True,
+        "message": "The virtual media is connected",
+    }
+
+
+def test_task_result_xfusion_dict_message_running():
+    task = {"TaskState": "Running", "Messages": {"Message": "Connecting"}}
+    assert _task_result(task) is None
+
+
+def test_monitor_resolves_finished_task(monkeypatch):
+    monkeypatch.setattr(task_monitor, "TASK_POLL_INTERVAL", 0)
+    client = FakeClient(
+        [
+            {"TaskState": "Running", "Messages": []},
+            {"TaskState": "Completed", "TaskStatus": "OK", "Messages": []},
+        ]
+    )
+
+    async def wait():
+        return await TaskMonitor().wait(client, "/redfish/v1/TaskService/Tasks/1")
+
+    assert asyncio.run(wait()) == {"status": True, "message": "Completed"}
+
+
+def test_monitor_times_out_with_last_message(monkeypatch):
+    monkeypatch.setattr(task_monitor, "TASK_POLL_INTERVAL", 0)
+    client = FakeClient(
+        [{"TaskState": "Running", "Messages": [{"Message": "Mounting"}]}]
+    )
+
+    async def wait():
+        return await TaskMonitor().wait(
+            client, "/redfish/v1/TaskService/Tasks/1", timeout=0
+        )
+
+    assert asyncio.run(wait()) == {"status": False, "message": "Mounting"}
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from utils import bmc_inventory
+from utils.bmc_inventory import get_inventory, set_inventory
+from utils.utils_iso_automator import _read_inventory
+
+
+class FakeServer:
+    """
+    Driver of a BMC that manages the server with the given serial number, and records the reads.
+    """
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.reads = []
+
+    async def get_serial_number(self):
+        self.reads.append("serial")
+        return self.serial
+
+    async def get_inventory(self):
+        self.reads.append("inventory")
+        return {"serial": self.serial, "model": "ProLiant DL380 Gen10"}
+
+
+@pytest.fixture(autouse=True)
+def inventory_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        bmc_inventory, "BMC_INVENTORY_PATH", str(tmp_path / "bmc-inventory.json")
+    )
+    monkeypatch.setattr(bmc_inventory, "BMC_INVENTORY_TTL", 3600)
+    monkeypatch.setattr(bmc_inventory, "BMC_INVENTORY_REFRESH", False)
+    bmc_inventory._load_inventories.cache_clear()
+    yield
+    bmc_inventory._load_inventories.cache_clear()
+
+
+def _host(server):
+    return {
+        "host": {
+            "hostname": "host-1",
+            "management": {"address": "10.0.0.1", "type": "ilo"},
+        },
+        "server": server,
+    }
+
+
+def test_read_inventory_miss():
+    server = FakeServer("CZ1")
+    assert asyncio.run(_read_inventory(_host(server)))["serial"] == "CZ1"
+    assert server.reads == ["inventory"]
+    assert get_inventory("10.0.0.1", "ilo", "host-1")["serial"] == "CZ1"
+
+
+def test_read_inventory_hit():
+    set_inventory("10.0.0.1", "ilo", "host-1", {"serial": "CZ1", "model": "cached"})
+    server = FakeServer("CZ1")
+    assert asyncio.run(_read_inventory(_host(server))) == {
+        "serial": "CZ1",
+        "model": "cached",
+    }
+    assert server.reads == ["serial"]
+
+
+def test_read_inventory_serial_mismatch():
+    set_inventory("10.0.0.1", "ilo", "host-1", {"serial": "CZ1", "model": "cached"})
+    server = FakeServer("CZ2")
+    assert asyncio.run(_read_inventory(_host(server))) == {
+        "serial": "CZ2",
+        "model": "ProLiant DL380 Gen10",
+    }
+    assert server.reads == ["serial", "inventory"]
+    assert get_inventory("10.0.0.1", "ilo", "host-1")["serial"] == "CZ2"
+
+
+def test_read_inventory_hit_bmc_down():
+    set_inventory("10.0.0.1", "ilo", "host-1", {"serial": "CZ1", "model": "cached"})
+
+    class DownServer(FakeServer):
+        async def get_serial_number(self):
+            raise Exception("Connection refused")
+
+    with pytest.raises(Exception, match="Connection refused"):
+        asyncio.run(_read_inventory(_host(DownServer("CZ1"))))